@@ -9,7 +9,11 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime, timezone
 import utils  
+import atexit
+import click
+import os
 from model.notifications import Notification
+from auditSink import audit_sink
 
 # Import blueprints
 from routes.auth import auth_bp
@@ -26,11 +30,43 @@ from routes.notifications import notifications_bp
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = db_config
+# 'rollup' reads the rate_candle table, 'sql' groups raw transactions in a single query
+app.config['EXCHANGE_HISTORY_SOURCE'] = os.getenv("EXCHANGE_HISTORY_SOURCE", "rollup")
+# most buckets per direction a history request may produce, keeps 1m/5m to short ranges
+app.config['HISTORY_MAX_BUCKETS'] = int(os.getenv("HISTORY_MAX_BUCKETS", "5000"))
+# match new offers against crossing resting offers instead of only resting them
+app.config['MATCHING_ENABLED'] = os.getenv("MATCHING_ENABLED", "false").lower() == "true"
+# 'locking' runs offer writes in the request under row locks, 'sequencer' queues them to one
+# writer thread per currency pair that group commits every SEQUENCER_COMMIT_INTERVAL seconds
+app.config['EXECUTION_MODE'] = os.getenv("EXECUTION_MODE", "locking")
+app.config['SEQUENCER_COMMIT_INTERVAL'] = float(os.getenv("SEQUENCER_COMMIT_INTERVAL", "0.005"))
+app.config['SEQUENCER_TIMEOUT_SECONDS'] = float(os.getenv("SEQUENCER_TIMEOUT_SECONDS", "10"))
+# 'pessimistic' locks offer and balance rows with SELECT ... FOR UPDATE, 'optimistic' reads them
+# unlocked and retries the command when a versioned update finds the row changed
+app.config['CONCURRENCY_MODE'] = os.getenv("CONCURRENCY_MODE", "pessimistic")
+app.config['OPTIMISTIC_MAX_RETRIES'] = int(os.getenv("OPTIMISTIC_MAX_RETRIES", "3"))
+# seconds between writes of the background notification flusher (notificationOutbox.notify_async)
+app.config['NOTIFICATION_FLUSH_INTERVAL'] = float(os.getenv("NOTIFICATION_FLUSH_INTERVAL", "1.0"))
+# read notifications older than this many days are deleted by the retention job, in batches
+app.config['NOTIFICATION_RETENTION_DAYS'] = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+app.config['NOTIFICATION_PRUNE_BATCH_SIZE'] = int(os.getenv("NOTIFICATION_PRUNE_BATCH_SIZE", "1000"))
+# seconds between writes of buffered transactions into the rate_candle rollups
+app.config['CANDLE_FLUSH_SECONDS'] = float(os.getenv("CANDLE_FLUSH_SECONDS", "2"))
+# 'async' queues audit logs for a background writer, 'sync' writes each one immediately (tests)
+app.config['AUDIT_SINK_MODE'] = os.getenv("AUDIT_SINK_MODE", "async")
+app.config['AUDIT_QUEUE_SIZE'] = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+app.config['AUDIT_MAX_BATCH'] = int(os.getenv("AUDIT_MAX_BATCH", "500"))
+app.config['AUDIT_FLUSH_INTERVAL'] = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+app.config['AUDIT_MAX_RETRIES'] = int(os.getenv("AUDIT_MAX_RETRIES", "5"))
+# audit_log keeps this many full months plus the current one, older months go to gzip files
+app.config['AUDIT_RETENTION_MONTHS'] = int(os.getenv("AUDIT_RETENTION_MONTHS", "6"))
+app.config['AUDIT_ARCHIVE_DIR'] = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
 CORS(app)
 
 db.init_app(app)
 ma.init_app(app)
 bcrypt.init_app(app)
+audit_sink.init_app(app)
 
 limiter = Limiter(app=app, key_func=get_remote_address)
 
@@ -47,6 +83,68 @@ app.register_blueprint(admin_bp)
 app.register_blueprint(logs_bp)
 app.register_blueprint(notifications_bp)
 
+# Bring an existing database up to the current models (new tables, columns and indexes), safe to rerun: flask upgrade-db
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    from schemaUpgrade import upgrade_schema
+    added = upgrade_schema()
+    for name in added:
+        click.echo(f"added {name}")
+    click.echo(f"Schema up to date, {len(added)} changes")
+
+
+# Rebuild the rate_candle rollups from existing transactions: flask backfill-candles [--start YYYY-MM-DD]
+@app.cli.command("backfill-candles")
+@click.option("--start", default=None, help="Only rebuild buckets from this date (YYYY-MM-DD)")
+def backfill_candles_command(start):
+    from candles import backfill_candles
+    from model.rateCandle import RateCandle
+    RateCandle.__table__.create(db.engine, checkfirst=True)
+    start_time = datetime.fromisoformat(start) if start else None
+    written = backfill_candles(start_time)
+    click.echo(f"Wrote {written} candles")
+
+
+# Opening ledger entries for balances that predate the ledger: flask open-ledger
+@app.cli.command("open-ledger")
+def open_ledger_command():
+    import ledger
+    from model.ledgerEntry import LedgerEntry
+    from model.balanceSnapshot import BalanceSnapshot
+    LedgerEntry.__table__.create(db.engine, checkfirst=True)
+    BalanceSnapshot.__table__.create(db.engine, checkfirst=True)
+    opened = ledger.open_balances()
+    db.session.commit()
+    click.echo(f"Opened ledger for {opened} users")
+
+
+# Check every user_balance against trades and open offers: flask reconcile-balances
+@app.cli.command("reconcile-balances")
+@click.option("--chunk-size", default=100000, help="Rows read per query")
+def reconcile_balances_command(chunk_size):
+    from reconcile import reconcile
+    report = reconcile(chunk_size)
+    click.echo(f"Checked {report['users_checked']} users, {report['discrepancy_count']} discrepancies")
+    for d in report["discrepancies"]:
+        click.echo(f"user {d['user_id']} {d['currency']}: expected {d['expected']} actual {d['actual']} ({d['difference']:+})")
+
+
+# Move audit_log months past the retention window into compressed files: flask archive-audit-logs
+@app.cli.command("archive-audit-logs")
+@click.option("--retention-months", default=None, type=int, help="Full months to keep in the table")
+def archive_audit_logs_command(retention_months):
+    from auditArchiver import archive_old_months
+    from model.auditArchive import AuditArchive, AuditArchiveLock
+    AuditArchive.__table__.create(db.engine, checkfirst=True)
+    AuditArchiveLock.__table__.create(db.engine, checkfirst=True)
+    if retention_months is None:
+        retention_months = app.config['AUDIT_RETENTION_MONTHS']
+    archives = archive_old_months(app.config['AUDIT_ARCHIVE_DIR'], retention_months)
+    for archive in archives:
+        click.echo(f"{archive.month}: {archive.row_count} rows -> {archive.path}")
+    click.echo(f"Wrote {len(archives)} archives")
+
+
 # Alert checking function
 def check_alerts():
     with app.app_context(): #This ensures the scheduler can access the database session and models properly
@@ -66,11 +164,121 @@ def check_alerts():
                 # Store notification in db
                 message = f"Alert triggered: {alert.direction} rate {current_rate} {alert.condition} {alert.threshold_rate}"
                 utils.create_notification(alert.user_id, message, 'alert')
+        # triggered flags and their notifications in one commit
         db.session.commit()
 
 # Set up scheduler
 scheduler = BackgroundScheduler()
 scheduler.add_job(check_alerts, IntervalTrigger(seconds=60))  # Check every minute
+
+# Fold committed transactions into the rate_candle rollups, one short commit per run
+def flush_candles():
+    with app.app_context():
+        from candles import candle_buffer
+        try:
+            candle_buffer.flush()
+        except Exception as e:
+            print(f"error occured {str(e)}")
+
+scheduler.add_job(flush_candles, IntervalTrigger(seconds=app.config['CANDLE_FLUSH_SECONDS']))
+# and whatever is still buffered when the worker exits
+atexit.register(flush_candles)
+
+# Resync the rolling rate window from the db, picks up transactions written by other workers
+def resync_rate_engine():
+    with app.app_context():
+        from rateEngine import rate_engine
+        rate_engine.rebuild()
+
+scheduler.add_job(resync_rate_engine, IntervalTrigger(minutes=5))
+
+# Reload the order book from the db, picks up offers changed by other workers
+def resync_order_book():
+    with app.app_context():
+        from orderBook import order_book
+        order_book.load()
+
+scheduler.add_job(resync_order_book, IntervalTrigger(minutes=1))
+
+# Roll ledger entries into balance snapshots so balance reads only sum recent entries
+def compact_ledger():
+    with app.app_context():
+        import ledger
+        try:
+            ledger.compact()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"error occured {str(e)}")
+
+scheduler.add_job(compact_ledger, IntervalTrigger(minutes=10))
+
+# Hourly balance reconciliation, only reports
+def reconcile_balances():
+    with app.app_context():
+        from reconcile import reconcile
+        try:
+            report = reconcile()
+            if report["discrepancy_count"]:
+                print(f"reconciliation found {report['discrepancy_count']} balance discrepancies: {report['discrepancies'][:10]}")
+        except Exception as e:
+            print(f"error occured {str(e)}")
+        finally:
+            db.session.rollback()
+
+scheduler.add_job(reconcile_balances, IntervalTrigger(hours=1))
+
+# Expire GTD offers past their expires_at: bulk refund, one notification per user, one commit per batch
+def expire_offers():
+    with app.app_context():
+        from trading import expire_due_offers
+        from orderBook import order_book
+        try:
+            while True:
+                released = expire_due_offers()
+                if not released:
+                    break
+                expired_by_user = {}
+                for row in released:
+                    expired_by_user.setdefault(row.user_id, []).append(f"#{row.id}")
+                for user_id, ids in expired_by_user.items():
+                    utils.create_notification(user_id, f"Your offer(s) {', '.join(ids)} expired and the remaining amounts were refunded.", 'offer')
+                # the queued notifications go in with the refunds as one insert
+                db.session.commit()
+                order_book.discard(released)
+        except Exception as e:
+            db.session.rollback()
+            print(f"error occured {str(e)}")
+
+scheduler.add_job(expire_offers, IntervalTrigger(seconds=30))
+
+# Retention: delete old read notifications, one short commit per batch
+def prune_notifications():
+    with app.app_context():
+        from notificationOutbox import prune_read_notifications
+        try:
+            while prune_read_notifications(
+                app.config['NOTIFICATION_RETENTION_DAYS'],
+                app.config['NOTIFICATION_PRUNE_BATCH_SIZE']
+            ):
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"error occured {str(e)}")
+
+scheduler.add_job(prune_notifications, IntervalTrigger(hours=1))
+
+# Archive audit_log months older than the retention window, deletes in batches after each file is written
+def archive_audit_logs():
+    with app.app_context():
+        from auditArchiver import archive_old_months
+        try:
+            archive_old_months(app.config['AUDIT_ARCHIVE_DIR'], app.config['AUDIT_RETENTION_MONTHS'])
+        except Exception as e:
+            db.session.rollback()
+            print(f"error occured {str(e)}")
+
+scheduler.add_job(archive_audit_logs, IntervalTrigger(hours=24))
 scheduler.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+import gzip
+import json
+import os
+import tempfile
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from model.audit_log import AuditLog
+from model.auditArchive import AuditArchive, AuditArchiveLock
+
+#audit_log is split into monthly ranges of timestamp (a rolling scheme, no database partitioning
+#so it works the same on mysql and sqlite). Months older than the retention window are moved out
+#of the table into one gzip NDJSON file each and can still be read back on demand
+
+CHUNK_SIZE = 5000
+
+
+def month_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def previous_month(start):
+    return month_start(start - timedelta(days=1))
+
+
+def month_range(month):
+    """
+    (start, end) datetimes of a 'YYYY-MM' month, end exclusive. Raises ValueError if malformed.
+    """
+    start = datetime.strptime(month, "%Y-%m")
+    return start, next_month(start)
+
+
+def _row_json(log):
+    return json.dumps({
+        "id": log.id,
+        "user_id": log.user_id,
+        "action_type": log.action_type.value,
+        "entity_type": log.entity_type,
+        "entity_id": log.entity_id,
+        "description": log.description,
+        "ip_address": log.ip_address,
+        "timestamp": log.timestamp.isoformat()
+    })
+
+
+@contextmanager
+def _run_lock():
+    """
+    Row lock on the marker row, held on its own connection for the whole run.
+    Yields False when another run already holds it.
+    """
+    table = AuditArchiveLock.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.insert(), {"id": 1})
+    except IntegrityError:
+        # already there
+        pass
+    with db.engine.connect() as conn:
+        with conn.begin():
+            locked = conn.execute(
+                select(table.c.id).where(table.c.id == 1).with_for_update(skip_locked=True)
+            ).first()
+            yield locked is not None
+
+
+def _month_rows(start, end, chunk_size):
+    # keyset walk over ix_audit_log_timestamp, one chunk in memory at a time
+    last = None
+    while True:
+        # plain rows, not ORM objects, so nothing piles up in the session
+        query = db.session.query(
+            AuditLog.id,
+            AuditLog.user_id,
+            AuditLog.action_type,
+            AuditLog.entity_type,
+            AuditLog.entity_id,
+            AuditLog.description,
+            AuditLog.ip_address,
+            AuditLog.timestamp
+        ).filter(
+            AuditLog.timestamp >= start,
+            AuditLog.timestamp < end
+        )
+        if last is not None:
+            query = query.filter(or_(
+                AuditLog.timestamp > last.timestamp,
+                and_(AuditLog.timestamp == last.timestamp, AuditLog.id > last.id)
+            ))
+        chunk = query.order_by(AuditLog.timestamp, AuditLog.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield from chunk
+        last = chunk[-1]
+
+
+def _delete_archived(ids, chunk_size):
+    # only the ids that are in a file, bounded deletes with one commit each so the table
+    # is never locked for the whole month
+    deleted = 0
+    for i in range(0, len(ids), chunk_size):
+        deleted += AuditLog.query.filter(AuditLog.id.in_(ids[i:i + chunk_size].tolist())).delete(synchronize_session=False)
+        db.session.commit()
+    return deleted
+
+
+def _archived_ids(month):
+    # ids written by earlier runs of the month, read back from their files
+    ids = array("q")
+    for archive in AuditArchive.query.filter(AuditArchive.month == month):
+        ids.extend(row["id"] for row in read_archive(archive.path))
+    return ids
+
+
+def archive_month(start, archive_dir, chunk_size=CHUNK_SIZE):
+    """
+    Move the audit_log rows of the month starting at start into a new archive file.
+    Rows already in an earlier archive of the month (left behind by an interrupted run)
+    are only deleted. Returns the AuditArchive written, or None if there was nothing new.
+    Callers serialize runs, see archive_old_months.
+    """
+    end = next_month(start)
+    month = start.strftime("%Y-%m")
+    _delete_archived(_archived_ids(month), chunk_size)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    written = array("q")
+    # unique temp name, a leftover from a crashed run is never reused
+    fd, tmp_path = tempfile.mkstemp(prefix=f"audit_log-{month}-", suffix=".ndjson.gz.tmp", dir=archive_dir)
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            for log in _month_rows(start, end, chunk_size):
+                f.write(_row_json(log) + "\n")
+                written.append(log.id)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if not written:
+        os.remove(tmp_path)
+        return None
+    row_count, first_id, last_id = len(written), min(written), max(written)
+
+    # one file per run of the month, named after its first id
+    path = os.path.join(archive_dir, f"audit_log-{month}-{first_id}.ndjson.gz")
+    os.replace(tmp_path, path)
+    archive = AuditArchive(
+        month=month,
+        path=path,
+        row_count=row_count,
+        first_id=first_id,
+        last_id=last_id
+    )
+    db.session.add(archive)
+    db.session.commit()
+
+    # the file is recorded before anything is deleted, and only what it holds is deleted
+    _delete_archived(written, chunk_size)
+    return archive
+
+
+def archive_old_months(archive_dir, retention_months, now=None, chunk_size=CHUNK_SIZE):
+    """
+    Archive every month that ended more than retention_months months ago. Returns the archives written.
+    Only one run at a time, across workers: a run that finds another in progress writes nothing.
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = month_start(now)
+    for _ in range(retention_months):
+        cutoff = previous_month(cutoff)
+    archives = []
+    with _run_lock() as locked:
+        if not locked:
+            print("audit archive already running, skipped")
+            return archives
+        oldest = db.session.query(func.min(AuditLog.timestamp)).scalar()
+        if oldest is None:
+            return archives
+        start = month_start(oldest)
+        while start < cutoff:
+            archive = archive_month(start, archive_dir, chunk_size)
+            if archive is not None:
+                archives.append(archive)
+            start = next_month(start)
+    return archives
+
+
+def read_archive(path, user_id=None, action_type=None, start=None, end=None):
+    """
+    Stream rows of one archive file as dicts, optionally filtered, without loading the file.
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if user_id is not None and row["user_id"] != user_id:
+                continue
+            if action_type is not None and row["action_type"] != action_type:
+                continue
+            if start is not None or end is not None:
+                timestamp = datetime.fromisoformat(row["timestamp"]).replace(tzinfo=None)
+                if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                    continue
+            yield row
+
+
+def archived_logs(start, end, user_id=None, action_type=None):
+    """
+    Stream archived rows with start <= timestamp < end across every archive file of those months.
+    """
+    months = []
+    month = month_start(start)
+    while month < end:
+        months.append(month.strftime("%Y-%m"))
+        month = next_month(month)
+    paths = [a.path for a in AuditArchive.query.filter(
+        AuditArchive.month.in_(months)
+    ).order_by(AuditArchive.month, AuditArchive.first_id)]
+    for path in paths:
+        yield from read_archive(path, user_id, action_type, start, end)
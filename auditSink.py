@@ -0,0 +1,226 @@
+import atexit
+from datetime import datetime, timezone
+import queue
+import threading
+import time
+from extensions import db
+from model.audit_log import AuditLog
+
+#audit records are queued here and written by a background thread with bulk inserts,
+#so logins and trades don't pay for an extra commit
+
+
+class AuditSink:
+    """
+    Bounded in-process queue of audit rows. The writer thread flushes a batch when it reaches
+    max_batch rows or flush_interval seconds after its first row, on its own connection.
+    When the queue is full the producer writes its row itself (backpressure). A batch whose
+    insert fails is retried with backoff, it is only counted as failed after max_retries attempts.
+    In "sync" mode every row is written immediately, for tests and scripts.
+    """
+
+    def __init__(self, mode="async", max_queue=10000, max_batch=500, flush_interval=1.0, max_retries=5):
+        self.app = None
+        self.mode = mode
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._retry = []
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.full = 0
+        self.failed = 0
+        self.high_water = 0
+        self.last_flush_ms = None
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get("AUDIT_SINK_MODE", self.mode)
+        self.max_batch = app.config.get("AUDIT_MAX_BATCH", self.max_batch)
+        self.flush_interval = app.config.get("AUDIT_FLUSH_INTERVAL", self.flush_interval)
+        self.max_retries = app.config.get("AUDIT_MAX_RETRIES", self.max_retries)
+        self.queue = queue.Queue(maxsize=app.config.get("AUDIT_QUEUE_SIZE", self.queue.maxsize))
+        # write whatever is still queued when the worker exits
+        atexit.register(self.close)
+
+    def emit(self, action_type, description, user_id=None, entity_type=None, entity_id=None, ip_address=None):
+        self.emit_many([{
+            "action_type": action_type,
+            "description": description,
+            "user_id": user_id,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "ip_address": ip_address
+        }])
+
+    def emit_many(self, entries):
+        """
+        Queue audit rows, entries are dicts with the emit arguments.
+        """
+        rows = [{
+            "action_type": entry["action_type"],
+            "description": entry["description"],
+            "user_id": entry.get("user_id"),
+            "entity_type": entry.get("entity_type"),
+            "entity_id": entry.get("entity_id"),
+            "ip_address": entry.get("ip_address"),
+            # stamped when the event happens, not when the batch is written
+            "timestamp": datetime.now(timezone.utc)
+        } for entry in entries]
+        if not rows:
+            return
+        if self.mode == "sync":
+            self._retry_due()
+            self._store(rows)
+            return
+
+        self._ensure_started()
+        overflow = []
+        enqueued = 0
+        for row in rows:
+            try:
+                self.queue.put_nowait(row)
+                enqueued += 1
+            except queue.Full:
+                overflow.append(row)
+        with self._lock:
+            self.enqueued += enqueued
+            self.high_water = max(self.high_water, self.queue.qsize())
+            self.full += len(overflow)
+        if overflow:
+            self._store(overflow)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="audit-sink", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        # wait for a first row, then collect until max_batch or flush_interval after it
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._retry_due()
+            batch = self._next_batch()
+            if batch:
+                self._store(batch)
+
+    def _store(self, rows):
+        # a batch that can't be written goes to the retry buffer, it is not dropped
+        if not self._write(rows):
+            with self._lock:
+                self._retry.append((rows, 1, time.monotonic() + self.flush_interval))
+            # the writer retries it, unless it is being shut down (close retries then)
+            if self.mode != "sync" and not self._stopping.is_set():
+                self._ensure_started()
+
+    def _retry_due(self, force=False):
+        """
+        Retry the failed batches whose backoff has passed (all of them when force is set).
+        A batch is counted as failed and given up after max_retries attempts.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [entry for entry in self._retry if force or entry[2] <= now]
+            self._retry = [entry for entry in self._retry if not (force or entry[2] <= now)]
+        for rows, attempts, _ in due:
+            if self._write(rows):
+                continue
+            if attempts >= self.max_retries:
+                with self._lock:
+                    self.failed += len(rows)
+                print(f"audit sink gave up on {len(rows)} rows after {attempts} attempts")
+                continue
+            backoff = min(self.flush_interval * 2 ** attempts, 60)
+            with self._lock:
+                self._retry.append((rows, attempts + 1, time.monotonic() + backoff))
+
+    def _write(self, rows):
+        started = time.monotonic()
+        try:
+            with self.app.app_context():
+                # own connection and transaction, never the caller's session
+                with db.engine.begin() as conn:
+                    conn.execute(AuditLog.__table__.insert(), rows)
+        except Exception as e:
+            print(f"error occured {str(e)}")
+            return False
+        with self._lock:
+            self.written += len(rows)
+            self.batches += 1
+            self.last_flush_ms = round((time.monotonic() - started) * 1000, 3)
+        return True
+
+    def flush(self):
+        """
+        Write everything queued right now from the calling thread. Returns the rows taken off the queue.
+        """
+        rows = []
+        try:
+            while True:
+                rows.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        for i in range(0, len(rows), self.max_batch):
+            self._store(rows[i:i + self.max_batch])
+        return len(rows)
+
+    def close(self, timeout=5):
+        # stop the writer, then drain what it left behind and retry failed batches until they run out
+        self._stopping.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        if self.app is None:
+            return
+        self.flush()
+        for attempt in range(self.max_retries):
+            if not self._retry:
+                break
+            if attempt:
+                time.sleep(self.flush_interval)
+            self._retry_due(force=True)
+        with self._lock:
+            lost, self._retry = self._retry, []
+            self.failed += sum(len(rows) for rows, _, _ in lost)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "queued": self.queue.qsize(),
+                "max_queue": self.queue.maxsize,
+                "high_water": self.high_water,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "full": self.full,
+                "retrying": sum(len(rows) for rows, _, _ in self._retry),
+                "failed": self.failed,
+                "last_flush_ms": self.last_flush_ms,
+            }
+
+
+audit_sink = AuditSink()
@@ -0,0 +1,98 @@
+"""
+Throughput benchmark for the matching engine.
+
+Runs the pure matcher on in-memory orders, then the full match + settle path
+against SQLite, and prints matches per second for both.
+
+    python benchmarks/matching_benchmark.py [--resting 2000] [--incoming 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from extensions import db, ma, bcrypt
+import matching
+
+
+def bench_pure(resting_count, incoming_count, seed):
+    rng = random.Random(seed)
+    now = datetime(2025, 1, 1)
+    resting = [
+        matching.RestingOrder(i, i % 50 + 1, "LBP", rng.uniform(88000, 90000), rng.uniform(1e6, 5e6), now + timedelta(seconds=i))
+        for i in range(resting_count)
+    ]
+    fills_total = 0
+    started = time.perf_counter()
+    for i in range(incoming_count):
+        fills, _ = matching.match_order(10_000 + i, "USD", rng.uniform(10, 200), rng.uniform(88000, 90000), resting)
+        fills_total += len(fills)
+    elapsed = time.perf_counter() - started
+    return fills_total, elapsed
+
+
+def bench_sqlite(resting_count, incoming_count, seed):
+    from model.user import User
+    from model.userBalance import UserBalance
+    from model.offer import Offer
+    import model.trade, model.transaction, model.rateCandle  # noqa: F401 register tables
+    from trading import match_incoming_offer, lock_for_incoming
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    ma.init_app(app)
+    bcrypt.init_app(app)
+    rng = random.Random(seed)
+
+    with app.app_context():
+        db.create_all()
+        makers = [User(f"maker{i}", "pw") for i in range(50)]
+        takers = [User(f"taker{i}", "pw") for i in range(50)]
+        db.session.add_all(makers + takers)
+        db.session.flush()
+        for u in makers + takers:
+            db.session.add(UserBalance(u.id, usd_amount=1e9, lbp_amount=1e14))
+        for i in range(resting_count):
+            maker = makers[i % len(makers)]
+            db.session.add(Offer(maker.id, "LBP", "USD", rng.uniform(1e6, 5e6), rng.uniform(88000, 90000)))
+        db.session.commit()
+
+        fills_total = 0
+        started = time.perf_counter()
+        for i in range(incoming_count):
+            taker = takers[i % len(takers)]
+            amount = rng.uniform(10, 200)
+            price = rng.uniform(88000, 90000)
+            resting, balances = lock_for_incoming(taker.id, "USD", "LBP", amount, price)
+            balance = balances[taker.id]
+            balance.usd_amount -= amount
+            offer = Offer(taker.id, "USD", "LBP", amount, price)
+            db.session.add(offer)
+            db.session.flush()
+            fills_total += len(match_incoming_offer(offer, balance, resting, balances))
+            db.session.commit()
+        elapsed = time.perf_counter() - started
+    return fills_total, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resting", type=int, default=2000)
+    parser.add_argument("--incoming", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for name, bench in (("pure matcher", bench_pure), ("match + settle on sqlite", bench_sqlite)):
+        fills, elapsed = bench(args.resting, args.incoming, args.seed)
+        print(f"{name}: {args.incoming} orders, {fills} matches in {elapsed:.3f}s "
+              f"-> {fills / elapsed:,.0f} matches/sec, {args.incoming / elapsed:,.0f} orders/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import json
+import queue
+import threading
+
+
+class Broadcaster:
+    """
+    In-process fan-out for server-sent events. Producers publish once, every
+    subscriber of the topic gets the event on its own bounded queue.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic=None):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(q)
+        return q
+
+    def unsubscribe(self, q, topic=None):
+        with self._lock:
+            subscribers = self._subscribers.get(topic)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def publish(self, event, data, topic=None):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # slow client: drop its oldest event rather than block the publisher
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+                try:
+                    q.put_nowait((event, data))
+                except queue.Full:
+                    pass
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def stream_events(q, keepalive_seconds=15):
+    """
+    Generator of SSE frames read from a subscriber queue, with keep-alive comments while idle.
+    """
+    while True:
+        try:
+            event, data = q.get(timeout=keepalive_seconds)
+        except queue.Empty:
+            yield ": keep-alive\n\n"
+            continue
+        yield format_sse(event, data)
+
+
+# live rates and trade prints
+market_broadcaster = Broadcaster()
+
+# per-user notification wake-ups, the topic is the user id
+notification_broadcaster = Broadcaster(max_queue=10)
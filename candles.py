@@ -0,0 +1,337 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import numpy as np
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from model.rateCandle import RateCandle
+from model.transaction import Transaction
+
+# rollup granularities kept in the rate_candle table, with their length in seconds
+CANDLE_INTERVALS = ("minute", "hour", "day")
+CANDLE_SECONDS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# history interval -> (finest stored rollup it is composed from, bucket length in seconds)
+HISTORY_INTERVALS = {
+    "1m": ("minute", 60),
+    "5m": ("minute", 5 * 60),
+    "15m": ("minute", 15 * 60),
+    "hourly": ("hour", 3600),
+    "1h": ("hour", 3600),
+    "4h": ("hour", 4 * 3600),
+    "daily": ("day", 86400),
+    "1d": ("day", 86400),
+    "weekly": ("day", 7 * 86400),
+    "1w": ("day", 7 * 86400),
+}
+# weekly buckets start on monday, 1970-01-05 is the first monday after the epoch
+WEEK_OFFSET_SECONDS = 4 * 86400
+
+
+def _naive_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_start(added_date, interval):
+    added_date = _naive_utc(added_date)
+    if interval == "minute":
+        return added_date.replace(second=0, microsecond=0)
+    if interval == "hour":
+        return added_date.replace(minute=0, second=0, microsecond=0)
+    return added_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _merge_into_candle(candle, rate, lbp_amount, usd_amount, added_date):
+    # folds one transaction into an existing candle
+    candle.weighted_sum += lbp_amount
+    candle.volume += usd_amount
+    candle.count += 1
+    candle.high_rate = max(candle.high_rate, rate)
+    candle.low_rate = min(candle.low_rate, rate)
+    if added_date < candle.first_at:
+        candle.first_at = added_date
+        candle.open_rate = rate
+    if added_date >= candle.last_at:
+        candle.last_at = added_date
+        candle.close_rate = rate
+
+
+class CandleBuffer:
+    """
+    Committed transactions waiting to be folded into rate_candle, already aggregated per
+    bucket. flush() applies each bucket with one atomic UPDATE in its own short transaction,
+    so trades never lock the hot current minute/hour/day rows. Whatever a crash loses before
+    a flush is restored by backfill_candles.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, added_date, usd_amount, lbp_amount, usd_to_lbp):
+        if not usd_amount:
+            return
+        added_date = _naive_utc(added_date)
+        rate = lbp_amount / usd_amount
+        with self._lock:
+            for interval in CANDLE_INTERVALS:
+                key = (interval, bucket_start(added_date, interval), bool(usd_to_lbp))
+                candle = self._pending.get(key)
+                if candle is None:
+                    # transient, only added to the session if the bucket doesn't exist yet
+                    candle = self._pending[key] = RateCandle(interval, key[1], key[2], rate, added_date)
+                _merge_into_candle(candle, rate, lbp_amount, usd_amount, added_date)
+
+    def _requeue(self, pending):
+        # a failed flush is merged back so the next one retries it
+        with self._lock:
+            for key, candle in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = candle
+                    continue
+                current.weighted_sum += candle.weighted_sum
+                current.volume += candle.volume
+                current.count += candle.count
+                current.high_rate = max(current.high_rate, candle.high_rate)
+                current.low_rate = min(current.low_rate, candle.low_rate)
+                if candle.first_at < current.first_at:
+                    current.first_at, current.open_rate = candle.first_at, candle.open_rate
+                if candle.last_at >= current.last_at:
+                    current.last_at, current.close_rate = candle.last_at, candle.close_rate
+
+    def flush(self):
+        """
+        Apply the buffered buckets and commit. Returns the number of buckets written.
+        Cached history is dropped once they are in, it may have been computed before them.
+        """
+        from rateCache import rate_cache
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            for candle in pending.values():
+                _apply_to_stored_candle(candle)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._requeue(pending)
+            raise
+        # the commit time invalidation in record_committed_transaction came before the rollups
+        rate_cache.invalidate()
+        return len(pending)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+
+def _apply_to_stored_candle(candle):
+    # atomic read-modify-write, no locking read first. open/close come before first_at/last_at
+    # because mysql evaluates SET assignments left to right with the updated values
+    c = RateCandle.__table__.c
+    earlier = c.first_at > candle.first_at
+    later = c.last_at <= candle.last_at
+    updated = db.session.execute(
+        RateCandle.__table__.update().where(
+            c.interval == candle.interval,
+            c.usd_to_lbp == candle.usd_to_lbp,
+            c.bucket_start == candle.bucket_start
+        ).ordered_values(
+            (c.weighted_sum, c.weighted_sum + candle.weighted_sum),
+            (c.volume, c.volume + candle.volume),
+            (c.count, c.count + candle.count),
+            (c.high_rate, case((c.high_rate < candle.high_rate, candle.high_rate), else_=c.high_rate)),
+            (c.low_rate, case((c.low_rate > candle.low_rate, candle.low_rate), else_=c.low_rate)),
+            (c.open_rate, case((earlier, candle.open_rate), else_=c.open_rate)),
+            (c.close_rate, case((later, candle.close_rate), else_=c.close_rate)),
+            (c.first_at, case((earlier, candle.first_at), else_=c.first_at)),
+            (c.last_at, case((later, candle.last_at), else_=c.last_at)),
+        )
+    ).rowcount
+    if updated:
+        return
+    # first transaction of the bucket. another worker may insert it concurrently,
+    # the savepoint keeps our transaction alive and the update is retried
+    try:
+        with db.session.begin_nested():
+            db.session.add(candle)
+    except IntegrityError:
+        db.session.expunge(candle)
+        _apply_to_stored_candle(candle)
+
+
+def record_transaction_in_candles(transaction):
+    """
+    Call after a Transaction has been committed, the rollups are updated by the next flush.
+    """
+    candle_buffer.add(transaction.added_date, transaction.usd_amount, transaction.lbp_amount, transaction.usd_to_lbp)
+
+
+def backfill_candles(start=None, chunk_size=10000):
+    """
+    Rebuild rollups from the transaction table, streaming rows in chunks ordered by time.
+    Existing candles at or after start are replaced. Returns the number of candles written.
+    Transactions still buffered by a worker are added again on its next flush, so run it while
+    trading is quiet or rebuild from a start before the last few seconds.
+    """
+    query = RateCandle.query
+    if start:
+        start = _naive_utc(start)
+        # align to the day so daily candles are rebuilt whole
+        start = bucket_start(start, "day")
+        query = query.filter(RateCandle.bucket_start >= start)
+    query.delete(synchronize_session=False)
+
+    rows = db.session.query(
+        Transaction.added_date,
+        Transaction.usd_amount,
+        Transaction.lbp_amount,
+        Transaction.usd_to_lbp
+    ).order_by(Transaction.added_date, Transaction.id)
+    if start:
+        rows = rows.filter(Transaction.added_date >= start)
+
+    candles = {}
+    for added_date, usd_amount, lbp_amount, usd_to_lbp in rows.yield_per(chunk_size):
+        if not usd_amount:
+            continue
+        added_date = _naive_utc(added_date)
+        rate = lbp_amount / usd_amount
+        for interval in CANDLE_INTERVALS:
+            key = (interval, bucket_start(added_date, interval), bool(usd_to_lbp))
+            candle = candles.get(key)
+            if candle is None:
+                candle = candles[key] = RateCandle(interval, key[1], key[2], rate, added_date)
+            _merge_into_candle(candle, rate, lbp_amount, usd_amount, added_date)
+
+    db.session.add_all(candles.values())
+    db.session.commit()
+    return len(candles)
+
+
+def get_candles(start_time, end_time, interval):
+    """
+    Rollup rows for both directions in [start_time, end_time + 1 day), ordered by bucket.
+    Returns (usd_to_lbp_candles, lbp_to_usd_candles).
+    """
+    # adding a day to support same day ops, same as get_transactions_by_date
+    end_time = end_time + timedelta(days=1)
+    candles = RateCandle.query.filter(
+        RateCandle.interval == interval,
+        RateCandle.bucket_start >= bucket_start(start_time, interval),
+        RateCandle.bucket_start < _naive_utc(end_time)
+    ).order_by(RateCandle.bucket_start).all()
+    usd_candles = [c for c in candles if c.usd_to_lbp]
+    lbp_candles = [c for c in candles if not c.usd_to_lbp]
+    return usd_candles, lbp_candles
+
+
+def candle_timestamps_and_rates(candles, interval):
+    # same timestamp format the raw bucketing returned: datetime for hourly, date for daily
+    timestamps = [
+        str(c.bucket_start) if interval != "day" else str(c.bucket_start.date())
+        for c in candles
+    ]
+    rates = [c.rate for c in candles]
+    return timestamps, rates
+
+
+def merge_candles(candles, seconds, offset=0):
+    """
+    Merge sorted rollup rows into coarser buckets of the given length in seconds.
+    offset shifts the bucket grid, e.g. WEEK_OFFSET_SECONDS for monday aligned weeks.
+    Returns a dict of arrays: bucket_start (datetime64), weighted_sum, volume, count,
+    open, high, low, close.
+    """
+    if not candles:
+        empty = np.empty(0)
+        return {
+            "bucket_start": np.empty(0, dtype="datetime64[s]"), "weighted_sum": empty, "volume": empty,
+            "count": np.empty(0, dtype=int), "open": empty, "high": empty, "low": empty, "close": empty
+        }
+
+    starts = np.array([c.bucket_start for c in candles], dtype="datetime64[s]").astype("int64")
+    keys = (starts - offset) // seconds
+    # candles come sorted by bucket_start so equal keys are contiguous
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    last = np.r_[first[1:], len(keys)] - 1
+
+    def column(name, dtype=float):
+        return np.array([getattr(c, name) for c in candles], dtype=dtype)
+
+    return {
+        "bucket_start": (keys[first] * seconds + offset).astype("datetime64[s]"),
+        "weighted_sum": np.add.reduceat(column("weighted_sum"), first),
+        "volume": np.add.reduceat(column("volume"), first),
+        "count": np.add.reduceat(column("count", int), first),
+        "open": column("open_rate")[first],
+        "high": np.maximum.reduceat(column("high_rate"), first),
+        "low": np.minimum.reduceat(column("low_rate"), first),
+        "close": column("close_rate")[last],
+    }
+
+
+def _grid_offset(seconds):
+    # weekly buckets are monday aligned, the rest start on the epoch
+    return WEEK_OFFSET_SECONDS if seconds % (7 * 86400) == 0 else 0
+
+
+def history_buckets(start_time, end_time, interval):
+    """
+    Buckets per direction a history request of interval over the range can produce: the range
+    get_candles reads, [bucket_start(start), end + 1 day), counted on the grid merge_candles uses.
+    """
+    base, seconds = HISTORY_INTERVALS[interval]
+    epoch = datetime(1970, 1, 1)
+    start = int((bucket_start(start_time, base) - epoch).total_seconds())
+    end = int((_naive_utc(end_time) + timedelta(days=1) - epoch).total_seconds())
+    if end <= start:
+        return 0
+    offset = _grid_offset(seconds)
+    return (end - 1 - offset) // seconds - (start - offset) // seconds + 1
+
+
+def finest_interval(start_time, end_time, max_buckets):
+    """
+    Finest history interval that covers the range in at most max_buckets buckets, the coarsest if none does.
+    """
+    by_length = sorted(HISTORY_INTERVALS, key=lambda name: HISTORY_INTERVALS[name][1])
+    for interval in by_length:
+        if history_buckets(start_time, end_time, interval) <= max_buckets:
+            return interval
+    return by_length[-1]
+
+
+def get_history_series(start_time, end_time, interval):
+    """
+    Rates per bucket for any interval in HISTORY_INTERVALS, composed from the finest
+    stored rollup. Returns ((usd_timestamps, usd_rates), (lbp_timestamps, lbp_rates)).
+    """
+    base, seconds = HISTORY_INTERVALS[interval]
+    usd_candles, lbp_candles = get_candles(start_time, end_time, base)
+    if seconds == CANDLE_SECONDS[base]:
+        return (
+            candle_timestamps_and_rates(usd_candles, base),
+            candle_timestamps_and_rates(lbp_candles, base),
+        )
+
+    offset = _grid_offset(seconds)
+    series = []
+    for direction_candles in (usd_candles, lbp_candles):
+        merged = merge_candles(direction_candles, seconds, offset)
+        unit = "D" if base == "day" else "s"
+        timestamps = [
+            str(ts).replace("T", " ")
+            for ts in merged["bucket_start"].astype(f"datetime64[{unit}]")
+        ]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = merged["weighted_sum"] / merged["volume"]
+        series.append((timestamps, [None if np.isnan(r) else float(r) for r in rates]))
+    return series[0], series[1]
+
+
+candle_buffer = CandleBuffer()
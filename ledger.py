@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, func, insert
+from extensions import db
+from model.ledgerEntry import LedgerEntry
+from model.balanceSnapshot import BalanceSnapshot
+from model.userBalance import UserBalance
+
+#append-only record of every balance movement, written next to the user_balance updates
+#nothing here commits, callers own the db transaction
+
+CURRENCIES = ("USD", "LBP")
+
+
+def post(user_id, currency, delta, reason, offer=None, trade=None):
+    """
+    Add one movement to the current transaction. offer and trade can still be unflushed.
+    """
+    if delta:
+        db.session.add(LedgerEntry(
+            user_id=user_id,
+            currency=currency,
+            delta=delta,
+            reason=reason,
+            offer=offer,
+            trade=trade
+        ))
+
+
+def post_many(entries):
+    """
+    Bulk insert movements, entries is a list of (user_id, currency, delta, reason, offer_id).
+    """
+    rows = [
+        {"user_id": user_id, "currency": currency, "delta": delta, "reason": reason, "offer_id": offer_id}
+        # opening entries are kept even at 0, they mark where the user's ledger starts
+        for user_id, currency, delta, reason, offer_id in entries if delta or reason == "opening_balance"
+    ]
+    if rows:
+        db.session.execute(insert(LedgerEntry), rows)
+
+
+def balances(user_id):
+    """
+    USD and LBP balance of a user: latest snapshot plus the entries after it.
+    """
+    result = {}
+    for currency in CURRENCIES:
+        snapshot = BalanceSnapshot.query.filter_by(
+            user_id=user_id, currency=currency
+        ).order_by(BalanceSnapshot.last_entry_id.desc()).first()
+        base, after_id = (snapshot.balance, snapshot.last_entry_id) if snapshot else (0.0, 0)
+        recent = db.session.query(func.coalesce(func.sum(LedgerEntry.delta), 0.0)).filter(
+            LedgerEntry.user_id == user_id,
+            LedgerEntry.currency == currency,
+            LedgerEntry.id > after_id
+        ).scalar()
+        result[currency] = base + recent
+    return result
+
+
+def compact(settle_seconds=60):
+    """
+    Roll entries up to a watermark into a new snapshot for every (user, currency) that moved since
+    its last snapshot. The watermark trails now by settle_seconds so entries of transactions still
+    in flight, which can hold lower ids, are left for the next run. Returns the snapshots written.
+    """
+    # entry times are stored as naive utc
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=settle_seconds)
+    watermark = db.session.query(func.max(LedgerEntry.id)).filter(LedgerEntry.created_at <= cutoff).scalar()
+    if not watermark:
+        return 0
+
+    latest = db.session.query(
+        BalanceSnapshot.user_id,
+        BalanceSnapshot.currency,
+        func.max(BalanceSnapshot.last_entry_id).label("last_entry_id")
+    ).group_by(BalanceSnapshot.user_id, BalanceSnapshot.currency).subquery()
+
+    # one grouped pass over the entries after each pair's last snapshot
+    moved = db.session.query(
+        LedgerEntry.user_id,
+        LedgerEntry.currency,
+        func.sum(LedgerEntry.delta).label("delta"),
+        latest.c.last_entry_id
+    ).outerjoin(latest, and_(
+        latest.c.user_id == LedgerEntry.user_id,
+        latest.c.currency == LedgerEntry.currency
+    )).filter(
+        LedgerEntry.id > func.coalesce(latest.c.last_entry_id, 0),
+        LedgerEntry.id <= watermark
+    ).group_by(LedgerEntry.user_id, LedgerEntry.currency, latest.c.last_entry_id).all()
+    if not moved:
+        return 0
+
+    previous = {
+        (s.user_id, s.currency): s.balance for s in db.session.query(BalanceSnapshot).join(latest, and_(
+            latest.c.user_id == BalanceSnapshot.user_id,
+            latest.c.currency == BalanceSnapshot.currency,
+            latest.c.last_entry_id == BalanceSnapshot.last_entry_id
+        ))
+    }
+    db.session.execute(insert(BalanceSnapshot), [
+        {
+            "user_id": row.user_id,
+            "currency": row.currency,
+            "balance": previous.get((row.user_id, row.currency), 0.0) + row.delta,
+            "last_entry_id": watermark
+        } for row in moved
+    ])
+    return len(moved)
+
+
+def open_balances():
+    """
+    Opening entries for users with a balance but no opening_balance entry yet, so ledger and
+    balance start out equal. The opening balance is everything the user owns at this point,
+    including what their open offers hold, followed by one offer_reserve entry for those holds.
+    Users who already have entries (trades or offers between deploying the ledger and opening it)
+    also get an opening_adjustment that cancels them, they are already part of the balance.
+    Reconciliation starts from the opening_balance entries. Returns the number of users opened.
+    """
+    from model.offer import Offer
+    is_opened = db.session.query(LedgerEntry.id).filter(
+        LedgerEntry.user_id == UserBalance.user_id,
+        LedgerEntry.reason == "opening_balance"
+    ).exists()
+    unopened = UserBalance.query.filter(~is_opened).all()
+    user_ids = [b.user_id for b in unopened]
+    held = {
+        (row.user_id, row.from_currency): row.held for row in db.session.query(
+            Offer.user_id, Offer.from_currency, func.sum(Offer.amount_remaining).label("held")
+        ).filter(
+            Offer.status.in_(["OPEN", "PARTIAL"]),
+            Offer.user_id.in_(user_ids)
+        ).group_by(Offer.user_id, Offer.from_currency)
+    }
+    posted = {
+        (row.user_id, row.currency): row.total for row in db.session.query(
+            LedgerEntry.user_id, LedgerEntry.currency, func.sum(LedgerEntry.delta).label("total")
+        ).filter(LedgerEntry.user_id.in_(user_ids)).group_by(LedgerEntry.user_id, LedgerEntry.currency)
+    }
+    entries = []
+    for b in unopened:
+        for currency, amount in (("USD", b.usd_amount), ("LBP", b.lbp_amount)):
+            hold = held.get((b.user_id, currency), 0.0)
+            entries.append((b.user_id, currency, amount + hold, "opening_balance", None))
+            entries.append((b.user_id, currency, -posted.get((b.user_id, currency), 0.0), "opening_adjustment", None))
+            entries.append((b.user_id, currency, -hold, "offer_reserve", None))
+    post_many(entries)
+    return len(unopened)
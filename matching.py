@@ -0,0 +1,114 @@
+"""
+Price-time priority matching, kept free of Flask and the db so it can be unit tested
+and benchmarked on plain objects.
+"""
+from collections import namedtuple
+
+# amounts below this are treated as fully consumed
+EPSILON = 1e-9
+
+# a resting offer as seen by the matcher: price is LBP per USD, remaining is in from_currency
+RestingOrder = namedtuple("RestingOrder", ["id", "user_id", "from_currency", "price", "remaining", "created_at"])
+
+# one execution against a resting order, at the resting order's price
+Fill = namedtuple("Fill", ["resting_id", "price", "usd_amount", "lbp_amount", "resting_consumed", "incoming_consumed"])
+
+
+def crosses(incoming_from_currency, limit_price, resting_price):
+    # USD seller accepts any bid at or above its rate, LBP seller any ask at or below
+    if incoming_from_currency == "USD":
+        return resting_price >= limit_price
+    return resting_price <= limit_price
+
+
+def priority_key(incoming_from_currency):
+    """
+    Sort key for resting orders on the opposite side: best price first, then oldest, then lowest id.
+    """
+    if incoming_from_currency == "USD":
+        # resting are LBP sellers (bids), highest rate first
+        return lambda r: (-r.price, r.created_at, r.id)
+    # resting are USD sellers (asks), lowest rate first
+    return lambda r: (r.price, r.created_at, r.id)
+
+
+def match_order(user_id, from_currency, amount, limit_price, resting):
+    """
+    Match an incoming order against resting orders of the opposite side.
+    amount is in from_currency. Resting orders of the same user are skipped.
+    Returns (fills, remaining) where remaining is the unfilled amount in from_currency.
+    The result only depends on the inputs, resting order is re-sorted by priority.
+    """
+    fills = []
+    remaining = amount
+    for order in sorted(resting, key=priority_key(from_currency)):
+        if remaining <= EPSILON:
+            break
+        if order.user_id == user_id or order.remaining <= EPSILON:
+            continue
+        if not crosses(from_currency, limit_price, order.price):
+            # sorted by price so nothing further crosses either
+            break
+
+        price = order.price
+        # whichever side runs out keeps its exact amount so no float dust is left behind
+        if from_currency == "USD":
+            # incoming gives USD, resting bid gives LBP
+            if order.remaining / price <= remaining:
+                usd_amount, lbp_amount = order.remaining / price, order.remaining
+            else:
+                usd_amount, lbp_amount = remaining, remaining * price
+            resting_consumed, incoming_consumed = lbp_amount, usd_amount
+        else:
+            # incoming gives LBP, resting ask gives USD
+            if order.remaining * price <= remaining:
+                usd_amount, lbp_amount = order.remaining, order.remaining * price
+            else:
+                usd_amount, lbp_amount = remaining / price, remaining
+            resting_consumed, incoming_consumed = usd_amount, lbp_amount
+
+        fills.append(Fill(order.id, price, usd_amount, lbp_amount, resting_consumed, incoming_consumed))
+        remaining -= incoming_consumed
+
+    if remaining <= EPSILON:
+        remaining = 0.0
+    return fills, remaining
+
+
+def plan_sweep(user_id, taker_gives, usd_quantity, worst_price, resting):
+    """
+    Walk resting orders best first and take up to usd_quantity USD worth of them.
+    taker_gives is the currency the taker pays with: "LBP" buys USD from asks, "USD" sells
+    USD into bids. worst_price bounds the rate, None means market. Returns (fills, usd_unfilled).
+    """
+    # the taker is the incoming side, so priority and crossing follow its currency
+    fills = []
+    remaining = usd_quantity
+    for order in sorted(resting, key=priority_key(taker_gives)):
+        if remaining <= EPSILON:
+            break
+        if order.user_id == user_id or order.remaining <= EPSILON:
+            continue
+        if worst_price is not None and not crosses(taker_gives, worst_price, order.price):
+            break
+
+        price = order.price
+        if taker_gives == "LBP":
+            # resting ask gives USD
+            usd_amount = min(remaining, order.remaining)
+            lbp_amount = usd_amount * price
+            resting_consumed, incoming_consumed = usd_amount, lbp_amount
+        else:
+            # resting bid gives LBP
+            if order.remaining / price <= remaining:
+                usd_amount, lbp_amount = order.remaining / price, order.remaining
+            else:
+                usd_amount, lbp_amount = remaining, remaining * price
+            resting_consumed, incoming_consumed = lbp_amount, usd_amount
+
+        fills.append(Fill(order.id, price, usd_amount, lbp_amount, resting_consumed, incoming_consumed))
+        remaining -= usd_amount
+
+    if remaining <= EPSILON:
+        remaining = 0.0
+    return fills, remaining
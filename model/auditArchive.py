@@ -0,0 +1,36 @@
+from extensions import db, ma
+from datetime import datetime, timezone
+
+
+class AuditArchive(db.Model):
+    """
+    One compressed NDJSON file holding audit_log rows of a month that were moved out of the table.
+    """
+    __tablename__ = "audit_archive"
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    path = db.Column(db.String(255), nullable=False, unique=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index('ix_audit_archive_month', 'month'),
+    )
+
+
+class AuditArchiveLock(db.Model):
+    """
+    Single marker row, an archiver run holds a row lock on it so two runs never overlap.
+    """
+    __tablename__ = "audit_archive_lock"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+
+class AuditArchiveSchema(ma.SQLAlchemyAutoSchema):
+    class Meta:
+        model = AuditArchive
+        fields = ("id", "month", "path", "row_count", "first_id", "last_id", "archived_at")
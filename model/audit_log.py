@@ -31,6 +31,12 @@ class AuditLog(db.Model):
     ip_address = db.Column(db.String(45), nullable=True)  # To store IPv4 or IPv6 addresses
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    # keyset pagination of a user's logs and of all logs for admins
+    __table_args__ = (
+        db.Index('ix_audit_log_user_timestamp', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_audit_log_timestamp', 'timestamp', 'id'),
+    )
+
     def __init__(self, action_type, description, user_id=None, entity_type=None, entity_id=None, ip_address=None):
         self.action_type = action_type
         self.description = description
@@ -0,0 +1,20 @@
+from extensions import db
+from datetime import datetime, timezone
+
+
+class BalanceSnapshot(db.Model):
+    """
+    A user's balance in one currency including every ledger entry up to last_entry_id.
+    """
+    __tablename__ = "balance_snapshot"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    currency = db.Column(db.String(3), nullable=False)
+    balance = db.Column(db.Float, nullable=False)
+    last_entry_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'currency', 'last_entry_id', name='uq_balance_snapshot_entry'),
+    )
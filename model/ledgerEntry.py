@@ -0,0 +1,36 @@
+from extensions import db, ma
+from datetime import datetime, timezone
+
+
+class LedgerEntry(db.Model):
+    """
+    One balance movement, rows are only ever inserted. A user's balance in a currency is
+    their latest BalanceSnapshot plus the deltas of the entries after it.
+    """
+    __tablename__ = "ledger_entry"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    currency = db.Column(db.String(3), nullable=False)  # USD or LBP
+    delta = db.Column(db.Float, nullable=False)
+    # opening_balance, offer_reserve, offer_refund or trade
+    reason = db.Column(db.String(20), nullable=False)
+    offer_id = db.Column(db.Integer, db.ForeignKey("offer.id"), nullable=True)
+    trade_id = db.Column(db.Integer, db.ForeignKey("trade.id"), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    # set on entries written before the offer or trade is flushed, fills in the ids on insert
+    offer = db.relationship("Offer")
+    trade = db.relationship("Trade")
+
+    __table_args__ = (
+        # entries of a user after a snapshot
+        db.Index('ix_ledger_entry_user_currency', 'user_id', 'currency', 'id'),
+    )
+
+
+class LedgerEntrySchema(ma.SQLAlchemyAutoSchema):
+    class Meta:
+        model = LedgerEntry
+        include_fk = True
+        fields = ("id", "user_id", "currency", "delta", "reason", "offer_id", "trade_id", "created_at")
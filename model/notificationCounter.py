@@ -0,0 +1,13 @@
+from extensions import db
+
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counter'
+
+    # one row per user, kept up to date by the notification outbox so the badge count
+    # and "is there anything new" checks never scan the notifications table
+    user_id = db.Column(db.Integer, primary_key=True)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+    last_notification_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<NotificationCounter {self.user_id}>'
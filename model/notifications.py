@@ -11,5 +11,11 @@ class Notification(db.Model):
     read = db.Column(db.Boolean, default=False)
     type = db.Column(db.String(50), nullable=False)  # e.g., 'alert', 'offer', 'trade'
 
+    # keyset pagination of a user's notifications, and the retention job's range scan
+    __table_args__ = (
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_notifications_read_created', 'read', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<Notification {self.id}>'
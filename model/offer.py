@@ -15,9 +15,24 @@ class Offer(db.Model):
 
     exchange_rate = db.Column(db.Float, nullable=False)
 
-    status = db.Column(db.String(20), default="OPEN")  # OPEN, PARTIAL, FILLED, CANCELLED
+    status = db.Column(db.String(20), default="OPEN")  # OPEN, PARTIAL, FILLED, CANCELLED, EXPIRED
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
 
+    # GTC rests until cancelled, GTD until expires_at (utc), IOC and FOK never rest
+    time_in_force = db.Column(db.String(3), nullable=False, default="GTC")
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    # bumped on every update, orm updates only match the version they read (optimistic mode)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {"version_id_col": version}
+
+    __table_args__ = (
+        # resting offers of one side in price order, used by the book load and matching
+        db.Index('ix_offer_side_rate', 'from_currency', 'status', 'exchange_rate', 'id'),
+        # due GTD offers for the expiry sweeper
+        db.Index('ix_offer_status_expires', 'status', 'expires_at'),
+    )
+
     def __init__(
         self, 
         user_id, 
@@ -25,6 +40,8 @@ class Offer(db.Model):
         to_currency, 
         amount_total, 
         exchange_rate,
+        time_in_force="GTC",
+        expires_at=None,
     ):
         super(Offer, self).__init__(
             user_id=user_id,
@@ -34,7 +51,9 @@ class Offer(db.Model):
             amount_remaining=amount_total, #init amount remaining to total
             exchange_rate=exchange_rate,
             status="OPEN", #make it open and add timestamp
-            created_at=datetime.now(timezone.utc)
+            created_at=datetime.now(timezone.utc),
+            time_in_force=time_in_force,
+            expires_at=expires_at
         )
 
 
@@ -53,4 +72,6 @@ class OfferSchema(ma.SQLAlchemyAutoSchema):
             "exchange_rate",
             "status",
             "created_at",
+            "time_in_force",
+            "expires_at",
         )
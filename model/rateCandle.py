@@ -0,0 +1,51 @@
+from extensions import db
+from sqlalchemy import UniqueConstraint
+
+
+class RateCandle(db.Model):
+    """
+    Pre-aggregated rollup of transactions, one row per bucket, direction and interval.
+    """
+    __tablename__ = "rate_candle"
+
+    id = db.Column(db.Integer, primary_key=True)
+    interval = db.Column(db.String(10), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    usd_to_lbp = db.Column(db.Boolean, nullable=False)
+
+    # weighted sum is sum(rate * usd) which equals sum(lbp), volume is sum(usd)
+    weighted_sum = db.Column(db.Float, nullable=False, default=0.0)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    open_rate = db.Column(db.Float, nullable=False)
+    high_rate = db.Column(db.Float, nullable=False)
+    low_rate = db.Column(db.Float, nullable=False)
+    close_rate = db.Column(db.Float, nullable=False)
+    # first and last transaction times in the bucket, keep open/close right if rows arrive out of order
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('interval', 'usd_to_lbp', 'bucket_start', name='uq_rate_candle_bucket'),
+    )
+
+    def __init__(self, interval, bucket_start, usd_to_lbp, rate, added_date):
+        super(RateCandle, self).__init__(
+            interval=interval,
+            bucket_start=bucket_start,
+            usd_to_lbp=usd_to_lbp,
+            weighted_sum=0.0,
+            volume=0.0,
+            count=0,
+            open_rate=rate,
+            high_rate=rate,
+            low_rate=rate,
+            close_rate=rate,
+            first_at=added_date,
+            last_at=added_date
+        )
+
+    @property
+    def rate(self):
+        return self.weighted_sum / self.volume if self.volume else None
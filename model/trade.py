@@ -17,6 +17,12 @@ class Trade(db.Model):
     executed_rate = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
     direction = db.Column(db.String(10), nullable=False)
+
+    # keyset pagination of a user's trades, one index per side since a user can be either
+    __table_args__ = (
+        db.Index('ix_trade_maker_created', 'maker_id', 'created_at', 'id'),
+        db.Index('ix_trade_taker_created', 'taker_id', 'created_at', 'id'),
+    )
     # values could be:
     # buy: taker is buying USD
     # sell: taker is selling USD
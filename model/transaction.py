@@ -27,6 +27,8 @@ class Transaction(db.Model):
     __table_args__ = (
         CheckConstraint('usd_amount > 0', name='chk_usd_amount'),
         CheckConstraint('lbp_amount > 0', name='chk_lbp_amount'),
+        # keyset pagination of a user's history
+        db.Index('ix_transaction_user_added', 'user_id', 'added_date', 'id'),
     )
 
 
@@ -10,6 +10,10 @@ class UserBalance(db.Model):
     lbp_amount = db.Column(db.Float, nullable=False, default=0.0)
     updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
 
+    # bumped on every update, orm updates only match the version they read (optimistic mode)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __mapper_args__ = {"version_id_col": version}
+
     def __init__(self, user_id, usd_amount=0.0, lbp_amount=0.0):
         self.user_id = user_id
         self.usd_amount = usd_amount
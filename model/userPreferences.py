@@ -8,7 +8,7 @@ class UserPreferences(db.Model):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('user.id'), unique=True, nullable=False)
     default_time_range = Column(String(32), default='3d')  #'1d', '3d', '1w', '1m'
-    graph_interval = Column(String(32), default='daily')    #'hourly', 'daily'
+    graph_interval = Column(String(32), default='daily')    #'hourly', 'daily' or any key of candles.HISTORY_INTERVALS
 
 #create schema
 
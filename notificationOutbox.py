@@ -0,0 +1,243 @@
+import atexit
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import queue
+import threading
+from sqlalchemy import bindparam, case, event, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from extensions import db
+from broadcaster import notification_broadcaster
+from model.notifications import Notification
+from model.notificationCounter import NotificationCounter
+
+#notifications collected during a unit of work and written with one bulk INSERT when it commits
+#the same commit keeps each user's unread counter current and, once it's durable, wakes the
+#user's long-poll/stream listeners
+
+OUTBOX_KEY = "notification_outbox"
+PUBLISH_KEY = "notification_publish"
+
+
+def queue_notification(user_id, message, type_, session=None):
+    """
+    Add a notification to the session's outbox, it is inserted with the session's next commit
+    and dropped if the transaction (or the savepoint it was queued in) rolls back.
+    """
+    session = session or db.session()
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    session.info.setdefault(OUTBOX_KEY, []).append(
+        (transaction, {"user_id": user_id, "message": message, "type": type_})
+    )
+
+
+def _seed_counters(session, user_ids):
+    # first counter row of a user starts from what the table already holds
+    rows = session.execute(
+        select(
+            Notification.user_id,
+            func.sum(case((Notification.read == False, 1), else_=0)),
+            func.max(Notification.id)
+        ).where(Notification.user_id.in_(user_ids)).group_by(Notification.user_id)
+    ).all()
+    found = {user_id: (unread or 0, last_id or 0) for user_id, unread, last_id in rows}
+    try:
+        with session.begin_nested():
+            session.execute(insert(NotificationCounter), [
+                {"user_id": user_id, "unread": found.get(user_id, (0, 0))[0], "last_notification_id": found.get(user_id, (0, 0))[1]}
+                for user_id in user_ids
+            ])
+        return True
+    except IntegrityError:
+        # another transaction created one of the rows first
+        return False
+
+
+def _adjust_counters(session, deltas):
+    """
+    Add deltas ({user_id: change in unread}) to the users' counters, creating missing rows,
+    and queue the new values for publishing after the commit.
+    """
+    user_ids = list(deltas)
+    existing = set(session.execute(
+        select(NotificationCounter.user_id).where(NotificationCounter.user_id.in_(user_ids))
+    ).scalars())
+    missing = [user_id for user_id in user_ids if user_id not in existing]
+    # seeded rows already count this transaction's notifications
+    if missing and _seed_counters(session, missing):
+        user_ids = [user_id for user_id in user_ids if user_id in existing]
+
+    if user_ids:
+        counter = NotificationCounter.__table__
+        last_id = select(func.max(Notification.id)).where(
+            Notification.user_id == counter.c.user_id
+        ).scalar_subquery()
+        session.execute(
+            counter.update().where(counter.c.user_id == bindparam("counter_user_id")).values(
+                unread=counter.c.unread + bindparam("unread_delta"),
+                last_notification_id=func.coalesce(last_id, 0)
+            ),
+            [{"counter_user_id": user_id, "unread_delta": deltas[user_id]} for user_id in user_ids]
+        )
+
+    transaction = session.get_nested_transaction() or session.get_transaction()
+    pending = session.info.setdefault(PUBLISH_KEY, [])
+    for row in session.execute(
+        select(NotificationCounter.user_id, NotificationCounter.unread, NotificationCounter.last_notification_id)
+        .where(NotificationCounter.user_id.in_(list(deltas)))
+    ):
+        pending.append((transaction, (row.user_id, {"unread": row.unread, "last_id": row.last_notification_id})))
+
+
+def mark_read(user_id, count, session=None):
+    """
+    Take count notifications off the user's unread counter in the current transaction.
+    """
+    if count:
+        _adjust_counters(session or db.session(), {user_id: -count})
+
+
+def get_counter(user_id):
+    """
+    (unread, last_notification_id) of a user, read from the counter row. Seeds the row on first use.
+    """
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is None:
+        _seed_counters(db.session(), [user_id])
+        db.session.commit()
+        counter = db.session.get(NotificationCounter, user_id)
+    return counter.unread, counter.last_notification_id
+
+
+def prune_read_notifications(older_than_days, batch_size=1000):
+    """
+    Delete up to batch_size read notifications created more than older_than_days ago.
+    Nothing is committed, callers commit each batch so no single delete holds locks for long.
+    Returns the number of rows deleted.
+    """
+    # created_at is stored as naive utc
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=older_than_days)
+    ids = [row.id for row in db.session.query(Notification.id).filter(
+        Notification.read == True,
+        Notification.created_at < cutoff
+    ).order_by(Notification.created_at).limit(batch_size)]
+    if not ids:
+        return 0
+    # read rows only, the unread counters don't change
+    return Notification.query.filter(Notification.id.in_(ids)).delete(synchronize_session=False)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_outbox(session):
+    entries = session.info.pop(OUTBOX_KEY, None)
+    if entries:
+        rows = [row for _, row in entries]
+        session.execute(insert(Notification), rows)
+        _adjust_counters(session, Counter(row["user_id"] for row in rows))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_counters(session):
+    # savepoint commits fire this too, only the outer commit makes the rows visible
+    if session.in_nested_transaction():
+        return
+    pending = session.info.pop(PUBLISH_KEY, None)
+    if not pending:
+        return
+    # later values of a user supersede earlier ones
+    latest = dict(item for _, item in pending)
+    for user_id, payload in latest.items():
+        notification_broadcaster.publish("notifications", payload, topic=user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_outbox(session, previous_transaction):
+    for key in (OUTBOX_KEY, PUBLISH_KEY):
+        entries = session.info.get(key)
+        if not entries:
+            continue
+        if not previous_transaction.nested:
+            session.info.pop(key, None)
+            continue
+
+        def rolled_back(transaction):
+            # queued in the savepoint that rolled back or in one nested inside it
+            while transaction is not None:
+                if transaction is previous_transaction:
+                    return True
+                transaction = transaction.parent
+            return False
+
+        session.info[key] = [(t, item) for t, item in entries if not rolled_back(t)]
+
+
+class NotificationFlusher(threading.Thread):
+    """
+    Background writer for fire-and-forget producers that have no transaction of their own:
+    notifications are buffered and written in one INSERT and commit every flush_interval seconds,
+    through the session outbox so unread counters and listeners are updated like any other commit.
+    """
+
+    def __init__(self, app, flush_interval=1.0, max_batch=500):
+        super().__init__(name="notification-flusher", daemon=True)
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.buffer = queue.Queue()
+        self.written = 0
+
+    def submit(self, user_id, message, type_):
+        self.buffer.put({"user_id": user_id, "message": message, "type": type_})
+
+    def _drain(self, block):
+        rows = []
+        try:
+            rows.append(self.buffer.get(timeout=self.flush_interval) if block else self.buffer.get_nowait())
+            while len(rows) < self.max_batch:
+                rows.append(self.buffer.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def flush(self, block=False):
+        rows = self._drain(block)
+        if not rows:
+            return 0
+        with self.app.app_context():
+            try:
+                for row in rows:
+                    queue_notification(row["user_id"], row["message"], row["type"])
+                db.session.commit()
+                self.written += len(rows)
+            except Exception as e:
+                db.session.rollback()
+                print(f"error occured {str(e)}")
+                return 0
+        return len(rows)
+
+    def close(self):
+        # one flush takes at most max_batch rows, keep going until the buffer is empty
+        while self.flush():
+            pass
+
+    def run(self):
+        while True:
+            self.flush(block=True)
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def notify_async(app, user_id, message, type_):
+    """
+    Queue a notification to the background flusher, started on first use.
+    """
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = NotificationFlusher(app, app.config.get("NOTIFICATION_FLUSH_INTERVAL", 1.0))
+            _flusher.start()
+            # write whatever is still buffered when the worker exits
+            atexit.register(_flusher.close)
+    _flusher.submit(user_id, message, type_)
@@ -0,0 +1,302 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+import threading
+import uuid
+
+# offers in these states rest on the book
+BOOK_STATUSES = ("OPEN", "PARTIAL")
+
+# level changes kept for /orderbook/depth/diff, older sequences need a new snapshot
+MAX_CHANGES = 10000
+
+# (from_currency, to_currency) -> best price first: USD sellers want the lowest rate, LBP sellers the highest
+SIDES = {
+    ("USD", "LBP"): "asks",
+    ("LBP", "USD"): "bids",
+}
+
+
+class BookSide:
+    """
+    Price levels of one side in a sorted list, each level a FIFO of offers keyed by offer id.
+    """
+
+    def __init__(self, descending):
+        self.descending = descending
+        # sort keys, prices are negated on the bid side so bisect keeps best first
+        self._keys = []
+        self._levels = {}
+
+    def _key(self, price):
+        return -price if self.descending else price
+
+    def add(self, entry):
+        price = entry["exchange_rate"]
+        level = self._levels.get(price)
+        if level is None:
+            level = self._levels[price] = OrderedDict()
+            insort(self._keys, self._key(price))
+        level[entry["id"]] = entry
+
+    def get(self, offer_id, price):
+        return self._levels[price][offer_id]
+
+    def replace(self, entry):
+        # same price, new amounts: keeps the offer's time priority
+        self._levels[entry["exchange_rate"]][entry["id"]] = entry
+
+    def remove(self, offer_id, price):
+        level = self._levels.get(price)
+        if level is None:
+            return
+        level.pop(offer_id, None)
+        if not level:
+            del self._levels[price]
+            key = self._key(price)
+            self._keys.pop(bisect_left(self._keys, key))
+
+    def page(self, limit, after=None):
+        """
+        Up to limit entries in book order, starting after the (price, offer_id) of the previous page.
+        Within a level offers are in arrival order, which follows their ids.
+        """
+        start = 0
+        if after is not None:
+            start = bisect_left(self._keys, self._key(after[0]))
+        result = []
+        for key in self._keys[start:]:
+            price = -key if self.descending else key
+            for entry in self._levels[price].values():
+                if after is not None and price == after[0] and entry["id"] <= after[1]:
+                    continue
+                result.append(entry)
+                if len(result) >= limit:
+                    return result
+        return result
+
+    def level(self, price):
+        """
+        Aggregated quantity and offer count at price, an empty level has both at 0.
+        """
+        entries = self._levels.get(price, {}).values()
+        return {
+            "price": price,
+            "quantity": sum(e["amount_remaining"] for e in entries),
+            "offers": len(entries),
+        }
+
+    def depth(self, max_levels=None):
+        return [
+            self.level(-key if self.descending else key)
+            for key in self._keys[:max_levels]
+        ]
+
+
+class OrderBook:
+    """
+    In-memory price-level book of resting OPEN/PARTIAL offers, loaded from the db on first use
+    and kept current by the offer endpoints after each commit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # one load at a time, so its recorded changes aren't cleared by another
+        self._load_lock = threading.Lock()
+        self._sides = {}
+        self._index = {}  # offer_id -> (from_currency, to_currency), price
+        self._loaded = False
+        # offer_id -> Offer.version of the last snapshot applied, removed offers included, so a
+        # snapshot that arrives late can't bring back an offer that was filled or cancelled.
+        # Kept from the last two loads only, older snapshots don't arrive that late
+        self._versions = {}
+        self._previous_versions = {}
+        # (offer_id, version, entry or None for a removal) applied while a load is reading the db,
+        # replayed on top of what it read
+        self._pending = None
+        # bumped on every level change, changes are (sequence, side name, level)
+        self._sequence = 0
+        self._changes = deque(maxlen=MAX_CHANGES)
+        # sequences only mean something within this instance, they start over on restart
+        self.epoch = uuid.uuid4().hex
+        self._reset()
+
+    def _reset(self):
+        self._sides = {pair: BookSide(descending=(name == "bids")) for pair, name in SIDES.items()}
+        self._index = {}
+
+    @staticmethod
+    def _entry(offer):
+        from model.offer import OfferSchema
+        return OfferSchema().dump(offer)
+
+    @staticmethod
+    def _resting(entry):
+        return entry["status"] in BOOK_STATUSES and entry["amount_remaining"] > 0
+
+    def load(self):
+        with self._load_lock:
+            self._load()
+
+    def _load(self):
+        from model.offer import Offer
+        with self._lock:
+            self._pending = []
+        try:
+            offers = Offer.query.filter(
+                Offer.status.in_(BOOK_STATUSES),
+                Offer.amount_remaining > 0
+            ).order_by(Offer.created_at, Offer.id).all()
+            # version read before the dump: if they disagree, the version is the older one,
+            # which only lets a newer snapshot through
+            entries = [(o.version, self._entry(o)) for o in offers]
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            before = self._levels_by_side() if self._loaded else None
+            self._reset()
+            self._previous_versions, self._versions = self._versions, {}
+            for version, entry in entries:
+                if self._resting(entry):
+                    self._add(entry)
+                self._versions[entry["id"]] = version
+            # commits that landed during the query may be missing from it
+            pending, self._pending = self._pending, None
+            for offer_id, version, entry in pending:
+                self._apply_change(offer_id, version, entry)
+            if before is not None:
+                # a resync only shows up to diff clients as the levels it actually moved
+                after = self._levels_by_side()
+                for name in after:
+                    for price in before[name].keys() | after[name].keys():
+                        if before[name].get(price) != after[name].get(price):
+                            self._record(self._pair(name), price)
+            self._loaded = True
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._load()
+
+    @staticmethod
+    def _pair(name):
+        return next(pair for pair, side in SIDES.items() if side == name)
+
+    def _levels_by_side(self):
+        return {
+            name: {level["price"]: (level["quantity"], level["offers"]) for level in self._sides[pair].depth()}
+            for pair, name in SIDES.items()
+        }
+
+    def _record(self, pair, price):
+        self._sequence += 1
+        self._changes.append((self._sequence, SIDES[pair], self._sides[pair].level(price)))
+
+    def _add(self, entry):
+        pair = (entry["from_currency"], entry["to_currency"])
+        self._sides[pair].add(entry)
+        self._index[entry["id"]] = (pair, entry["exchange_rate"])
+        return pair, entry["exchange_rate"]
+
+    def _remove(self, offer_id):
+        located = self._index.pop(offer_id, None)
+        if located:
+            pair, price = located
+            self._sides[pair].remove(offer_id, price)
+        return located
+
+    def apply(self, offer):
+        """
+        Reflect a committed offer: rests it, updates its remaining amount or takes it off the book.
+        Snapshots may come in any order, one not newer than the last applied (by Offer.version) is ignored.
+        """
+        version = offer.version
+        entry = self._entry(offer)
+        self._change(entry["id"], version, entry if self._resting(entry) else None)
+
+    def discard(self, released):
+        """
+        Take offers released in bulk (cancelled or expired) off the book. released are the rows
+        returned by trading.release_offers, with the version they had before the release.
+        """
+        for row in released:
+            self._change(row.id, row.version + 1, None)
+
+    def _change(self, offer_id, version, entry):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((offer_id, version, entry))
+            if self._loaded:
+                self._apply_change(offer_id, version, entry)
+            # otherwise the load on first read picks the offer up from the db
+
+    def _apply_change(self, offer_id, version, entry):
+        # entry None takes the offer off the book
+        last = self._versions.get(offer_id, self._previous_versions.get(offer_id, 0))
+        if version <= last:
+            return
+        self._versions[offer_id] = version
+        located = self._index.get(offer_id)
+        changed = None
+        if entry is None:
+            changed = self._remove(offer_id)
+        elif located is None:
+            changed = self._add(entry)
+        else:
+            pair, price = located
+            current = self._sides[pair].get(offer_id, price)
+            self._sides[pair].replace(entry)
+            if entry["amount_remaining"] != current["amount_remaining"]:
+                changed = located
+        if changed:
+            self._record(*changed)
+
+    def page(self, from_currency, to_currency, limit, after=None):
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._sides[(from_currency, to_currency)].page(limit, after))
+
+    def depth(self, max_levels=None):
+        """
+        Levels of both sides, the sequence they are current as of and the epoch it belongs to.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            depth = {
+                name: self._sides[pair].depth(max_levels)
+                for pair, name in SIDES.items()
+            }
+            depth["sequence"] = self._sequence
+            depth["epoch"] = self.epoch
+            return depth
+
+    def diff(self, since, epoch):
+        """
+        Latest state of every level changed after sequence `since`, a level with quantity 0 was emptied.
+        Returns None when changes after `since` are no longer kept, or `since` is from another epoch
+        (a restarted or different worker), and a new snapshot is needed.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            if epoch != self.epoch or since > self._sequence:
+                return None
+            if since < self._sequence and (not self._changes or self._changes[0][0] > since + 1):
+                return None
+            latest = {}
+            for sequence, name, level in reversed(self._changes):
+                if sequence <= since:
+                    break
+                latest.setdefault((name, level["price"]), level)
+            diff = {name: [] for name in SIDES.values()}
+            for (name, _), level in latest.items():
+                diff[name].append(level)
+            for name in SIDES.values():
+                diff[name].sort(key=lambda level: level["price"], reverse=(name == "bids"))
+            diff["sequence"] = self._sequence
+            diff["epoch"] = self.epoch
+            return diff
+
+
+order_book = OrderBook()
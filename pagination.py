@@ -0,0 +1,77 @@
+import base64
+import json
+from datetime import datetime
+from flask import request, abort
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 200
+
+
+def encode_cursor(sort_value, row_id):
+    # opaque to clients: base64 of [sort value, id], datetimes as iso strings
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, as_datetime=False):
+    """
+    Returns (sort_value, id) from a cursor made by encode_cursor, aborts with 400 if it's malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        if as_datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(row_id)
+    except (ValueError, TypeError):
+        abort(400, "INVALID cursor")
+
+
+def page_args(default_limit=DEFAULT_PAGE_LIMIT, max_limit=MAX_PAGE_LIMIT):
+    """
+    Reads ?limit= and ?cursor= from the request. limit is clamped to max_limit.
+    """
+    limit = request.args.get("limit")
+    try:
+        limit = int(limit) if limit else default_limit
+    except ValueError:
+        abort(400, "limit MUST BE AN INTEGER")
+    if limit <= 0:
+        abort(400, "limit MUST BE GREATER THAN 0")
+    return min(limit, max_limit), request.args.get("cursor")
+
+
+def keyset_page(query, sort_column, id_column, limit, cursor=None, descending=True):
+    """
+    One page of query ordered by (sort_column, id_column), starting after cursor.
+    Fetches limit + 1 rows to know whether there is a next page.
+    Returns (rows, next_cursor), next_cursor is None on the last page.
+    """
+    if cursor:
+        as_datetime = sort_column.type.python_type is datetime
+        sort_value, row_id = decode_cursor(cursor, as_datetime)
+        if descending:
+            query = query.filter(or_(
+                sort_column < sort_value,
+                and_(sort_column == sort_value, id_column < row_id)
+            ))
+        else:
+            query = query.filter(or_(
+                sort_column > sort_value,
+                and_(sort_column == sort_value, id_column > row_id)
+            ))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
@@ -0,0 +1,157 @@
+import numpy as np
+from datetime import timedelta
+from extensions import db
+from model.transaction import Transaction
+
+# optional statistics a client can ask for with ?stats=std,percentiles or ?stats=all
+EXTRA_STATS = ("std", "volatility", "percentiles", "vwap", "volume", "count")
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def parse_stats_param(stats_str):
+    """
+    Parse the comma separated stats parameter, raises ValueError on unknown names.
+    """
+    if not stats_str:
+        return []
+    requested = [s.strip().lower() for s in stats_str.split(",") if s.strip()]
+    if "all" in requested:
+        return list(EXTRA_STATS)
+    unknown = [s for s in requested if s not in EXTRA_STATS]
+    if unknown:
+        raise ValueError(f"Unknown stats: {', '.join(unknown)}")
+    return requested
+
+
+def load_rate_arrays(startDate, endDate):
+    """
+    Fetch only the amount columns for the range in one query, ordered by time.
+    Returns {True: (usd, lbp), False: (usd, lbp)} keyed on usd_to_lbp, as float arrays.
+    """
+    #adding a day to support same day ops
+    endDate = endDate + timedelta(days=1)
+    rows = db.session.query(
+        Transaction.usd_amount,
+        Transaction.lbp_amount,
+        Transaction.usd_to_lbp
+    ).filter(
+        Transaction.added_date >= startDate,
+        Transaction.added_date < endDate
+    ).order_by(Transaction.added_date, Transaction.id).all()
+
+    if not rows:
+        empty = (np.empty(0), np.empty(0))
+        return {True: empty, False: empty}
+
+    data = np.array(rows, dtype=float)
+    usd, lbp, direction = data[:, 0], data[:, 1], data[:, 2].astype(bool)
+    # rows with no usd can't give a rate
+    valid = usd != 0
+    return {
+        True: (usd[valid & direction], lbp[valid & direction]),
+        False: (usd[valid & ~direction], lbp[valid & ~direction]),
+    }
+
+
+def _weighted_percentiles(rates, weights, percentiles):
+    order = np.argsort(rates, kind="stable")
+    sorted_rates = rates[order]
+    cumulative = np.cumsum(weights[order])
+    targets = np.asarray(percentiles, dtype=float) / 100 * cumulative[-1]
+    idx = np.searchsorted(cumulative, targets, side="left")
+    idx = np.clip(idx, 0, len(sorted_rates) - 1)
+    return {f"p{p}": float(v) for p, v in zip(percentiles, sorted_rates[idx])}
+
+
+def compute_rate_stats(usd, lbp, extra=()):
+    """
+    Vectorized stats for one direction. Always returns min, max, weighted_avg and pct_change
+    with the same meaning as before, plus any requested extra stats.
+    """
+    if len(usd) == 0:
+        stats = {"min": None, "max": None, "weighted_avg": None, "pct_change": 0}
+        for name in extra:
+            stats[name] = 0 if name in ("volume", "count") else None
+        return stats
+
+    rates = lbp / usd
+    total_usd = usd.sum()
+    # sum(rate * usd) / sum(usd)
+    weighted_avg = float((rates * usd).sum() / total_usd)
+
+    stats = {
+        "min": float(rates.min()),
+        "max": float(rates.max()),
+        "weighted_avg": weighted_avg,
+        #pct change from first rate to last rate
+        "pct_change": float((rates[-1] - rates[0]) / rates[0] * 100) if len(rates) > 1 else 0
+    }
+
+    for name in extra:
+        if name == "std":
+            # usd weighted standard deviation around the weighted average
+            stats["std"] = float(np.sqrt((usd * (rates - weighted_avg) ** 2).sum() / total_usd))
+        elif name == "volatility":
+            # standard deviation of log returns between consecutive transactions, in percent
+            returns = np.diff(np.log(rates))
+            stats["volatility"] = float(returns.std() * 100) if len(returns) > 1 else 0
+        elif name == "percentiles":
+            stats["percentiles"] = _weighted_percentiles(rates, usd, PERCENTILES)
+        elif name == "vwap":
+            stats["vwap"] = float(lbp.sum() / total_usd)
+        elif name == "volume":
+            stats["volume"] = float(total_usd)
+        elif name == "count":
+            stats["count"] = int(len(rates))
+    return stats
+
+
+def get_rate_analytics(startDate, endDate, extra=()):
+    arrays = load_rate_arrays(startDate, endDate)
+    return (
+        compute_rate_stats(*arrays[True], extra=extra),
+        compute_rate_stats(*arrays[False], extra=extra),
+    )
+
+
+def downsample_lttb(timestamps, rates, max_points):
+    """
+    Largest-triangle-three-buckets downsampling of a bucketed series.
+    Keeps the first and last points and, per bucket, the point forming the largest
+    triangle with the previously kept point and the average of the next bucket.
+    Returns (timestamps, rates) as lists with at most max_points entries.
+    """
+    n = len(rates)
+    if max_points >= n or n <= 2:
+        return list(timestamps), list(rates)
+
+    x = np.array(timestamps, dtype="datetime64[s]").astype("int64").astype(float)
+    y = np.array([np.nan if r is None else r for r in rates], dtype=float)
+    # empty buckets would poison the areas, drop them up front
+    valid = ~np.isnan(y)
+    if not valid.all():
+        kept = np.flatnonzero(valid)
+        x, y = x[valid], y[valid]
+        timestamps = [timestamps[i] for i in kept]
+        n = len(y)
+        if max_points >= n or n <= 2:
+            return list(timestamps), y.tolist()
+
+    # inner points split into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = np.empty(max_points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+
+    prev = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        # average of the next bucket (the last point for the final bucket)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        bx, by = x[start:end], y[start:end]
+        areas = np.abs((x[prev] - avg_x) * (by - y[prev]) - (x[prev] - bx) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(areas))
+        selected[i + 1] = prev
+
+    return [timestamps[i] for i in selected], y[selected].tolist()
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+class LRUCacheBackend:
+    """
+    In-process backend: bounded LRU of key -> (expires_at, value).
+    A shared store backend only needs the same get/set/clear methods.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RateCache:
+    """
+    TTL cache for exchange rate responses, invalidated whenever a Transaction is committed.
+    Entries are tagged with the generation they were computed in, invalidate() starts a new one,
+    so a value computed before a commit and stored after it is never served.
+    """
+
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(endpoint, start_time=None, end_time=None, *extra):
+        # normalize times to the minute so requests that default to "now" can share an entry
+        def norm(value):
+            return value.replace(second=0, microsecond=0, tzinfo=None).isoformat() if value else None
+        return (endpoint, norm(start_time), norm(end_time)) + tuple(extra)
+
+    def get_or_compute(self, key, compute):
+        generation = self.generation
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == generation:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = compute()
+        # an invalidate during compute means the value may already be stale, don't keep it
+        if self.generation == generation:
+            self.backend.set(key, (generation, value), self.ttl)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else None,
+            "invalidations": self.invalidations,
+            "entries": len(self.backend),
+            "ttl_seconds": self.ttl,
+        }
+
+
+rate_cache = RateCache(LRUCacheBackend(), ttl=int(os.getenv("RATE_CACHE_TTL_SECONDS", "30")))
@@ -0,0 +1,124 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import threading
+
+
+class RollingRateEngine:
+    """
+    Keeps running weighted sums per direction over a sliding window so the
+    current exchange rate can be read without rescanning the transaction table.
+    weighted sum is sum(rate * usd) which is simply sum(lbp), volume is sum(usd).
+    """
+
+    def __init__(self, window=timedelta(days=3)):
+        self.window = window
+        self._lock = threading.Lock()
+        # key is usd_to_lbp (True/False), buffers hold (added_date, lbp, usd, transaction id) in time order,
+        # rebuilt minute buckets have no id
+        self._buffers = {True: deque(), False: deque()}
+        self._weighted_sum = {True: 0.0, False: 0.0}
+        self._usd_sum = {True: 0.0, False: 0.0}
+        # ids of the transactions in the buffers: the last rebuild's snapshot plus those added since.
+        # ids don't commit in order, so membership is what tells a counted row, not an id cutoff
+        self._counted = set()
+        self._loaded = False
+
+    @staticmethod
+    def _naive_utc(value):
+        #db returns naive utc datetimes, new objects carry tzinfo, compare both as naive utc
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def rebuild(self):
+        """
+        Cold start: rebuild the window with one aggregate query grouped per minute and direction.
+        Each minute bucket becomes a single buffer entry so the buffer stays small.
+        The ids the aggregate covered are read in the same transaction, transactions added while
+        it runs are kept if it missed them and not counted twice if it saw them.
+        """
+        from sqlalchemy import select
+        from extensions import db
+        from model.transaction import Transaction
+        from utils import truncate_date
+
+        cutoff = self._naive_utc(datetime.now(timezone.utc) - self.window)
+        bucket = truncate_date(Transaction.added_date, "minute")
+        # own connection and transaction so both reads see the same snapshot of the table
+        with db.engine.connect() as conn:
+            with conn.begin():
+                rows = conn.execute(select(
+                    Transaction.usd_to_lbp,
+                    db.func.max(Transaction.added_date),
+                    db.func.sum(Transaction.lbp_amount),
+                    db.func.sum(Transaction.usd_amount),
+                ).where(
+                    Transaction.added_date >= cutoff
+                ).group_by(
+                    Transaction.usd_to_lbp, bucket
+                )).all()
+                snapshot_ids = set(conn.execute(
+                    select(Transaction.id).where(Transaction.added_date >= cutoff)
+                ).scalars())
+
+        buffers = {True: [], False: []}
+        for usd_to_lbp, last_date, lbp_sum, usd_sum in rows:
+            buffers[bool(usd_to_lbp)].append((self._naive_utc(last_date), lbp_sum or 0.0, usd_sum or 0.0, None))
+
+        with self._lock:
+            counted = set(snapshot_ids)
+            for direction, entries in buffers.items():
+                # transactions added that the snapshot didn't see are carried over
+                carried = [e for e in self._buffers[direction] if e[3] is not None and e[3] not in snapshot_ids]
+                counted.update(e[3] for e in carried)
+                entries.extend(carried)
+                entries.sort(key=lambda e: e[0])
+                self._buffers[direction] = deque(entries)
+                self._weighted_sum[direction] = sum(e[1] for e in entries)
+                self._usd_sum[direction] = sum(e[2] for e in entries)
+            self._counted = counted
+            self._loaded = True
+
+    def add(self, added_date, usd_amount, lbp_amount, usd_to_lbp, transaction_id=None):
+        # O(1) update for a newly committed transaction
+        if usd_amount == 0:
+            return
+        with self._lock:
+            if transaction_id is not None:
+                if transaction_id in self._counted:
+                    # already counted, by the last rebuild or an earlier add
+                    return
+                self._counted.add(transaction_id)
+            direction = bool(usd_to_lbp)
+            # kept even before the first rebuild, which carries over what its snapshot missed
+            self._buffers[direction].append((self._naive_utc(added_date), lbp_amount, usd_amount, transaction_id))
+            self._weighted_sum[direction] += lbp_amount
+            self._usd_sum[direction] += usd_amount
+            if not self._loaded:
+                self._evict(datetime.now(timezone.utc))
+
+    def _evict(self, now):
+        cutoff = self._naive_utc(now - self.window)
+        for direction, buffer in self._buffers.items():
+            while buffer and buffer[0][0] < cutoff:
+                _, lbp, usd, _ = buffer.popleft()
+                self._weighted_sum[direction] -= lbp
+                self._usd_sum[direction] -= usd
+            if not buffer:
+                # reset so float drift from repeated subtraction does not accumulate
+                self._weighted_sum[direction] = 0.0
+                self._usd_sum[direction] = 0.0
+
+    def current_rates(self):
+        if not self._loaded:
+            self.rebuild()
+        with self._lock:
+            self._evict(datetime.now(timezone.utc))
+            rates = {}
+            for key, direction in (("usd_to_lbp", True), ("lbp_to_usd", False)):
+                total_usd = self._usd_sum[direction]
+                rates[key] = self._weighted_sum[direction] / total_usd if self._buffers[direction] and total_usd > 0 else None
+            return rates
+
+
+rate_engine = RollingRateEngine()
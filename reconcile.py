@@ -0,0 +1,134 @@
+import numpy as np
+from sqlalchemy import func
+from extensions import db
+from model.ledgerEntry import LedgerEntry
+from model.offer import Offer
+from model.trade import Trade
+from model.user import User
+from model.userBalance import UserBalance
+
+#balance reconciliation: expected balances are rebuilt from the trade and offer tables with numpy,
+#reading the tables in id ordered chunks so memory only grows with the number of users
+
+CHUNK_SIZE = 100000
+
+# float sums of large LBP amounts drift a little, differences below this are not reported
+ABS_TOLERANCE = 1e-6
+REL_TOLERANCE = 1e-9
+
+NO_CUTOFF = np.iinfo(np.int64).min
+
+
+def _epoch_us(times):
+    return np.array(times, dtype="datetime64[us]").astype(np.int64)
+
+
+def _chunks(query, id_column, chunk_size):
+    # keyset over the id so each chunk is an index range scan
+    last_id = 0
+    while True:
+        rows = query.filter(id_column > last_id).order_by(id_column).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _opening(size):
+    """
+    Per user opening USD/LBP from the ledger's opening_balance entries, and the time they were
+    written: trades before it are already part of the opening. Users without one start at 0.
+    """
+    usd, lbp = np.zeros(size), np.zeros(size)
+    cutoff = np.full(size, NO_CUTOFF, dtype=np.int64)
+    rows = db.session.query(
+        LedgerEntry.user_id,
+        LedgerEntry.currency,
+        func.sum(LedgerEntry.delta),
+        func.min(LedgerEntry.created_at)
+    ).filter(LedgerEntry.reason == "opening_balance").group_by(LedgerEntry.user_id, LedgerEntry.currency).all()
+    if rows:
+        user_ids, currencies, amounts, opened_at = zip(*rows)
+        user_ids = np.array(user_ids)
+        amounts = np.array(amounts, dtype=float)
+        is_usd = np.array(currencies) == "USD"
+        usd[user_ids[is_usd]] = amounts[is_usd]
+        lbp[user_ids[~is_usd]] = amounts[~is_usd]
+        np.maximum.at(cutoff, user_ids, _epoch_us(opened_at))
+    return usd, lbp, cutoff
+
+
+def expected_balances(size, chunk_size=CHUNK_SIZE):
+    """
+    Expected USD and LBP per user id: opening balance, plus every trade after it (maker gives
+    amount_from of the offer's currency and gets amount_to, the taker the reverse), minus what
+    open offers still hold. Funds an incoming offer paid a trade with are part of that trade,
+    so offers only count for their remaining amount.
+    """
+    usd, lbp, cutoff = _opening(size)
+
+    trades = db.session.query(
+        Trade.id, Trade.maker_id, Trade.taker_id, Trade.amount_from, Trade.amount_to, Trade.created_at, Offer.from_currency
+    ).join(Offer, Offer.id == Trade.offer_id)
+    for rows in _chunks(trades, Trade.id, chunk_size):
+        _, makers, takers, amount_from, amount_to, created_at, currencies = zip(*rows)
+        makers, takers = np.array(makers), np.array(takers)
+        amount_from, amount_to = np.array(amount_from, dtype=float), np.array(amount_to, dtype=float)
+        created_at = _epoch_us(created_at)
+        from_usd = np.array(currencies) == "USD"
+
+        # maker side, the taker gets exactly the opposite
+        maker_usd = np.where(from_usd, -amount_from, amount_to)
+        maker_lbp = np.where(from_usd, amount_to, -amount_from)
+        for users, sign in ((makers, 1.0), (takers, -1.0)):
+            counted = created_at > cutoff[users]
+            usd += sign * np.bincount(users[counted], weights=maker_usd[counted], minlength=size)
+            lbp += sign * np.bincount(users[counted], weights=maker_lbp[counted], minlength=size)
+
+    holds = db.session.query(Offer.id, Offer.user_id, Offer.from_currency, Offer.amount_remaining).filter(
+        Offer.status.in_(["OPEN", "PARTIAL"])
+    )
+    for rows in _chunks(holds, Offer.id, chunk_size):
+        _, users, currencies, remaining = zip(*rows)
+        users, remaining = np.array(users), np.array(remaining, dtype=float)
+        is_usd = np.array(currencies) == "USD"
+        usd -= np.bincount(users[is_usd], weights=remaining[is_usd], minlength=size)
+        lbp -= np.bincount(users[~is_usd], weights=remaining[~is_usd], minlength=size)
+    return usd, lbp
+
+
+def reconcile(chunk_size=CHUNK_SIZE, max_report=100):
+    """
+    Compare every user_balance row with its expected balance.
+    Returns a summary with the count of users checked and the largest discrepancies first.
+    """
+    size = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    expected_usd, expected_lbp = expected_balances(size, chunk_size)
+
+    discrepancies = []
+    checked = 0
+    balances = db.session.query(UserBalance.id, UserBalance.user_id, UserBalance.usd_amount, UserBalance.lbp_amount)
+    for rows in _chunks(balances, UserBalance.id, chunk_size):
+        _, users, actual_usd, actual_lbp = zip(*rows)
+        users = np.array(users)
+        checked += len(users)
+        for currency, actual, expected in (("USD", actual_usd, expected_usd), ("LBP", actual_lbp, expected_lbp)):
+            actual = np.array(actual, dtype=float)
+            expected = expected[users]
+            difference = actual - expected
+            off = np.abs(difference) > ABS_TOLERANCE + REL_TOLERANCE * np.maximum(np.abs(expected), 1.0)
+            for i in np.flatnonzero(off):
+                discrepancies.append({
+                    "user_id": int(users[i]),
+                    "currency": currency,
+                    "expected": float(expected[i]),
+                    "actual": float(actual[i]),
+                    "difference": float(difference[i])
+                })
+
+    discrepancies.sort(key=lambda d: abs(d["difference"]), reverse=True)
+    return {
+        "users_checked": checked,
+        "discrepancy_count": len(discrepancies),
+        "discrepancies": discrepancies[:max_report]
+    }
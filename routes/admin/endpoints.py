@@ -1,5 +1,8 @@
-from model.audit_log import AuditLog, AuditLogSchema
-from flask import abort, request, jsonify, g
+from model.audit_log import AuditLog, AuditLogSchema, AuditActionType
+from model.auditArchive import AuditArchive, AuditArchiveSchema
+from flask import abort, request, jsonify, g, Response, stream_with_context
+import json
+from datetime import datetime
 from jwtAuth import admin_required
 from model.user import User, UserSchema
 from model.transaction import Transaction
@@ -11,6 +14,8 @@ from flask import Blueprint
 from utils import validate_rate_alert_fields
 from routes.admin.utils import get_transaction_stats, change_user_status 
 from utils import log_preference_change
+from candles import HISTORY_INTERVALS
+from pagination import page_args, keyset_page
 
 
 
@@ -36,6 +41,73 @@ def view_transaction_stats():
     return jsonify(stats)
 
 
+@admin_bp.route('/admin/cache-stats', methods=['GET'])
+@admin_required
+def view_cache_stats():
+    # hit/miss counters of the exchange rate response cache in this worker
+    from rateCache import rate_cache
+    return jsonify(rate_cache.stats()), 200
+
+
+# concurrency mode and per command attempts / version conflicts in this worker
+@admin_bp.route('/admin/contention-stats', methods=['GET'])
+@admin_required
+def view_contention_stats():
+    from flask import current_app
+    from trading import contention
+    from sequencer import sequencers
+    return jsonify({
+        'concurrency_mode': current_app.config.get('CONCURRENCY_MODE'),
+        'execution_mode': current_app.config.get('EXECUTION_MODE'),
+        'commands': contention.stats(),
+        'sequencers': sequencers.stats()
+    }), 200
+
+
+# queue depth, batches written and backpressure counters of the audit log sink in this worker
+@admin_bp.route('/admin/audit-sink-stats', methods=['GET'])
+@admin_required
+def view_audit_sink_stats():
+    from auditSink import audit_sink
+    return jsonify(audit_sink.stats()), 200
+
+
+# expected balances rebuilt from trades and open offers compared with user_balance
+@admin_bp.route('/admin/reconciliation', methods=['GET'])
+@admin_required
+def run_reconciliation():
+    from reconcile import reconcile
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify(reconcile(max_report=limit)), 200
+
+
+# a user's ledger: balance replayed from snapshot + entries next to the stored balance, and the entries
+@admin_bp.route('/admin/user/<int:user_id>/ledger', methods=['GET'])
+@admin_required
+def view_user_ledger(user_id):
+    import ledger
+    from model.ledgerEntry import LedgerEntry, LedgerEntrySchema
+    from model.userBalance import UserBalance
+    balance = UserBalance.query.filter_by(user_id=user_id).first()
+    if not balance:
+        return jsonify({'error': 'User balance not found'}), 404
+
+    limit, cursor = page_args()
+    entries, next_cursor = keyset_page(
+        LedgerEntry.query.filter_by(user_id=user_id), LedgerEntry.created_at, LedgerEntry.id, limit, cursor
+    )
+    return jsonify({
+        'ledger_balance': ledger.balances(user_id),
+        'stored_balance': {'USD': balance.usd_amount, 'LBP': balance.lbp_amount},
+        'entries': LedgerEntrySchema(many=True).dump(entries),
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
+
+
 @admin_bp.route('/admin/user/<int:user_id>/status', methods=['PUT'])
 @admin_required
 def manage_user_status(user_id):
@@ -68,7 +140,7 @@ def manage_user_preferences(user_id):
         #update preferences based on provided data, if a field is not provided or invalid it will remain unchanged
         if 'default_time_range' in data and data['default_time_range'] in ['1d', '3d', '1w', '1m']:
             prefs.default_time_range = data['default_time_range']
-        if 'graph_interval' in data and data['graph_interval'] in ['hourly', 'daily']:
+        if 'graph_interval' in data and data['graph_interval'] in HISTORY_INTERVALS:
             prefs.graph_interval = data['graph_interval']
         db.session.commit()
         # Audit log for preference update (admin)
@@ -208,5 +280,44 @@ def set_user_status(user_id):
 @admin_bp.route('/admin/audit-logs', methods=['GET'])
 @admin_required
 def view_all_audit_logs():
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).all()
-    return jsonify(audit_logs_schema.dump(logs)), 200
\ No newline at end of file
+    limit, cursor = page_args()
+    logs, next_cursor = keyset_page(AuditLog.query, AuditLog.timestamp, AuditLog.id, limit, cursor)
+    return jsonify({
+        "audit_logs": audit_logs_schema.dump(logs, many=True),
+        "limit": limit,
+        "next_cursor": next_cursor
+    }), 200
+
+
+# monthly audit_log files written by the archive job
+@admin_bp.route('/admin/audit-logs/archives', methods=['GET'])
+@admin_required
+def view_audit_log_archives():
+    archives = AuditArchive.query.order_by(AuditArchive.month.desc(), AuditArchive.first_id.desc()).all()
+    return jsonify({"archives": AuditArchiveSchema(many=True).dump(archives)}), 200
+
+
+# archived audit logs in [start, end) as NDJSON, read from the files as the response is sent
+@admin_bp.route('/admin/audit-logs/archived', methods=['GET'])
+@admin_required
+def view_archived_audit_logs():
+    from auditArchiver import archived_logs
+    try:
+        start = datetime.fromisoformat(request.args["start"])
+        end = datetime.fromisoformat(request.args["end"])
+    except KeyError:
+        abort(400, "start AND end ARE REQUIRED")
+    except ValueError:
+        abort(400, "start AND end MUST BE ISO DATES")
+    if start >= end:
+        abort(400, "start MUST BE BEFORE end")
+    user_id = request.args.get("user_id", type=int)
+    action_type = request.args.get("action_type")
+    if action_type is not None and action_type not in AuditActionType.__members__:
+        abort(400, "INVALID action_type")
+
+    def generate():
+        for row in archived_logs(start, end, user_id, action_type):
+            yield json.dumps(row) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
\ No newline at end of file
@@ -1,10 +1,14 @@
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, current_app, Response, stream_with_context
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from datetime import datetime, timedelta, timezone
 import jwtAuth  
 from model.transaction import Transaction
 import utils
+import candles
+import rateAnalytics
+from rateCache import rate_cache
+from broadcaster import market_broadcaster, format_sse, stream_events
 from model.userPreferences import UserPreferences
 
 exchange_bp = Blueprint('exchange', __name__)
@@ -14,7 +18,7 @@ limiter = Limiter(key_func=get_remote_address)
 @exchange_bp.route('/exchangeRate', methods=['GET'])
 @limiter.limit("10 per minute")
 def get_exchange_rate():
-    rates = utils.get_current_exchange_rates()
+    rates = rate_cache.get_or_compute(rate_cache.make_key("current"), utils.get_current_exchange_rates)
 
     return jsonify({
         "message":"Retrieved average exchange rates",
@@ -23,6 +27,30 @@ def get_exchange_rate():
     }), 200
 
 
+# live rates and trades as server-sent events, replaces polling /exchangeRate
+@exchange_bp.route('/exchangeRate/stream', methods=['GET'])
+def stream_exchange_rate():
+    rates = rate_cache.get_or_compute(rate_cache.make_key("current"), utils.get_current_exchange_rates)
+    q = market_broadcaster.subscribe()
+
+    def generate():
+        try:
+            # send the current snapshot first, then whatever the publisher pushes
+            yield format_sse("rates", {
+                "usd_to_lbp": rates["usd_to_lbp"],
+                "lbp_to_usd": rates["lbp_to_usd"]
+            })
+            yield from stream_events(q)
+        finally:
+            market_broadcaster.unsubscribe(q)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # get exchange rate with analytics
 @exchange_bp.route("/exchangeRate/analytics", methods=["GET"])
 @limiter.limit("10 per minute")
@@ -59,35 +87,20 @@ def get_exchange_rate_analytics():
         "error": "Invalid date format. Use YYYY-MM-DD"
         }), 400
     
-    # get transactions
-    usd_to_lbp_transactions, lbp_to_usd_transactions = utils.get_transactions_by_date(
-        start_time, end_time
-    )
+    # optional extra statistics, e.g. stats=std,percentiles or stats=all
+    try:
+        extra_stats = rateAnalytics.parse_stats_param(request.args.get("stats"))
+    except ValueError as e:
+        return jsonify({
+        "error": str(e)
+        }), 400
 
-    #get weighted rates
-    usd_to_lbp_rates_weighted, lbp_to_usd_rates_weighted = utils.get_transaction_rates_weighted(
-        usd_to_lbp_transactions, lbp_to_usd_transactions
+    # computed over numpy arrays of the amount columns only, cached per normalized range
+    usd_stats, lbp_stats = rate_cache.get_or_compute(
+        rate_cache.make_key("analytics", start_time, end_time, tuple(extra_stats)),
+        lambda: rateAnalytics.get_rate_analytics(start_time, end_time, extra_stats)
     )
 
-    # compute stats for USD to LBP
-    usd_rates = [r for r, w in usd_to_lbp_rates_weighted]  # plain rates
-    usd_stats = {
-        "min": min(usd_rates) if usd_rates else None,
-        "max": max(usd_rates) if usd_rates else None,
-        "weighted_avg": utils.get_weighted_avg_rate(usd_to_lbp_rates_weighted),
-        #pct change from first rate to last rate
-        "pct_change": ((usd_rates[-1] - usd_rates[0]) / usd_rates[0] * 100) if len(usd_rates) > 1 else 0
-    }
-
-    # compute stats for LBP to USD
-    lbp_rates = [r for r, w in lbp_to_usd_rates_weighted] #plain rates
-    lbp_stats = {
-        "min": min(lbp_rates) if lbp_rates else None,
-        "max": max(lbp_rates) if lbp_rates else None,
-        "weighted_avg": utils.get_weighted_avg_rate(lbp_to_usd_rates_weighted),
-        "pct_change": ((lbp_rates[-1] - lbp_rates[0]) / lbp_rates[0] * 100) if len(lbp_rates) > 1 else 0
-    }
-
     return jsonify({
         "message": "Exchange rate analytics retrieved",
         "usd_to_lbp": usd_stats,
@@ -107,6 +120,7 @@ def get_exchange_rate_history():
     start_str = request.args.get("start")
     end_str = request.args.get("end")
     interval = request.args.get("interval") # if user provides interval use it, otherwise use preference
+    requested_interval = interval
 
     # Use user preferences if not provided
     user_id = jwtAuth.get_auth_user(request)
@@ -128,7 +142,7 @@ def get_exchange_rate_history():
                 interval = prefs.graph_interval
             if not end_str:
                 end_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')       
-    print(f"Received request for exchange rate history with start={start_str}, end={end_str}, interval={interval}")
+    current_app.logger.debug(f"Received request for exchange rate history with start={start_str}, end={end_str}, interval={interval}")
     #converts to datetime objects, defaults to three days ago and current time
     try:
         start_time, end_time = utils.convert_str_to_time(start_str, end_str)
@@ -137,19 +151,62 @@ def get_exchange_rate_history():
         "error": "Invalid date format. Use YYYY-MM-DD"
         }), 400
     
-    usd_txns, lbp_txns = utils.get_transactions_by_date(start_time, end_time)
-
-    # group transactions by interval
-    if interval == "hourly":
-        func = lambda t: t.added_date.replace(minute=0, second=0, microsecond=0) # keep day but round hour down
-        
-    else:  # daily
-        func = lambda t: t.added_date.date()
-
-    usd_timestamps, usd_rates = utils.extract_timestamps_and_rates(usd_txns, func)
-    lbp_timestamps, lbp_rates = utils.extract_timestamps_and_rates(lbp_txns, func)
+    # optional cap on points per direction for chart clients
+    max_points = request.args.get("max_points")
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            max_points = 0
+        if max_points < 3:
+            return jsonify({
+            "error": "max_points must be an integer of at least 3"
+            }), 400
+
+    # unknown intervals keep falling back to daily
+    if interval not in candles.HISTORY_INTERVALS:
+        interval = "daily"
+    # too many buckets for the range: an interval the client asked for is refused,
+    # one from preferences or the default is made coarser
+    max_buckets = current_app.config.get("HISTORY_MAX_BUCKETS", 5000)
+    if candles.history_buckets(start_time, end_time, interval) > max_buckets:
+        if requested_interval in candles.HISTORY_INTERVALS:
+            return jsonify({
+            "error": f"interval {interval} is too fine for this range, at most {max_buckets} points per direction"
+            }), 400
+        interval = candles.finest_interval(start_time, end_time, max_buckets)
+    history_source = current_app.config.get("EXCHANGE_HISTORY_SOURCE")
+    payload = rate_cache.get_or_compute(
+        rate_cache.make_key("history", start_time, end_time, interval, history_source),
+        lambda: _compute_history(start_time, end_time, interval, history_source)
+    )
 
-    return jsonify({
+    if max_points:
+        # downsample a copy, the cached payload keeps the full series
+        payload = {
+            direction: dict(zip(
+                ("timestamps", "rates"),
+                rateAnalytics.downsample_lttb(series["timestamps"], series["rates"], max_points)
+            ))
+            for direction, series in payload.items()
+        }
+    return jsonify(payload), 200
+
+
+def _compute_history(start_time, end_time, interval, history_source):
+    if history_source == "sql" and interval in ("hourly", "daily"):
+        # one grouped query over raw transactions, for deployments without rollups
+        candle_interval = "hour" if interval == "hourly" else "day"
+        (usd_timestamps, usd_rates), (lbp_timestamps, lbp_rates) = utils.get_bucketed_rates(
+            start_time, end_time, candle_interval
+        )
+    else:
+        # read pre-aggregated rollups, merged up to the requested interval
+        (usd_timestamps, usd_rates), (lbp_timestamps, lbp_rates) = candles.get_history_series(
+            start_time, end_time, interval
+        )
+
+    return {
         "usd_to_lbp": {
             "timestamps": usd_timestamps, 
             "rates": usd_rates
@@ -158,4 +215,4 @@ def get_exchange_rate_history():
             "timestamps": lbp_timestamps, 
             "rates": lbp_rates
             },
-    }), 200
\ No newline at end of file
+    }
@@ -1,13 +1,43 @@
 
+import json
 from jwtAuth import jwt_required
 from model.audit_log import AuditLog, AuditLogSchema
-from flask import Blueprint, jsonify, g
+from flask import Blueprint, jsonify, g, request, abort, Response, stream_with_context
+from pagination import page_args, keyset_page
 
 logs_bp = Blueprint('logs', __name__)
-audit_logs_schema = AuditLogSchema()
+audit_logs_schema = AuditLogSchema(many=True)
 @logs_bp.route('/audit-logs', methods=['GET'])
 @jwt_required
 def view_my_audit_logs():
     user_id = g.current_user_id
-    logs = AuditLog.query.filter_by(user_id=user_id).order_by(AuditLog.timestamp.desc()).all()
-    return jsonify(audit_logs_schema.dump(logs)), 200
\ No newline at end of file
+    limit, cursor = page_args()
+    logs, next_cursor = keyset_page(
+        AuditLog.query.filter_by(user_id=user_id),
+        AuditLog.timestamp,
+        AuditLog.id,
+        limit,
+        cursor
+    )
+    return jsonify({
+        "audit_logs": audit_logs_schema.dump(logs),
+        "limit": limit,
+        "next_cursor": next_cursor
+    }), 200
+
+# the user's own logs of an archived month (?month=YYYY-MM) as NDJSON
+@logs_bp.route('/audit-logs/archived', methods=['GET'])
+@jwt_required
+def view_my_archived_audit_logs():
+    from auditArchiver import archived_logs, month_range
+    user_id = g.current_user_id
+    try:
+        start, end = month_range(request.args.get("month", ""))
+    except ValueError:
+        abort(400, "month MUST BE YYYY-MM")
+
+    def generate():
+        for row in archived_logs(start, end, user_id=user_id):
+            yield json.dumps(row) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
\ No newline at end of file
@@ -1,33 +1,209 @@
-from flask import Blueprint, jsonify, request, g, abort
+import queue
+from flask import Blueprint, jsonify, request, g, abort, Response, stream_with_context
 from jwtAuth import jwt_required
 from model.notifications import Notification
 from extensions import db
+from pagination import page_args, keyset_page
+from broadcaster import notification_broadcaster, format_sse
+from notificationOutbox import get_counter, mark_read
 
 notifications_bp = Blueprint('notifications', __name__)
 
+MAX_POLL_SECONDS = 30
+MAX_DELIVERY_BATCH = 100
+
+
+def _notification_json(n):
+    return {
+        'id': n.id,
+        'message': n.message,
+        'created_at': n.created_at.isoformat(),
+        'read': n.read,
+        'type': n.type
+    }
+
+
+def _bulk_filter(user_id, data):
+    """
+    Filter for the bulk endpoints from the optional body fields up_to_id and type,
+    without either it covers all of the user's notifications.
+    """
+    query = Notification.query.filter(Notification.user_id == user_id)
+    up_to_id = data.get('up_to_id')
+    if up_to_id is not None:
+        if not isinstance(up_to_id, int) or isinstance(up_to_id, bool):
+            abort(400, 'up_to_id MUST BE AN INTEGER')
+        query = query.filter(Notification.id <= up_to_id)
+    type_ = data.get('type')
+    if type_ is not None:
+        if not isinstance(type_, str):
+            abort(400, 'type MUST BE A STRING')
+        query = query.filter(Notification.type == type_)
+    return query
+
+
+def _notifications_after(user_id, after_id):
+    # only runs when the counter says there is something newer than after_id
+    return Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.id > after_id
+    ).order_by(Notification.id.asc()).limit(MAX_DELIVERY_BATCH).all()
+
 @notifications_bp.route('/notifications', methods=['GET'])
 @jwt_required
 def get_notifications():
     user_id = g.current_user_id
-    notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
-    return jsonify([
-        {
-            'id': n.id,
-            'message': n.message,
-            'created_at': n.created_at.isoformat(),
-            'read': n.read,
-            'type': n.type
-        } for n in notifications
-    ]), 200
+    limit, cursor = page_args()
+    notifications, next_cursor = keyset_page(
+        Notification.query.filter_by(user_id=user_id),
+        Notification.created_at,
+        Notification.id,
+        limit,
+        cursor
+    )
+    return jsonify({
+        'notifications': [_notification_json(n) for n in notifications],
+        'limit': limit,
+        'next_cursor': next_cursor
+    }), 200
+
+@notifications_bp.route('/notifications/unread-count', methods=['GET'])
+@jwt_required
+def get_unread_count():
+    # read from the user's counter row, never a COUNT over notifications
+    unread, last_id = get_counter(g.current_user_id)
+    return jsonify({'unread': unread, 'last_id': last_id}), 200
+
+@notifications_bp.route('/notifications/poll', methods=['GET'])
+@jwt_required
+def poll_notifications():
+    """
+    Long-poll: returns notifications with id > after_id as soon as there are any,
+    or an empty list after timeout seconds. Without after_id it waits for the next one.
+    """
+    user_id = g.current_user_id
+    try:
+        after_id = request.args.get('after_id', type=int)
+        timeout = min(float(request.args.get('timeout', MAX_POLL_SECONDS)), MAX_POLL_SECONDS)
+    except ValueError:
+        abort(400, 'timeout MUST BE A NUMBER')
+
+    # subscribe before reading the counter so a commit in between still wakes us
+    q = notification_broadcaster.subscribe(user_id)
+    try:
+        unread, last_id = get_counter(user_id)
+        if after_id is None:
+            after_id = last_id
+        if last_id <= after_id:
+            # don't hold a db connection while waiting
+            db.session.close()
+            try:
+                _, payload = q.get(timeout=max(timeout, 0))
+                unread, last_id = payload['unread'], payload['last_id']
+            except queue.Empty:
+                pass
+    finally:
+        notification_broadcaster.unsubscribe(q, user_id)
+
+    notifications = _notifications_after(user_id, after_id) if last_id > after_id else []
+    return jsonify({
+        'notifications': [_notification_json(n) for n in notifications],
+        'unread': unread,
+        'last_id': notifications[-1].id if notifications else after_id
+    }), 200
+
+@notifications_bp.route('/notifications/stream', methods=['GET'])
+@jwt_required
+def stream_notifications():
+    """
+    Server-sent events: an 'unread' event with the current count, then a 'notifications'
+    event with the new rows every time notifications are committed for the user.
+    """
+    user_id = g.current_user_id
+    q = notification_broadcaster.subscribe(user_id)
+    unread, last_id = get_counter(user_id)
+    after_id = request.args.get('after_id', last_id, type=int)
+    db.session.close()
+
+    def generate():
+        nonlocal after_id, unread
+        try:
+            yield format_sse('unread', {'unread': unread, 'last_id': last_id})
+            pending = last_id > after_id
+            while True:
+                if not pending:
+                    try:
+                        _, payload = q.get(timeout=15)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                        continue
+                    unread = payload['unread']
+                    pending = payload['last_id'] > after_id
+                    if not pending:
+                        # only the count changed (notifications read or deleted)
+                        yield format_sse('unread', payload)
+                        continue
+                notifications = _notifications_after(user_id, after_id)
+                db.session.close()
+                if notifications:
+                    after_id = notifications[-1].id
+                    yield format_sse('notifications', {
+                        'notifications': [_notification_json(n) for n in notifications],
+                        'unread': unread,
+                        'last_id': after_id
+                    })
+                pending = len(notifications) == MAX_DELIVERY_BATCH
+        finally:
+            notification_broadcaster.unsubscribe(q, user_id)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@notifications_bp.route('/notifications/read', methods=['PATCH'])
+@jwt_required
+def mark_notifications_read():
+    # one UPDATE for every matching unread notification
+    user_id = g.current_user_id
+    data = request.get_json(silent=True) or {}
+    updated = _bulk_filter(user_id, data).filter(
+        Notification.read == False
+    ).update({Notification.read: True}, synchronize_session=False)
+    mark_read(user_id, updated)
+    db.session.commit()
+    return jsonify({'message': 'Notifications marked as read', 'updated': updated}), 200
+
+@notifications_bp.route('/notifications', methods=['DELETE'])
+@jwt_required
+def delete_notifications():
+    user_id = g.current_user_id
+    data = request.get_json(silent=True) or {}
+    # a real json boolean, "false" as a string would otherwise count as true
+    read_only = data.get('read_only', False)
+    if not isinstance(read_only, bool):
+        abort(400, 'read_only MUST BE A BOOLEAN')
+    query = _bulk_filter(user_id, data)
+    # read and unread rows are deleted separately, the unread rowcount comes off the counter
+    unread_deleted = 0
+    if not read_only:
+        unread_deleted = query.filter(Notification.read == False).delete(synchronize_session=False)
+    read_deleted = query.filter(Notification.read == True).delete(synchronize_session=False)
+    mark_read(user_id, unread_deleted)
+    db.session.commit()
+    return jsonify({'message': 'Notifications deleted', 'deleted': unread_deleted + read_deleted}), 200
 
 @notifications_bp.route('/notifications/<int:notification_id>/read', methods=['PATCH'])
 @jwt_required
 def mark_notification_read(notification_id):
     user_id = g.current_user_id
-    notification = Notification.query.filter_by(id=notification_id, user_id=user_id).first()
-    if not notification:
+    query = Notification.query.filter_by(id=notification_id, user_id=user_id)
+    # conditional update, of two concurrent requests only the one that flips it takes it off the counter
+    updated = query.filter(Notification.read == False).update({Notification.read: True}, synchronize_session=False)
+    if not updated and not query.first():
         abort(404, 'Notification not found')
-    notification.read = True
+    mark_read(user_id, updated)
     db.session.commit()
     return jsonify({'message': 'Notification marked as read'}), 200
 
@@ -35,9 +211,12 @@ def mark_notification_read(notification_id):
 @jwt_required
 def delete_notification(notification_id):
     user_id = g.current_user_id
-    notification = Notification.query.filter_by(id=notification_id, user_id=user_id).first()
-    if not notification:
+    query = Notification.query.filter_by(id=notification_id, user_id=user_id)
+    # same as the bulk delete: only a delete that removed an unread row comes off the counter
+    unread_deleted = query.filter(Notification.read == False).delete(synchronize_session=False)
+    read_deleted = query.filter(Notification.read == True).delete(synchronize_session=False)
+    if not unread_deleted + read_deleted:
         abort(404, 'Notification not found')
-    db.session.delete(notification)
+    mark_read(user_id, unread_deleted)
     db.session.commit()
     return jsonify({'message': 'Notification deleted'}), 200
@@ -1,7 +1,9 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timezone
 
-from flask import Blueprint, request, jsonify, abort, g
+from flask import Blueprint, request, jsonify, abort, g, current_app
 from werkzeug.exceptions import HTTPException
+from sqlalchemy.orm.exc import StaleDataError
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from model.offer import Offer, OfferSchema
@@ -14,6 +16,15 @@ from jwtAuth import jwt_required
 from extensions import db
 from utils import create_audit_log
 from utils import create_notification
+from utils import record_committed_transaction, record_committed_trade
+from utils import add_audit_logs
+from orderBook import order_book
+from trading import fill_amounts, settle_fill, match_incoming_offer, sweep_offers, batch_accept
+from trading import lock_for_incoming, lock_balances
+from trading import TIME_IN_FORCE, is_expired, utc_now, release_offers, for_update, contention
+from sequencer import sequencers
+import ledger
+from pagination import page_args, keyset_page, encode_cursor, decode_cursor
 
 offers_bp = Blueprint('offers', __name__)
 limiter = Limiter(key_func=get_remote_address)
@@ -21,6 +32,281 @@ limiter = Limiter(key_func=get_remote_address)
 offer_schema = OfferSchema()
 trade_schema = TradeSchema(many=True)
 
+
+def _execute(pair, command, *args):
+    """
+    Run a write command and commit it, retrying it from scratch when an optimistic version
+    check fails (up to OPTIMISTIC_MAX_RETRIES times, then 409).
+    The command's result is only returned once it is committed.
+    """
+    retries = current_app.config.get("OPTIMISTIC_MAX_RETRIES", 3)
+    for attempt in range(retries + 1):
+        contention.record(command.__name__, "attempts")
+        try:
+            return _execute_once(pair, command, *args)
+        except StaleDataError:
+            db.session.rollback()
+            contention.record(command.__name__, "conflicts")
+    contention.record(command.__name__, "exhausted")
+    abort(409, "The offer or balance was changed by another request, try again")
+
+
+def _execute_once(pair, command, *args):
+    # in 'sequencer' mode the command is queued to the pair's single writer thread and group
+    # committed, otherwise it runs here
+    if current_app.config.get("EXECUTION_MODE") != "sequencer":
+        result = command(*args)
+        db.session.commit()
+        return result
+
+    future = sequencers.submit(current_app._get_current_object(), pair, command, *args)
+    timeout = current_app.config.get("SEQUENCER_TIMEOUT_SECONDS", 10)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # a command that never started is withdrawn, so a retry can't run it twice
+        if future.cancel():
+            abort(503, "Trade sequencer is busy, try again")
+    # already in a batch: its outcome is only a commit away, wait for it but not forever
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        abort(503, "Trade sequencer did not finish the request in time, check its outcome before retrying")
+
+
+def _offer_pair(offer_id):
+    # plain read, no lock: only used to pick the sequencer
+    row = db.session.query(Offer.from_currency, Offer.to_currency).filter_by(id=offer_id).first()
+    if not row:
+        abort(404, "Offer not found")
+    return sequencers.pair_for(row.from_currency, row.to_currency)
+
+
+# write commands: no commits and no request state, so they can run on a sequencer thread
+
+def _create_offer_command(user_id, from_currency, to_currency, amount, exchange_rate, match, time_in_force, expires_at):
+    # IOC and FOK only make sense against the book, they match even with MATCHING_ENABLED off
+    match = match or time_in_force in ("IOC", "FOK")
+    # resting offers are locked before any balance, the same order every other writer uses
+    if match:
+        resting, balances = lock_for_incoming(user_id, from_currency, to_currency, amount, exchange_rate)
+    else:
+        resting, balances = [], lock_balances({user_id})
+
+    # Subtract maker funds immediately
+    maker_balance = balances.get(user_id)
+    if not maker_balance:
+        abort(400, "Maker balance not found")
+
+    if from_currency == "USD":
+        if maker_balance.usd_amount < amount:
+            abort(400, "Insufficient USD balance to create offer")
+        maker_balance.usd_amount -= amount
+    else:
+        if maker_balance.lbp_amount < amount:
+            abort(400, "Insufficient LBP balance to create offer")
+        maker_balance.lbp_amount -= amount
+
+    # Create Offer
+    offer = Offer(
+        user_id=user_id,
+        from_currency=from_currency,
+        to_currency=to_currency,
+        amount_total=amount,
+        exchange_rate=exchange_rate,
+        time_in_force=time_in_force,
+        expires_at=expires_at
+    )
+
+    db.session.add(offer)
+    ledger.post(user_id, from_currency, -amount, "offer_reserve", offer)
+
+    # optionally match a marketable offer right away against resting offers,
+    # fills commit in the same db transaction as the offer
+    db.session.flush()
+    fills = match_incoming_offer(offer, maker_balance, resting, balances) if match else []
+
+    if time_in_force == "FOK" and offer.amount_remaining > 0:
+        # undoes the reservation and any fills along with it
+        abort(400, "FOK offer could not be filled entirely")
+    if time_in_force == "IOC" and offer.amount_remaining > 0:
+        # the unfilled rest never rests on the book, give it back
+        if from_currency == "USD":
+            maker_balance.usd_amount += offer.amount_remaining
+        else:
+            maker_balance.lbp_amount += offer.amount_remaining
+        ledger.post(user_id, from_currency, offer.amount_remaining, "offer_refund", offer)
+        offer.amount_remaining = 0
+        offer.status = "CANCELLED"
+
+    # notifications are queued and written with the offer and its fills
+    for resting_offer, trade, _ in fills:
+        maker_msg = f"Your offer #{resting_offer.id} was matched by {trade.taker_username} for {trade.amount_from} {resting_offer.from_currency} at rate {trade.executed_rate}."
+        create_notification(resting_offer.user_id, maker_msg, 'offer')
+    if fills:
+        create_notification(user_id, f"Your offer #{offer.id} was matched immediately in {len(fills)} trade(s).", 'trade')
+    return offer, fills
+
+
+def _accept_offer_command(offer_id, user_id, requested_amount):
+    # Start transaction and lock the offer row with withforupdate
+    # any other session trying to access the same row has to wait
+    #this prevents overselling or race conditions
+    #(in optimistic mode nothing waits, a concurrent change fails the versioned update instead)
+    offer = for_update(db.session.query(Offer).filter_by(id=offer_id)).first()
+    if not offer:
+        abort(404, "Offer not found")
+
+    if offer.user_id == user_id:
+        abort(400, "Cannot accept your own offer")
+
+    if offer.status not in ["OPEN", "PARTIAL"]:
+        abort(400, f"Offer is not available (status={offer.status})")
+
+    if is_expired(offer):
+        abort(400, "Offer has expired")
+
+    if requested_amount > offer.amount_remaining:
+        abort(400, f"Requested amount exceeds remaining offer ({offer.amount_remaining})")
+
+    # Get taker and maker balances with lock, both in one ordered statement after the offer
+    balances = lock_balances({user_id, offer.user_id})
+    taker_balance = balances.get(user_id)
+    maker_balance = balances.get(offer.user_id)
+
+    if not maker_balance:
+        abort(400, "Maker balance not found")
+    if not taker_balance:
+        abort(400, "Taker balance not found")
+
+    usd_amount, lbp_amount, amount_to, usd_to_lbp, dir = fill_amounts(offer, requested_amount)
+
+    # Check if taker has sufficient balance maker's balance was already reserved at offer creation, so we only check the taker balance here 
+    if usd_to_lbp:
+        if taker_balance.usd_amount < usd_amount:
+            abort(400, f"Insufficient USD balance. Required: {usd_amount}, Available: {taker_balance.usd_amount}")
+    else:
+        if taker_balance.lbp_amount < lbp_amount:
+            abort(400, f"Insufficient LBP balance. Required: {lbp_amount}, Available: {taker_balance.lbp_amount}")
+
+    # Get usernames for maker and taker
+    maker = User.query.filter_by(id=offer.user_id).first()
+    taker = User.query.filter_by(id=user_id).first()
+    maker_username = maker.user_name if maker and maker.user_name else "Unknown"
+    taker_username = taker.user_name if taker and taker.user_name else "Unknown"
+
+    # Create Trade and Transaction records, move balances and update the offer
+    trade, transaction = settle_fill(
+        offer,
+        requested_amount,
+        user_id,
+        taker_balance,
+        maker_balance,
+        maker_username,
+        taker_username
+    )
+
+    # Notify taker (current user) of trade completion
+    trade_msg = f"Trade completed: You {'bought' if dir=='buy' else 'sold'} {requested_amount} {offer.from_currency} at rate {offer.exchange_rate}."
+    create_notification(user_id, trade_msg, 'trade')
+
+    # Notify maker (offer owner) that their offer was accepted
+    maker_msg = f"Your offer #{offer.id} was accepted by {taker_username} for {requested_amount} {offer.from_currency} at rate {offer.exchange_rate}."
+    create_notification(offer.user_id, maker_msg, 'offer')
+
+    db.session.flush()
+    return offer, trade, transaction
+
+
+def _sweep_totals(results):
+    usd_filled = sum(t.usd_amount for _, _, t in results)
+    lbp_filled = sum(t.lbp_amount for _, _, t in results)
+    return usd_filled, lbp_filled, lbp_filled / usd_filled if usd_filled else None
+
+
+def _sweep_command(user_id, direction, usd_quantity, worst_price):
+    results, usd_unfilled = sweep_offers(user_id, direction, usd_quantity, worst_price)
+    if not results:
+        abort(400, "No offers available within the requested price")
+
+    for offer, trade, _ in results:
+        maker_msg = f"Your offer #{offer.id} was accepted by {trade.taker_username} for {trade.amount_from} {offer.from_currency} at rate {offer.exchange_rate}."
+        create_notification(offer.user_id, maker_msg, 'offer')
+    usd_filled, _, vwap = _sweep_totals(results)
+    trade_msg = f"Sweep completed: You {'bought' if direction == 'buy' else 'sold'} {usd_filled} USD across {len(results)} offer(s) at average rate {vwap}."
+    create_notification(user_id, trade_msg, 'trade')
+
+    db.session.flush()
+    return results, usd_unfilled
+
+
+def _batch_accept_command(user_id, legs, all_or_nothing):
+    results = batch_accept(user_id, legs, all_or_nothing)
+
+    filled = [r for r in results if not r["error"]]
+    for r in filled:
+        offer, trade = r["offer"], r["trade"]
+        maker_msg = f"Your offer #{offer.id} was accepted by {trade.taker_username} for {r['amount']} {offer.from_currency} at rate {offer.exchange_rate}."
+        create_notification(offer.user_id, maker_msg, 'offer')
+    if filled:
+        create_notification(user_id, f"Batch completed: {len(filled)} of {len(results)} offer(s) accepted.", 'trade')
+
+    db.session.flush()
+    return results
+
+
+def _bulk_cancel_command(user_id, from_currency, min_rate, max_rate):
+    query = db.session.query(Offer.id).filter(
+        Offer.user_id == user_id,
+        Offer.status.in_(["OPEN", "PARTIAL"])
+    )
+    if from_currency:
+        query = query.filter(Offer.from_currency == from_currency)
+    if min_rate is not None:
+        query = query.filter(Offer.exchange_rate >= min_rate)
+    if max_rate is not None:
+        query = query.filter(Offer.exchange_rate <= max_rate)
+
+    released = release_offers([row.id for row in query], "CANCELLED")
+    if not released:
+        return released
+
+    # the notification goes in with the cancel, not a commit of its own
+    create_notification(user_id, f"{len(released)} of your offers were cancelled.", 'offer')
+    return released
+
+
+def _cancel_offer_command(offer_id, user_id):
+    offer = for_update(db.session.query(Offer).filter_by(id=offer_id)).first()
+    if not offer:
+        abort(404, "Offer not found")
+
+    if offer.user_id != user_id:
+        abort(403, "Only the offer owner can cancel the offer") #forbidden acttion
+
+    if offer.status not in ["OPEN", "PARTIAL"]:
+        abort(400, f"Offer cannot be cancelled (status={offer.status})")
+
+    # Refund remaining amount_remaining to maker in the offer.from_currency
+    refund_amount = offer.amount_remaining
+    if refund_amount > 0:
+        maker_balance = for_update(db.session.query(UserBalance).filter_by(user_id=offer.user_id)).first()
+        if not maker_balance:
+            abort(400, "Maker balance not found for refund")
+        if offer.from_currency == "USD":
+            maker_balance.usd_amount += refund_amount
+        else:
+            maker_balance.lbp_amount += refund_amount
+        ledger.post(offer.user_id, offer.from_currency, refund_amount, "offer_refund", offer)
+
+    # mark as cancelled and zero remaining amount
+    offer.status = "CANCELLED"
+    offer.amount_remaining = 0
+
+    # Notify maker (offer owner) that their offer was cancelled
+    create_notification(user_id, f"Your offer #{offer.id} was cancelled.", 'offer')
+    return offer
+
 #create offers endpoint
 @offers_bp.route("/offers", methods=["POST"])
 @limiter.limit("10 per minute")
@@ -69,46 +355,68 @@ def create_offer():
     if exchange_rate <= 0:
         abort(400, "EXCHANGE_RATE MUST BE GREATER THAN 0")
 
-    # Subtract maker funds immediately
-    try:
-        maker_balance = db.session.query(UserBalance).filter_by(user_id=user_id).with_for_update().first()
-        if not maker_balance:
-            abort(400, "Maker balance not found")
-
-        if from_currency == "USD":
-            if maker_balance.usd_amount < amount:
-                abort(400, "Insufficient USD balance to create offer")
-            maker_balance.usd_amount -= amount
-        else:
-            if maker_balance.lbp_amount < amount:
-                abort(400, "Insufficient LBP balance to create offer")
-            maker_balance.lbp_amount -= amount
+    # Validate time in force, GTD needs a future expires_at
+    time_in_force = str(data.get("time_in_force") or "GTC").upper()
+    if time_in_force not in TIME_IN_FORCE:
+        abort(400, f"time_in_force MUST BE ONE OF {', '.join(TIME_IN_FORCE)}")
+
+    expires_at = None
+    if time_in_force == "GTD":
+        if not data.get("expires_at"):
+            abort(400, "MISSING FIELD: expires_at")
+        try:
+            expires_at = datetime.fromisoformat(str(data["expires_at"]))
+        except ValueError:
+            abort(400, "expires_at MUST BE AN ISO 8601 DATETIME")
+        if expires_at.tzinfo:
+            expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+        if expires_at <= utc_now():
+            abort(400, "expires_at MUST BE IN THE FUTURE")
+    elif data.get("expires_at"):
+        abort(400, "expires_at IS ONLY VALID WITH time_in_force GTD")
 
-        # Create Offer
-        offer = Offer(
-            user_id=user_id,
-            from_currency=from_currency,
-            to_currency=to_currency,
-            amount_total=amount,
-            exchange_rate=exchange_rate,
+    try:
+        offer, fills = _execute(
+            sequencers.pair_for(from_currency, to_currency),
+            _create_offer_command,
+            user_id,
+            from_currency,
+            to_currency,
+            amount,
+            exchange_rate,
+            bool(current_app.config.get("MATCHING_ENABLED")),
+            time_in_force,
+            expires_at
         )
-
-        db.session.add(offer)
-        db.session.commit()
+        order_book.apply(offer)
+        for resting_offer, trade, transaction in fills:
+            order_book.apply(resting_offer)
+            record_committed_transaction(transaction)
+            record_committed_trade(trade)
 
         # Audit log for offer creation
-        ip_address = request.remote_addr
-        log = create_audit_log(
+        create_audit_log(
             action_type=AuditActionType.OFFER_CREATED,
-            description=f"Offer created: {amount} {from_currency} to {to_currency} at rate {exchange_rate}.",
+            description=f"Offer created: {amount} {from_currency} to {to_currency} at rate {exchange_rate} ({time_in_force}).",
             user_id=user_id,
             entity_type="Offer",
             entity_id=offer.id,
             ip_address=request.remote_addr
         )
+        for resting_offer, trade, transaction in fills:
+            create_audit_log(
+                action_type=AuditActionType.OFFER_FULLY_FILLED if resting_offer.status == "FILLED" else AuditActionType.OFFER_PARTIALLY_FILLED,
+                description=f"Offer {resting_offer.id} matched by offer {offer.id} of user {user_id}: {trade.amount_from} {resting_offer.from_currency} at rate {trade.executed_rate}.",
+                user_id=user_id,
+                entity_type="Offer",
+                entity_id=resting_offer.id,
+                ip_address=request.remote_addr
+            )
+
         return jsonify({
             "message": "Offer created successfully",
-            "offer": offer_schema.dump(offer)
+            "offer": offer_schema.dump(offer),
+            "trades": trade_schema.dump([trade for _, trade, _ in fills])
         }), 201
     except HTTPException:
         raise
@@ -134,29 +442,79 @@ def get_offers():
     if direction not in ["buy", "sell"]:
         abort(400, "direction MUST BE 'buy' OR 'sell'")
 
-    query = Offer.query.filter(
-        Offer.status.in_(["OPEN", "PARTIAL"]),
-        Offer.amount_remaining > 0
-    )
+    limit, cursor = page_args(default_limit=20)
+    after = decode_cursor(cursor) if cursor else None
 
-    # User wants to BUY USD, so we want USD sellers
+    # pages come from the in-memory order book instead of a sorted table scan,
+    # the cursor is the (rate, id) of the last offer of the previous page
+    # User wants to BUY USD, so we want USD sellers, cheapest first
     if direction == "buy":
-        query = query.filter(
-            Offer.from_currency == "USD",
-            Offer.to_currency == "LBP"
-        ).order_by(Offer.exchange_rate.asc())
+        offers = order_book.page("USD", "LBP", limit + 1, after)
 
-    # User wants to SELL USD, so we want LBP sellers
+    # User wants to SELL USD, so we want LBP sellers, highest rate first
     elif direction == "sell":
-        query = query.filter(
-            Offer.from_currency == "LBP",
-            Offer.to_currency == "USD"
-        ).order_by(Offer.exchange_rate.desc())
+        offers = order_book.page("LBP", "USD", limit + 1, after)
+
+    next_cursor = None
+    if len(offers) > limit:
+        offers = offers[:limit]
+        next_cursor = encode_cursor(offers[-1]["exchange_rate"], offers[-1]["id"])
 
-    offers = query.limit(20).all()
+    return jsonify({
+        "offers": offers,
+        "limit": limit,
+        "next_cursor": next_cursor
+    }), 200
 
-    schema = OfferSchema(many=True)
-    return jsonify(schema.dump(offers)), 200
+
+# quantity aggregated per price level for both sides of the book
+@offers_bp.route("/orderbook/depth", methods=["GET"])
+@limiter.limit("10 per minute")
+@jwt_required
+def get_order_book_depth():
+    levels = request.args.get("levels")
+    try:
+        levels = int(levels) if levels else None
+    except ValueError:
+        abort(400, "levels MUST BE AN INTEGER")
+    if levels is not None and levels <= 0:
+        abort(400, "levels MUST BE GREATER THAN 0")
+
+    depth = order_book.depth(levels)
+    return jsonify({
+        "sequence": depth["sequence"], # pass to /orderbook/depth/diff to get what changed since
+        "epoch": depth["epoch"], # along with this, sequences of another epoch don't compare
+        "asks": depth["asks"], # USD sellers, USD -> LBP
+        "bids": depth["bids"]  # LBP sellers, LBP -> USD
+    }), 200
+
+
+# levels changed since a sequence (and epoch) from /orderbook/depth or a previous diff
+@offers_bp.route("/orderbook/depth/diff", methods=["GET"])
+@limiter.limit("60 per minute")
+@jwt_required
+def get_order_book_diff():
+    since = request.args.get("since")
+    if since is None:
+        abort(400, "MISSING since PARAMETER")
+    try:
+        since = int(since)
+    except ValueError:
+        abort(400, "since MUST BE AN INTEGER")
+    epoch = request.args.get("epoch")
+    if not epoch:
+        abort(400, "MISSING epoch PARAMETER")
+
+    diff = order_book.diff(since, epoch)
+    if diff is None:
+        # too far behind, or from before a restart, start over from a full snapshot
+        return jsonify({"error": "Sequence is no longer available, fetch /orderbook/depth again"}), 410
+    return jsonify({
+        "sequence": diff["sequence"],
+        "epoch": diff["epoch"],
+        "asks": diff["asks"], # quantity 0 means the level was emptied
+        "bids": diff["bids"]
+    }), 200
 
 
 @offers_bp.route("/offers/<int:offer_id>/accept", methods=["POST"])
@@ -178,104 +536,20 @@ def accept_offer(offer_id):
         abort(400, "'amount' must be greater than 0")
 
     try:
-        # Start transaction and lock the offer row with withforupdate
-        # any other session trying to access the same row has to wait
-        #this prevents overselling or race conditions
-        offer = db.session.query(Offer).filter_by(id=offer_id).with_for_update().first()
-        if not offer:
-            abort(404, "Offer not found")
-
-        if offer.user_id == user_id:
-            abort(400, "Cannot accept your own offer")
-
-        if offer.status not in ["OPEN", "PARTIAL"]:
-            abort(400, f"Offer is not available (status={offer.status})")
-
-        if requested_amount > offer.amount_remaining:
-            abort(400, f"Requested amount exceeds remaining offer ({offer.amount_remaining})")
-
-        # Get taker and maker balances with lock
-        taker_balance = db.session.query(UserBalance).filter_by(user_id=user_id).with_for_update().first()
-        maker_balance = db.session.query(UserBalance).filter_by(user_id=offer.user_id).with_for_update().first()
-        
-        if not maker_balance:
-            abort(400, "Maker balance not found")
-        if not taker_balance:
-            abort(400, "Taker balance not found")
-        
-
-        if offer.from_currency == "USD":
-            usd_amount = requested_amount # maker gives USD
-            amount_to = requested_amount * offer.exchange_rate  
-            lbp_amount = amount_to # taker gives LBP
-            usd_to_lbp = False
-            dir = "buy"
-        else:
-            amount_to = requested_amount / offer.exchange_rate # maker gives LBP
-            usd_amount = amount_to # taker receives USD
-            lbp_amount = requested_amount # maker gives LBP
-            usd_to_lbp = True
-            dir = "sell"
-
-        # Check if taker has sufficient balance maker's balance was already reserved at offer creation, so we only check the taker balance here 
-        if usd_to_lbp:
-            if taker_balance.usd_amount < usd_amount:
-                abort(400, f"Insufficient USD balance. Required: {usd_amount}, Available: {taker_balance.usd_amount}")
-        else:
-            if taker_balance.lbp_amount < lbp_amount:
-                abort(400, f"Insufficient LBP balance. Required: {lbp_amount}, Available: {taker_balance.lbp_amount}")
-
-        # Get usernames for maker and taker
-        maker = User.query.filter_by(id=offer.user_id).first()
-        taker = User.query.filter_by(id=user_id).first()
-        maker_username = maker.user_name if maker and maker.user_name else "Unknown"
-        taker_username = taker.user_name if taker and taker.user_name else "Unknown"
-
-        
-        # Create Trade record
-        trade = Trade(
-            offer_id=offer.id,
-            maker_id=offer.user_id,
-            taker_id=user_id,
-            maker_username=maker_username,
-            taker_username=taker_username,
-            amount_from=requested_amount, # amount that taker will get
-            amount_to=amount_to,
-            direction=dir, # specifies if taker was buying or selling usd
-            executed_rate=offer.exchange_rate
-        )
-        db.session.add(trade)
-
-        transaction = Transaction(
-            usd_amount=usd_amount,
-            lbp_amount=lbp_amount,
-            usd_to_lbp=usd_to_lbp,
-            user_id=user_id # logs the taker which is current user
+        offer, trade, transaction = _execute(
+            _offer_pair(offer_id),
+            _accept_offer_command,
+            offer_id,
+            user_id,
+            requested_amount
         )
-        db.session.add(transaction)
+        order_book.apply(offer)
+        record_committed_transaction(transaction)
+        record_committed_trade(trade)
 
-        # Update balances: maker's sell currency was subtracted at offer creation,
-        #so here we only credit the maker with the amount to and update the taker balance.
-        if offer.from_currency == "USD":
-            # Maker sold USD at creation; on accept, maker receives LBP, taker gives LBP and receives USD
-            taker_balance.lbp_amount -= lbp_amount
-            taker_balance.usd_amount += usd_amount
-            maker_balance.lbp_amount += lbp_amount
-        else:
-            # Maker sold LBP at creation; on accept, maker receives USD, taker gives USD and receives LBP
-            taker_balance.usd_amount -= usd_amount
-            taker_balance.lbp_amount += lbp_amount
-            maker_balance.usd_amount += usd_amount
-
-        maker_balance.updated_at = datetime.now(timezone.utc)
-        taker_balance.updated_at = datetime.now(timezone.utc)
-        # Update offer remaining amount
-        offer.amount_remaining -= requested_amount
-        if offer.amount_remaining == 0:
-            offer.status = "FILLED"
+        if offer.status == "FILLED":
             action_type = AuditActionType.OFFER_FULLY_FILLED
         else:
-            offer.status = "PARTIAL"
             action_type = AuditActionType.OFFER_PARTIALLY_FILLED
 
         # Audit log for offer acceptance
@@ -288,17 +562,6 @@ def accept_offer(offer_id):
             ip_address=request.remote_addr
         )
 
-        # Notify taker (current user) of trade completion
-        
-        trade_msg = f"Trade completed: You {'bought' if dir=='buy' else 'sold'} {requested_amount} {offer.from_currency} at rate {offer.exchange_rate}."
-        create_notification(user_id, trade_msg, 'trade')
-
-        # Notify maker (offer owner) that their offer was accepted
-        maker_msg = f"Your offer #{offer.id} was accepted by {taker_username} for {requested_amount} {offer.from_currency} at rate {offer.exchange_rate}."
-        create_notification(offer.user_id, maker_msg, 'offer')
-
-        db.session.commit()
-
         return jsonify({
             "message": "Offer accepted successfully",
             "trade_id": trade.id,
@@ -314,42 +577,240 @@ def accept_offer(offer_id):
         abort(500, "Trade offer could not be accepted")
 
 
-@offers_bp.route("/offers/<int:offer_id>", methods=["DELETE"])
+# fill a quantity of USD across the best offers in one request and one db transaction
+@offers_bp.route("/offers/sweep", methods=["POST"])
+@limiter.limit("10 per minute")
 @jwt_required
-def cancel_offer(offer_id):
+def sweep_offers_endpoint():
     user_id = g.current_user_id
+    data = request.json
+    if not data:
+        abort(400, "INVALID JSON PAYLOAD")
 
+    for field in ["direction", "amount"]:
+        if field not in data:
+            abort(400, f"MISSING FIELD: {field}")
+
+    direction = str(data.get("direction")).lower()
+    if direction not in ["buy", "sell"]:
+        abort(400, "direction MUST BE 'buy' OR 'sell'")
+
+    # amount is always in USD, worst_price bounds the rate (omit for a market sweep)
     try:
-        offer = db.session.query(Offer).filter_by(id=offer_id).with_for_update().first()
-        if not offer:
-            abort(404, "Offer not found")
-
-        if offer.user_id != user_id:
-            abort(403, "Only the offer owner can cancel the offer") #forbidden acttion
-
-        if offer.status not in ["OPEN", "PARTIAL"]:
-            abort(400, f"Offer cannot be cancelled (status={offer.status})")
-
-        # Refund remaining amount_remaining to maker in the offer.from_currency
-        refund_amount = offer.amount_remaining
-        if refund_amount > 0:
-            maker_balance = db.session.query(UserBalance).filter_by(user_id=offer.user_id).with_for_update().first()
-            if not maker_balance:
-                abort(400, "Maker balance not found for refund")
-            if offer.from_currency == "USD":
-                maker_balance.usd_amount += refund_amount
-            else:
-                maker_balance.lbp_amount += refund_amount
-
-        # mark as cancelled and zero remaining amount
-        offer.status = "CANCELLED"
-        offer.amount_remaining = 0
+        usd_quantity = float(data.get("amount"))
+        worst_price = float(data["worst_price"]) if data.get("worst_price") is not None else None
+    except (ValueError, TypeError):
+        abort(400, "AMOUNT AND WORST_PRICE MUST BE NUMBERS")
 
-        # Notify maker (offer owner) that their offer was cancelled
-        cancel_msg = f"Your offer #{offer.id} was cancelled."
-        create_notification(user_id, cancel_msg, 'offer')
+    if usd_quantity <= 0:
+        abort(400, "AMOUNT MUST BE GREATER THAN 0")
+    if worst_price is not None and worst_price <= 0:
+        abort(400, "WORST_PRICE MUST BE GREATER THAN 0")
 
-        db.session.commit()
+    try:
+        # both directions trade the USD/LBP pair
+        results, usd_unfilled = _execute(
+            sequencers.pair_for("USD", "LBP"),
+            _sweep_command,
+            user_id,
+            direction,
+            usd_quantity,
+            worst_price
+        )
+        for offer, trade, transaction in results:
+            order_book.apply(offer)
+            record_committed_transaction(transaction)
+            record_committed_trade(trade)
+
+        usd_filled, lbp_filled, vwap = _sweep_totals(results)
+
+        for offer, trade, transaction in results:
+            create_audit_log(
+                action_type=AuditActionType.OFFER_FULLY_FILLED if offer.status == "FILLED" else AuditActionType.OFFER_PARTIALLY_FILLED,
+                description=f"Offer {offer.id} swept by user {user_id}: {trade.amount_from} {offer.from_currency} at rate {offer.exchange_rate}.",
+                user_id=user_id,
+                entity_type="Offer",
+                entity_id=offer.id,
+                ip_address=request.remote_addr
+            )
+
+        return jsonify({
+            "message": "Sweep completed",
+            "usd_filled": usd_filled,
+            "lbp_filled": lbp_filled,
+            "usd_unfilled": usd_unfilled,
+            "vwap": vwap,
+            "trades": trade_schema.dump([trade for _, trade, _ in results])
+        }), 201
+
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"error occured {str(e)}")
+        abort(500, "Sweep could not be completed")
+
+
+# accept many offers in one request, one lock statement per table and one commit
+@offers_bp.route("/offers/accept/batch", methods=["POST"])
+@jwt_required
+def batch_accept_offers():
+    user_id = g.current_user_id
+    data = request.json
+    if not data or not isinstance(data.get("legs"), list) or not data["legs"]:
+        abort(400, "Missing 'legs' list in request body")
+
+    if len(data["legs"]) > 100:
+        abort(400, "A batch can contain at most 100 legs")
+
+    legs = []
+    for index, leg in enumerate(data["legs"]):
+        if not isinstance(leg, dict) or "offer_id" not in leg or "amount" not in leg:
+            abort(400, f"Leg {index} must have 'offer_id' and 'amount'")
+        try:
+            offer_id = int(leg["offer_id"])
+            amount = float(leg["amount"])
+        except (ValueError, TypeError):
+            abort(400, f"Leg {index}: 'offer_id' and 'amount' must be numbers")
+        if amount <= 0:
+            abort(400, f"Leg {index}: 'amount' must be greater than 0")
+        legs.append((offer_id, amount))
+
+    # by default any invalid leg rejects the whole batch, partial=true fills what it can
+    partial = data.get("partial", False)
+    if not isinstance(partial, bool):
+        abort(400, "'partial' must be true or false")
+    all_or_nothing = not partial
+
+    try:
+        results = _execute(
+            sequencers.pair_for("USD", "LBP"),
+            _batch_accept_command,
+            user_id,
+            legs,
+            all_or_nothing
+        )
+        filled = [r for r in results if not r["error"]]
+
+        for r in filled:
+            order_book.apply(r["offer"])
+            record_committed_transaction(r["transaction"])
+            record_committed_trade(r["trade"])
+
+        for r in filled:
+            offer, trade = r["offer"], r["trade"]
+            create_audit_log(
+                action_type=AuditActionType.OFFER_FULLY_FILLED if offer.status == "FILLED" else AuditActionType.OFFER_PARTIALLY_FILLED,
+                description=f"Offer {offer.id} accepted by user {user_id} in batch: {r['amount']} {offer.from_currency} at rate {offer.exchange_rate}.",
+                user_id=user_id,
+                entity_type="Offer",
+                entity_id=offer.id,
+                ip_address=request.remote_addr
+            )
+
+        return jsonify({
+            "message": "Batch processed",
+            "filled": len(filled),
+            "rejected": len(results) - len(filled),
+            "legs": [
+                {
+                    "offer_id": r["offer_id"],
+                    "amount": r["amount"],
+                    "error": r["error"],
+                    "trade_id": r["trade"].id if not r["error"] else None,
+                    "offer_status": r["offer"].status if not r["error"] else None,
+                    "amount_remaining": r["offer"].amount_remaining if not r["error"] else None
+                } for r in results
+            ]
+        }), 201 if filled else 400
+
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"error occured {str(e)}")
+        abort(500, "Batch could not be accepted")
+
+
+# cancel many of the caller's offers at once: all of them, one currency sold, and/or a rate range
+@offers_bp.route("/offers/cancel", methods=["POST"])
+@limiter.limit("10 per minute")
+@jwt_required
+def bulk_cancel_offers():
+    user_id = g.current_user_id
+    data = request.get_json(silent=True) or {}
+
+    # the currency the offers sell, same field as when creating them: 'USD' cancels USD -> LBP offers
+    if "side" in data:
+        # a buy/sell side reads differently from each end of the book, refuse it rather than
+        # ignore it and cancel everything
+        abort(400, "side IS NOT SUPPORTED, USE from_currency ('USD' OR 'LBP')")
+    from_currency = data.get("from_currency")
+    if from_currency is not None:
+        from_currency = str(from_currency).upper()
+        if from_currency not in ["USD", "LBP"]:
+            abort(400, "from_currency MUST BE 'USD' OR 'LBP'")
+
+    try:
+        min_rate = float(data["min_rate"]) if data.get("min_rate") is not None else None
+        max_rate = float(data["max_rate"]) if data.get("max_rate") is not None else None
+    except (ValueError, TypeError):
+        abort(400, "MIN_RATE AND MAX_RATE MUST BE NUMBERS")
+    if min_rate is not None and max_rate is not None and min_rate > max_rate:
+        abort(400, "MIN_RATE MUST NOT BE GREATER THAN MAX_RATE")
+
+    try:
+        released = _execute(
+            sequencers.pair_for("USD", "LBP"),
+            _bulk_cancel_command,
+            user_id,
+            from_currency,
+            min_rate,
+            max_rate
+        )
+        order_book.discard(released)
+
+        # audit rows are queued only once the cancel is committed
+        add_audit_logs([
+            {
+                "action_type": AuditActionType.OFFER_CANCELLED,
+                "description": f"Offer {row.id} cancelled by user {user_id} in bulk.",
+                "user_id": user_id,
+                "entity_type": "Offer",
+                "entity_id": row.id,
+                "ip_address": request.remote_addr
+            } for row in released
+        ])
+
+        refunded = {"USD": 0.0, "LBP": 0.0}
+        for row in released:
+            refunded[row.from_currency] += row.amount_remaining
+
+        return jsonify({
+            "message": "Offers cancelled",
+            "cancelled": len(released),
+            "offer_ids": [row.id for row in released],
+            "refunded": refunded
+        }), 200
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        print(f"error occured {str(e)}")
+        abort(500, "Offers could not be cancelled")
+
+
+@offers_bp.route("/offers/<int:offer_id>", methods=["DELETE"])
+@jwt_required
+def cancel_offer(offer_id):
+    user_id = g.current_user_id
+
+    try:
+        offer = _execute(_offer_pair(offer_id), _cancel_offer_command, offer_id, user_id)
+        order_book.apply(offer)
 
         # Audit log for offer cancellation
         create_audit_log(
@@ -374,15 +835,23 @@ def cancel_offer(offer_id):
 @jwt_required
 def get_my_trades():
     user_id = g.current_user_id
+    limit, cursor = page_args()
 
     try:
-        # include trades where user was maker or taker
-        trades = db.session.query(Trade).filter(
+        # include trades where user was maker or taker, newest first
+        query = db.session.query(Trade).filter(
             (Trade.maker_id == user_id) | (Trade.taker_id == user_id)
-        ).order_by(Trade.created_at.desc()).limit(100).all()
+        )
+        trades, next_cursor = keyset_page(query, Trade.created_at, Trade.id, limit, cursor)
 
-        return jsonify({"trades": trade_schema.dump(trades)}), 200
+        return jsonify({
+            "trades": trade_schema.dump(trades),
+            "limit": limit,
+            "next_cursor": next_cursor
+        }), 200
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"error occured {str(e)}")
         abort(500, "Could not retrieve trades")
\ No newline at end of file
@@ -3,6 +3,7 @@ from extensions import db
 from model.user import User
 from model.userPreferences import UserPreferences, UserPreferencesSchema
 from utils import log_preference_change
+from candles import HISTORY_INTERVALS
 from jwtAuth import jwt_required
 from model.audit_log import AuditLog, AuditLogSchema    
 
@@ -36,7 +37,7 @@ def set_preferences():
     #update preferences based on provided data, if a field is not provided or invalid it will remain unchanged
     if 'default_time_range' in data and data['default_time_range'] in ['1d', '3d', '1w', '1m']:
         prefs.default_time_range = data['default_time_range']
-    if 'graph_interval' in data and data['graph_interval'] in ['hourly', 'daily']:
+    if 'graph_interval' in data and data['graph_interval'] in HISTORY_INTERVALS:
         prefs.graph_interval = data['graph_interval']
     db.session.commit()
     # Audit log for preference updateuser
@@ -6,7 +6,8 @@ from model.audit_log import AuditLog, AuditActionType
 import jwtAuth
 from datetime import datetime, timedelta, timezone
 from jwt import ExpiredSignatureError, InvalidTokenError
-from utils import create_audit_log, create_notification
+from utils import create_audit_log, create_notification, record_committed_transaction
+from pagination import page_args, keyset_page
 
 
 transactions_bp = Blueprint('transactions', __name__)
@@ -28,13 +29,20 @@ def get_user_transactions():
         abort(401, "error: Unauthorized user")
     
     #here the user is authenticated
-    transactions=db.session.execute(
-        db.select(Transaction).where(Transaction.user_id==user_id)
-    ).scalars().all()
+    limit, cursor = page_args()
+    transactions, next_cursor = keyset_page(
+        Transaction.query.filter(Transaction.user_id==user_id),
+        Transaction.added_date,
+        Transaction.id,
+        limit,
+        cursor
+    )
 
     return jsonify({
         "message":"Retrieved user's transactions",
-        "transactions":transactions_schema.dump(transactions)
+        "transactions":transactions_schema.dump(transactions),
+        "limit": limit,
+        "next_cursor": next_cursor
     }), 200
 
 
@@ -87,13 +95,13 @@ def add_transaction():
         user_id=user_id,
     )
     db.session.add(t)
-    db.session.commit()
-    # Notify user of transaction completion
+    # Notify user of transaction completion, written with the transaction's commit
     if user_id:
         direction = 'USD to LBP' if usd_to_lbp else 'LBP to USD'
         msg = f"Transaction completed: {usd_amount} USD, {lbp_amount} LBP, Direction: {direction}."
         create_notification(user_id, msg, 'transaction')
-
+    db.session.commit()
+    record_committed_transaction(t)
 
     create_audit_log(
         action_type=AuditActionType.TRANSACTION_CREATED,
@@ -0,0 +1,45 @@
+from sqlalchemy import inspect, text
+from extensions import db
+from model.offer import Offer
+from model.notificationCounter import NotificationCounter
+
+#there are no migrations: tables and columns added to existing models are created here.
+#Every step checks first, running it again changes nothing
+
+# tables every request path needs, the notification outbox keeps the unread counters on each commit
+ADDED_TABLES = [NotificationCounter]
+
+# (table, column, ddl) for columns added after the table was first created,
+# NOT NULL columns carry a default so existing rows get a value
+ADDED_COLUMNS = [
+    # time in force (GTC/GTD/IOC/FOK) and GTD expiry
+    ("offer", "time_in_force", "VARCHAR(3) NOT NULL DEFAULT 'GTC'"),
+    ("offer", "expires_at", "DATETIME NULL"),
+    # optimistic concurrency, version_id_col on both models
+    ("offer", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("user_balance", "version", "INTEGER NOT NULL DEFAULT 1"),
+]
+
+
+def upgrade_schema():
+    """
+    Add missing tables, columns and indexes to an existing database. Returns the names of what was added.
+    """
+    added = []
+    inspector = inspect(db.engine)
+    for model in ADDED_TABLES:
+        if not inspector.has_table(model.__tablename__):
+            model.__table__.create(db.engine)
+            added.append(model.__tablename__)
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                added.append(f"{table}.{column}")
+    # indexes the new columns are queried by
+    for index in Offer.__table__.indexes:
+        if index.name not in {i["name"] for i in inspect(db.engine).get_indexes("offer")}:
+            index.create(db.engine)
+            added.append(index.name)
+    return added
@@ -0,0 +1,140 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+from extensions import db
+
+
+class PairSequencer(threading.Thread):
+    """
+    Single writer for one currency pair. Commands are applied in submission order, each in
+    its own savepoint, and committed together every commit_interval seconds (or max_batch
+    commands). Callers wait on the returned future, which resolves only after the commit,
+    with objects already detached from this thread's session.
+    """
+
+    def __init__(self, app, pair, commit_interval=0.005, max_batch=100):
+        super().__init__(name=f"sequencer-{'/'.join(pair)}", daemon=True)
+        self.app = app
+        self.pair = pair
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.commands = queue.Queue()
+        self.batches = 0
+        self.applied = 0
+
+    def submit(self, command, *args):
+        future = Future()
+        self.commands.put((command, args, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.commands.get()]
+        deadline = time.monotonic() + self.commit_interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.commands.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        with self.app.app_context():
+            # results are read by the waiting request threads after the commit,
+            # keep their loaded state instead of expiring it
+            db.session().expire_on_commit = False
+            while True:
+                batch = self._next_batch()
+                try:
+                    outcomes = self._apply(batch)
+                except Exception as e:
+                    # never let one bad batch stop the pair
+                    print(f"sequencer {self.name} error {str(e)}")
+                    db.session.rollback()
+                    outcomes = [
+                        (future, None, e) for _, _, future in batch
+                        if future.running() or (not future.done() and future.set_running_or_notify_cancel())
+                    ]
+                finally:
+                    # detach everything before the callers see it and start the next batch
+                    # with an empty identity map so no stale balances are reused
+                    db.session.expunge_all()
+                self._resolve(outcomes)
+
+    @staticmethod
+    def _resolve(outcomes):
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _apply(self, batch):
+        # each command gets a savepoint, the whole batch one commit.
+        # returns (future, result, error) for every command that ran, resolved by the caller
+        outcomes = []
+        for command, args, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            savepoint = db.session.begin_nested()
+            try:
+                result = command(*args)
+                savepoint.commit()
+                outcomes.append((future, result, None))
+            except Exception as e:
+                # only this command is undone, the rest of the batch still commits
+                savepoint.rollback()
+                outcomes.append((future, None, e))
+
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return [(future, None, error or e) for future, _, error in outcomes]
+
+        self.batches += 1
+        self.applied += len(outcomes)
+        return outcomes
+
+
+class SequencerRegistry:
+    """
+    One PairSequencer thread per currency pair, started on first use.
+    """
+
+    def __init__(self):
+        self._sequencers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pair_for(from_currency, to_currency):
+        # both directions of a pair share a sequencer
+        return tuple(sorted((from_currency, to_currency)))
+
+    def submit(self, app, pair, command, *args):
+        with self._lock:
+            sequencer = self._sequencers.get(pair)
+            if sequencer is None:
+                sequencer = self._sequencers[pair] = PairSequencer(
+                    app,
+                    pair,
+                    commit_interval=app.config.get("SEQUENCER_COMMIT_INTERVAL", 0.005)
+                )
+                sequencer.start()
+        return sequencer.submit(command, *args)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "/".join(pair): {
+                    "queued": s.commands.qsize(),
+                    "batches": s.batches,
+                    "applied": s.applied,
+                } for pair, s in self._sequencers.items()
+            }
+
+
+sequencers = SequencerRegistry()
@@ -0,0 +1,33 @@
+import glob
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask
+from extensions import db, ma, bcrypt
+
+# every model registers its table, same as the app does on import. Schemas configure the
+# mappers when they are defined, so the models others refer to by name come first
+import model.user, model.offer, model.trade, model.transaction  # noqa: E401,F401
+for path in sorted(glob.glob(os.path.join(ROOT, "model", "*.py"))):
+    importlib.import_module("model." + os.path.basename(path)[:-3])
+
+
+@pytest.fixture
+def app():
+    # in-memory sqlite, a fresh schema per test, like benchmarks/matching_benchmark.py
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    ma.init_app(app)
+    bcrypt.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
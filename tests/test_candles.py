@@ -0,0 +1,29 @@
+"""
+Tests for the history bucket count in candles.py, no db needed.
+
+    python -m pytest tests
+"""
+from datetime import datetime
+
+import candles
+
+
+def test_counts_the_day_get_candles_adds():
+    # a same day range still covers the whole end day
+    assert candles.history_buckets(datetime(2025, 1, 1), datetime(2025, 1, 1), "1h") == 24
+    assert candles.history_buckets(datetime(2025, 1, 1), datetime(2025, 1, 7), "1d") == 7
+
+
+def test_start_is_aligned_to_its_bucket():
+    assert candles.history_buckets(datetime(2025, 1, 1, 13, 30), datetime(2025, 1, 1), "1h") == 11
+    assert candles.history_buckets(datetime(2025, 1, 1, 13, 30), datetime(2025, 1, 1), "4h") == 3
+
+
+def test_weeks_are_monday_aligned():
+    # wednesday to tuesday spans two monday weeks, monday to sunday only one
+    assert candles.history_buckets(datetime(2025, 1, 1), datetime(2025, 1, 7), "weekly") == 2
+    assert candles.history_buckets(datetime(2025, 1, 6), datetime(2025, 1, 12), "weekly") == 1
+
+
+def test_empty_range():
+    assert candles.history_buckets(datetime(2025, 1, 5), datetime(2025, 1, 1), "1d") == 0
@@ -0,0 +1,138 @@
+"""
+Unit tests for the pure matcher in matching.py, no Flask or db needed.
+
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matching
+from matching import RestingOrder
+
+T0 = datetime(2025, 1, 1)
+
+
+def at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+
+def test_best_price_first_for_usd_seller():
+    # an incoming USD seller hits the highest LBP bid first
+    resting = [
+        RestingOrder(1, 10, "LBP", 89000, 89000 * 5, at(0)),
+        RestingOrder(2, 11, "LBP", 90000, 90000 * 5, at(1)),
+        RestingOrder(3, 12, "LBP", 89500, 89500 * 5, at(2)),
+    ]
+    fills, remaining = matching.match_order(1, "USD", 12, 89000, resting)
+    assert [f.resting_id for f in fills] == [2, 3, 1]
+    assert [f.price for f in fills] == [90000, 89500, 89000]
+    assert remaining == 0
+
+
+def test_best_price_first_for_lbp_seller():
+    # an incoming LBP seller hits the lowest USD ask first
+    resting = [
+        RestingOrder(1, 10, "USD", 90000, 5, at(0)),
+        RestingOrder(2, 11, "USD", 89000, 5, at(1)),
+    ]
+    fills, remaining = matching.match_order(1, "LBP", 89000 * 5 + 90000 * 2, 90000, resting)
+    assert [f.resting_id for f in fills] == [2, 1]
+    assert fills[0].usd_amount == 5
+    assert fills[1].usd_amount == pytest.approx(2)
+    assert remaining == 0
+
+
+def test_same_price_oldest_then_lowest_id():
+    resting = [
+        RestingOrder(5, 10, "USD", 89000, 1, at(2)),
+        RestingOrder(7, 11, "USD", 89000, 1, at(1)),
+        RestingOrder(6, 12, "USD", 89000, 1, at(1)),
+    ]
+    fills, _ = matching.match_order(1, "LBP", 89000 * 3, 89000, resting)
+    assert [f.resting_id for f in fills] == [6, 7, 5]
+
+
+def test_input_order_does_not_matter():
+    resting = [
+        RestingOrder(i, 10 + i, "LBP", 89000 + (i % 3) * 100, 89000, at(i % 4))
+        for i in range(1, 10)
+    ]
+    forward, _ = matching.match_order(1, "USD", 4, 89000, resting)
+    backward, _ = matching.match_order(1, "USD", 4, 89000, list(reversed(resting)))
+    assert forward == backward
+
+
+def test_partial_fill_of_resting_order():
+    resting = [RestingOrder(1, 10, "USD", 89000, 10, at(0))]
+    fills, remaining = matching.match_order(1, "LBP", 89000 * 4, 89000, resting)
+    assert len(fills) == 1
+    fill = fills[0]
+    assert fill.usd_amount == pytest.approx(4)
+    assert fill.lbp_amount == 89000 * 4
+    # the resting ask keeps the other 6 USD
+    assert fill.resting_consumed == pytest.approx(4)
+    assert fill.incoming_consumed == 89000 * 4
+    assert remaining == 0
+
+
+def test_partial_fill_of_incoming_order():
+    resting = [
+        RestingOrder(1, 10, "LBP", 90000, 90000 * 2, at(0)),
+        RestingOrder(2, 11, "LBP", 89000, 89000 * 1, at(1)),
+    ]
+    fills, remaining = matching.match_order(1, "USD", 5, 89000, resting)
+    assert [f.resting_id for f in fills] == [1, 2]
+    # both bids are fully consumed, with their exact amounts
+    assert fills[0].resting_consumed == 90000 * 2
+    assert fills[1].resting_consumed == 89000 * 1
+    assert sum(f.usd_amount for f in fills) == pytest.approx(3)
+    assert remaining == pytest.approx(2)
+
+
+def test_stops_at_first_price_that_does_not_cross():
+    resting = [
+        RestingOrder(1, 10, "USD", 89000, 1, at(0)),
+        RestingOrder(2, 11, "USD", 90000, 1, at(1)),
+    ]
+    fills, remaining = matching.match_order(1, "LBP", 89000 + 90000, 89500, resting)
+    assert [f.resting_id for f in fills] == [1]
+    assert remaining == 90000
+
+
+def test_no_cross_no_fills():
+    resting = [RestingOrder(1, 10, "LBP", 88000, 88000, at(0))]
+    fills, remaining = matching.match_order(1, "USD", 1, 89000, resting)
+    assert fills == []
+    assert remaining == 1
+
+
+def test_own_orders_are_skipped():
+    resting = [
+        RestingOrder(1, 1, "USD", 88000, 5, at(0)),
+        RestingOrder(2, 10, "USD", 89000, 5, at(1)),
+    ]
+    fills, remaining = matching.match_order(1, "LBP", 89000 * 2, 89000, resting)
+    # the better priced ask belongs to the taker, it is passed over not matched
+    assert [f.resting_id for f in fills] == [2]
+    assert remaining == 0
+
+
+def test_only_own_orders_leaves_everything_unfilled():
+    resting = [RestingOrder(1, 1, "LBP", 90000, 90000, at(0))]
+    fills, remaining = matching.match_order(1, "USD", 1, 89000, resting)
+    assert fills == []
+    assert remaining == 1
+
+
+def test_exhausted_resting_orders_are_skipped():
+    resting = [
+        RestingOrder(1, 10, "USD", 88000, matching.EPSILON / 2, at(0)),
+        RestingOrder(2, 11, "USD", 89000, 1, at(1)),
+    ]
+    fills, _ = matching.match_order(1, "LBP", 89000, 89000, resting)
+    assert [f.resting_id for f in fills] == [2]
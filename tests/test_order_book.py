@@ -0,0 +1,79 @@
+"""
+The in-memory order book against snapshots that arrive out of order.
+"""
+from model.offer import Offer
+from orderBook import OrderBook
+
+
+def snapshot(version, status, remaining, offer_id=1, rate=90000):
+    # a detached offer as a request thread hands it to the book after its commit
+    offer = Offer(7, "USD", "LBP", 10, rate)
+    offer.id = offer_id
+    offer.version = version
+    offer.status = status
+    offer.amount_remaining = remaining
+    return offer
+
+
+def loaded_book():
+    book = OrderBook()
+    book.load()
+    return book
+
+
+def test_snapshots_apply_in_version_order(app):
+    book = loaded_book()
+    book.apply(snapshot(1, "OPEN", 10))
+    book.apply(snapshot(2, "PARTIAL", 6))
+    assert book.depth()["asks"] == [{"price": 90000, "quantity": 6, "offers": 1}]
+
+
+def test_late_snapshot_does_not_bring_back_a_filled_offer(app):
+    book = loaded_book()
+    book.apply(snapshot(1, "OPEN", 10))
+    book.apply(snapshot(3, "FILLED", 0))
+    before = book.depth()
+
+    # the PARTIAL of the fill before the last one, handed over after it
+    book.apply(snapshot(2, "PARTIAL", 6))
+    assert book.depth() == before
+    assert before["asks"] == []
+    diff = book.diff(before["sequence"], before["epoch"])
+    assert diff["asks"] == [] and diff["bids"] == []
+    assert diff["sequence"] == before["sequence"]
+
+
+def test_late_snapshot_does_not_grow_a_level(app):
+    book = loaded_book()
+    book.apply(snapshot(1, "OPEN", 10))
+    book.apply(snapshot(3, "PARTIAL", 4))
+    before = book.depth()
+    book.apply(snapshot(2, "PARTIAL", 6))
+    assert book.depth() == before
+    assert before["asks"] == [{"price": 90000, "quantity": 4, "offers": 1}]
+
+
+def test_late_snapshot_after_bulk_release(app):
+    book = loaded_book()
+    book.apply(snapshot(1, "OPEN", 10))
+    book.apply(snapshot(2, "PARTIAL", 6))
+
+    class Released:
+        # a row from trading.release_offers, version as read before the release
+        id = 1
+        version = 2
+
+    book.discard([Released])
+    before = book.depth()
+    book.apply(snapshot(2, "PARTIAL", 6))
+    book.apply(snapshot(1, "OPEN", 10))
+    assert book.depth() == before
+    assert book.diff(before["sequence"], before["epoch"])["sequence"] == before["sequence"]
+
+
+def test_create_and_fill_handed_over_in_reverse(app):
+    # sequencer mode: a create and its accept commit in one batch, the futures resolve in any order
+    book = loaded_book()
+    book.apply(snapshot(2, "FILLED", 0))
+    book.apply(snapshot(1, "OPEN", 10))
+    assert book.depth()["asks"] == []
@@ -0,0 +1,221 @@
+"""
+Tests for the settlement paths in trading.py against in-memory SQLite, see conftest.py.
+
+    python -m pytest tests
+"""
+import pytest
+from werkzeug.exceptions import HTTPException
+
+from extensions import db
+from model.offer import Offer
+from model.trade import Trade
+from model.user import User
+from model.userBalance import UserBalance
+import trading
+
+
+def user(name, usd=1000.0, lbp=1e9):
+    u = User(name, "pw")
+    db.session.add(u)
+    db.session.flush()
+    db.session.add(UserBalance(u.id, usd_amount=usd, lbp_amount=lbp))
+    return u.id
+
+
+def resting(user_id, from_currency, amount, rate):
+    # a resting offer, its funds already taken out of the owner's balance
+    to_currency = "LBP" if from_currency == "USD" else "USD"
+    offer = Offer(user_id, from_currency, to_currency, amount, rate)
+    db.session.add(offer)
+    db.session.flush()
+    return offer.id
+
+
+def balance(user_id):
+    b = UserBalance.query.filter_by(user_id=user_id).one()
+    return b.usd_amount, b.lbp_amount
+
+
+def incoming(user_id, from_currency, amount, rate):
+    # what offer creation does: lock, reserve the taker's funds, flush, then match
+    to_currency = "LBP" if from_currency == "USD" else "USD"
+    resting_offers, balances = trading.lock_for_incoming(user_id, from_currency, to_currency, amount, rate)
+    taker_balance = balances[user_id]
+    if from_currency == "USD":
+        taker_balance.usd_amount -= amount
+    else:
+        taker_balance.lbp_amount -= amount
+    offer = Offer(user_id, from_currency, to_currency, amount, rate)
+    db.session.add(offer)
+    db.session.flush()
+    return offer, trading.match_incoming_offer(offer, taker_balance, resting_offers, balances)
+
+
+def test_match_incoming_offer_best_price_first(app):
+    maker, taker = user("maker"), user("taker")
+    cheap = resting(maker, "USD", 5, 89000)
+    dear = resting(maker, "USD", 5, 90000)
+    db.session.commit()
+
+    offer, fills = incoming(taker, "LBP", 89000 * 5 + 90000 * 2, 90000)
+    db.session.commit()
+
+    assert [o.id for o, _, _ in fills] == [cheap, dear]
+    assert offer.status == "FILLED" and offer.amount_remaining == 0
+    assert db.session.get(Offer, cheap).status == "FILLED"
+    assert db.session.get(Offer, dear).status == "PARTIAL"
+    assert db.session.get(Offer, dear).amount_remaining == pytest.approx(3)
+    assert balance(taker) == pytest.approx((1007, 1e9 - 89000 * 5 - 90000 * 2))
+    assert balance(maker) == pytest.approx((1000, 1e9 + 89000 * 5 + 90000 * 2))
+
+
+def test_match_incoming_offer_skips_own_and_non_crossing(app):
+    maker, taker = user("maker"), user("taker")
+    resting(taker, "USD", 5, 88000)
+    resting(maker, "USD", 5, 91000)
+    db.session.commit()
+
+    offer, fills = incoming(taker, "LBP", 89000 * 5, 90000)
+    assert fills == []
+    assert offer.status == "OPEN" and offer.amount_remaining == 89000 * 5
+
+
+def test_settle_fill_moves_balances(app):
+    maker, taker = user("maker"), user("taker")
+    offer_id = resting(maker, "USD", 10, 89000)
+    db.session.commit()
+
+    offer = db.session.get(Offer, offer_id)
+    balances = trading.lock_balances({maker, taker})
+    trade, transaction = trading.settle_fill(offer, 4, taker, balances[taker], balances[maker], "maker", "taker")
+    db.session.commit()
+
+    assert offer.status == "PARTIAL" and offer.amount_remaining == 6
+    assert (trade.maker_id, trade.taker_id, trade.amount_from, trade.amount_to) == (maker, taker, 4, 89000 * 4)
+    assert (transaction.usd_amount, transaction.lbp_amount, transaction.user_id) == (4, 89000 * 4, taker)
+    assert balance(taker) == (1004, 1e9 - 89000 * 4)
+    assert balance(maker) == (1000, 1e9 + 89000 * 4)
+
+
+def test_settle_fill_of_the_rest_fills_the_offer(app):
+    maker, taker = user("maker"), user("taker")
+    offer_id = resting(maker, "LBP", 89000 * 2, 89000)
+    db.session.commit()
+
+    offer = db.session.get(Offer, offer_id)
+    balances = trading.lock_balances({maker, taker})
+    trading.settle_fill(offer, 89000 * 2, taker, balances[taker], balances[maker], "maker", "taker")
+    db.session.commit()
+
+    assert offer.status == "FILLED" and offer.amount_remaining == 0
+    assert balance(taker) == (998, 1e9 + 89000 * 2)
+    assert balance(maker) == (1002, 1e9)
+
+
+def test_fok_rollback_undoes_fills(app):
+    # a FOK offer the book can't fill aborts, the rollback takes the partial fills with it
+    maker, taker = user("maker"), user("taker")
+    offer_id = resting(maker, "USD", 5, 89000)
+    db.session.commit()
+
+    offer, fills = incoming(taker, "LBP", 89000 * 8, 89000)
+    assert len(fills) == 1 and offer.amount_remaining > 0
+    db.session.rollback()
+
+    assert db.session.get(Offer, offer_id).status == "OPEN"
+    assert db.session.get(Offer, offer_id).amount_remaining == 5
+    assert Offer.query.count() == 1
+    assert Trade.query.count() == 0
+    assert balance(taker) == (1000, 1e9)
+    assert balance(maker) == (1000, 1e9)
+
+
+def test_ioc_leaves_only_the_unfilled_rest(app):
+    # IOC refunds what's left on the incoming offer after matching, which must be the unfilled part
+    maker, taker = user("maker"), user("taker")
+    resting(maker, "USD", 5, 89000)
+    db.session.commit()
+
+    offer, fills = incoming(taker, "LBP", 89000 * 8, 89000)
+    assert len(fills) == 1
+    assert offer.status == "PARTIAL"
+    assert offer.amount_remaining == pytest.approx(89000 * 3)
+
+
+def test_sweep_offers_fills_across_levels(app):
+    maker, taker = user("maker"), user("taker")
+    first = resting(maker, "USD", 5, 89000)
+    second = resting(maker, "USD", 5, 89500)
+    resting(maker, "USD", 5, 91000)
+    db.session.commit()
+
+    results, unfilled = trading.sweep_offers(taker, "buy", 12, worst_price=90000)
+    db.session.commit()
+
+    assert [o.id for o, _, _ in results] == [first, second]
+    assert unfilled == pytest.approx(2)
+    assert balance(taker) == pytest.approx((1010, 1e9 - 89000 * 5 - 89500 * 5))
+
+
+def test_sweep_offers_insufficient_balance(app):
+    maker, taker = user("maker"), user("taker", lbp=1000)
+    offer_id = resting(maker, "USD", 5, 89000)
+    db.session.commit()
+
+    with pytest.raises(HTTPException) as raised:
+        trading.sweep_offers(taker, "buy", 5)
+    assert raised.value.code == 400
+    db.session.rollback()
+    assert db.session.get(Offer, offer_id).amount_remaining == 5
+
+
+def test_batch_accept_partial_mode_skips_invalid_legs(app):
+    maker, taker = user("maker"), user("taker")
+    good = resting(maker, "USD", 5, 89000)
+    small = resting(maker, "USD", 1, 89000)
+    own = resting(taker, "USD", 5, 89000)
+    db.session.commit()
+
+    results = trading.batch_accept(taker, [(good, 2), (small, 3), (own, 1), (999, 1)], all_or_nothing=False)
+    db.session.commit()
+
+    assert [r["error"] is None for r in results] == [True, False, False, False]
+    assert "exceeds remaining" in results[1]["error"]
+    assert results[2]["error"] == "Cannot accept your own offer"
+    assert results[3]["error"] == "Offer not found"
+    assert db.session.get(Offer, good).amount_remaining == 3
+    assert db.session.get(Offer, small).amount_remaining == 1
+    assert balance(taker) == (1002, 1e9 - 89000 * 2)
+
+
+def test_batch_accept_all_or_nothing_aborts(app):
+    maker, taker = user("maker"), user("taker")
+    good = resting(maker, "USD", 5, 89000)
+    db.session.commit()
+
+    with pytest.raises(HTTPException) as raised:
+        trading.batch_accept(taker, [(good, 2), (999, 1)])
+    assert raised.value.code == 400
+
+
+def test_release_offers_refunds_what_was_left(app):
+    maker, taker = user("maker"), user("taker")
+    usd_offer = resting(maker, "USD", 10, 89000)
+    lbp_offer = resting(maker, "LBP", 89000 * 3, 89000)
+    db.session.commit()
+    balances = trading.lock_balances({maker, taker})
+    trading.settle_fill(db.session.get(Offer, usd_offer), 4, taker, balances[taker], balances[maker], "maker", "taker")
+    db.session.commit()
+
+    released = trading.release_offers([usd_offer, lbp_offer], "CANCELLED")
+    db.session.commit()
+
+    assert sorted((r.id, r.amount_remaining) for r in released) == [(usd_offer, 6), (lbp_offer, 89000 * 3)]
+    assert balance(maker) == (1006, 1e9 + 89000 * 4 + 89000 * 3)
+    for offer_id in (usd_offer, lbp_offer):
+        offer = db.session.get(Offer, offer_id)
+        assert offer.status == "CANCELLED" and offer.amount_remaining == 0
+
+    # already released offers are skipped, nothing is refunded twice
+    assert trading.release_offers([usd_offer, lbp_offer], "CANCELLED") == []
+    assert balance(maker) == (1006, 1e9 + 89000 * 4 + 89000 * 3)
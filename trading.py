@@ -0,0 +1,491 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+import threading
+from flask import abort, current_app
+from sqlalchemy import bindparam, or_
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+from extensions import db
+from model.offer import Offer
+from model.trade import Trade
+from model.transaction import Transaction
+from model.user import User
+from model.userBalance import UserBalance
+import ledger
+import matching
+
+#shared settlement helpers for accepting, matching and sweeping offers
+#nothing here commits, callers own the db transaction
+
+# GTC good till cancelled, GTD good till expires_at, IOC fill what crosses now and drop the rest,
+# FOK fill entirely now or not at all
+TIME_IN_FORCE = ("GTC", "GTD", "IOC", "FOK")
+
+
+def fill_amounts(offer, amount):
+    """
+    Amounts for filling `amount` (in offer.from_currency) of an offer.
+    Returns usd_amount, lbp_amount, amount_to, usd_to_lbp, direction.
+    """
+    if offer.from_currency == "USD":
+        usd_amount = amount # maker gives USD
+        amount_to = amount * offer.exchange_rate
+        lbp_amount = amount_to # taker gives LBP
+        return usd_amount, lbp_amount, amount_to, False, "buy"
+    amount_to = amount / offer.exchange_rate # maker gives LBP
+    usd_amount = amount_to # taker receives USD
+    lbp_amount = amount # maker gives LBP
+    return usd_amount, lbp_amount, amount_to, True, "sell"
+
+
+def optimistic():
+    # CONCURRENCY_MODE 'optimistic' reads without row locks and relies on the version columns
+    return current_app.config.get("CONCURRENCY_MODE") == "optimistic"
+
+
+def for_update(query):
+    """
+    Lock the selected rows, unless running optimistic where a stale version fails the update instead.
+    """
+    return query if optimistic() else query.with_for_update()
+
+
+class ContentionStats:
+    """
+    Per command counters of attempts, version conflicts and commands that ran out of retries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def record(self, command, event):
+        with self._lock:
+            counters = self._counters.setdefault(command, {"attempts": 0, "conflicts": 0, "exhausted": 0})
+            counters[event] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                command: dict(counters, conflict_rate=counters["conflicts"] / counters["attempts"] if counters["attempts"] else 0.0)
+                for command, counters in self._counters.items()
+            }
+
+
+contention = ContentionStats()
+
+
+def utc_now():
+    # offer times are stored as naive utc
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_expired(offer, now=None):
+    return offer.expires_at is not None and offer.expires_at <= (now or utc_now())
+
+
+def usernames_for(user_ids):
+    users = User.query.filter(User.id.in_(set(user_ids))).all()
+    return {u.id: u.user_name or "Unknown" for u in users}
+
+
+def settle_fill(offer, amount, taker_id, taker_balance, maker_balance, maker_username, taker_username, taker_prepaid=False):
+    """
+    Execute `amount` of a locked resting offer for a taker: adds the Trade and Transaction,
+    moves balances and updates the offer's remaining amount and status.
+    taker_prepaid means the taker's side was already reserved by its own offer.
+    Returns (trade, transaction).
+    """
+    usd_amount, lbp_amount, amount_to, usd_to_lbp, direction = fill_amounts(offer, amount)
+
+    trade = Trade(
+        offer_id=offer.id,
+        maker_id=offer.user_id,
+        taker_id=taker_id,
+        maker_username=maker_username,
+        taker_username=taker_username,
+        amount_from=amount, # amount that taker will get
+        amount_to=amount_to,
+        direction=direction, # specifies if taker was buying or selling usd
+        executed_rate=offer.exchange_rate
+    )
+    db.session.add(trade)
+
+    transaction = Transaction(
+        usd_amount=usd_amount,
+        lbp_amount=lbp_amount,
+        usd_to_lbp=usd_to_lbp,
+        user_id=taker_id # logs the taker
+    )
+    db.session.add(transaction)
+
+    # Update balances: maker's sell currency was subtracted at offer creation,
+    #so here we only credit the maker with the amount to and update the taker balance.
+    if offer.from_currency == "USD":
+        # maker receives LBP, taker gives LBP and receives USD
+        if not taker_prepaid:
+            taker_balance.lbp_amount -= lbp_amount
+            ledger.post(taker_id, "LBP", -lbp_amount, "trade", offer, trade)
+        taker_balance.usd_amount += usd_amount
+        maker_balance.lbp_amount += lbp_amount
+        ledger.post(taker_id, "USD", usd_amount, "trade", offer, trade)
+        ledger.post(offer.user_id, "LBP", lbp_amount, "trade", offer, trade)
+    else:
+        # maker receives USD, taker gives USD and receives LBP
+        if not taker_prepaid:
+            taker_balance.usd_amount -= usd_amount
+            ledger.post(taker_id, "USD", -usd_amount, "trade", offer, trade)
+        taker_balance.lbp_amount += lbp_amount
+        maker_balance.usd_amount += usd_amount
+        ledger.post(taker_id, "LBP", lbp_amount, "trade", offer, trade)
+        ledger.post(offer.user_id, "USD", usd_amount, "trade", offer, trade)
+
+    maker_balance.updated_at = datetime.now(timezone.utc)
+    taker_balance.updated_at = datetime.now(timezone.utc)
+
+    # Update offer remaining amount
+    offer.amount_remaining -= amount
+    if offer.amount_remaining <= matching.EPSILON:
+        offer.amount_remaining = 0
+        offer.status = "FILLED"
+    else:
+        offer.status = "PARTIAL"
+    return trade, transaction
+
+
+def _value_in(unit, from_currency, amount, price):
+    # amount of from_currency at price (LBP per USD) expressed in unit
+    if from_currency == unit:
+        return amount
+    return amount / price if unit == "USD" else amount * price
+
+
+def _candidate_ids(resting_from_currency, exclude_user_id, price_bound, needed, unit, page_size=100):
+    """
+    Ids of resting offers selling resting_from_currency, best price first.
+    price_bound is the taker's limit (None for market): LBP sellers must pay at least it,
+    USD sellers must ask at most it. Pages through the book until the offers' remaining amounts,
+    valued in unit, cover needed, so a large FOK/IOC order or sweep sees all the liquidity it needs.
+    """
+    query = Offer.query.filter(
+        Offer.from_currency == resting_from_currency,
+        Offer.status.in_(["OPEN", "PARTIAL"]),
+        Offer.amount_remaining > 0,
+        Offer.user_id != exclude_user_id,
+        # GTD offers past expiry don't trade even before the sweeper gets to them
+        or_(Offer.expires_at.is_(None), Offer.expires_at > utc_now())
+    )
+    if resting_from_currency == "LBP":
+        if price_bound is not None:
+            query = query.filter(Offer.exchange_rate >= price_bound)
+        query = query.order_by(Offer.exchange_rate.desc(), Offer.created_at, Offer.id)
+    else:
+        if price_bound is not None:
+            query = query.filter(Offer.exchange_rate <= price_bound)
+        query = query.order_by(Offer.exchange_rate.asc(), Offer.created_at, Offer.id)
+    query = query.with_entities(Offer.id, Offer.exchange_rate, Offer.amount_remaining)
+
+    ids, covered = [], 0.0
+    while True:
+        page = query.offset(len(ids)).limit(page_size).all()
+        for row in page:
+            ids.append(row.id)
+            covered += _value_in(unit, resting_from_currency, row.amount_remaining, row.exchange_rate)
+        if len(page) < page_size or covered >= needed:
+            return ids
+
+
+def _lock_offers(offer_ids):
+    # one statement, ascending id order so concurrent writers can't deadlock each other
+    return for_update(db.session.query(Offer).filter(
+        Offer.id.in_(offer_ids)
+    ).order_by(Offer.id)).all()
+
+
+def lock_balances(user_ids):
+    """
+    Lock balances in one statement, ascending id order, keyed by user id.
+    Every writer locks its offers first and then all the balances it needs with one call here,
+    that single global order is what keeps concurrent trades from deadlocking.
+    """
+    return {
+        b.user_id: b for b in for_update(db.session.query(UserBalance).filter(
+            UserBalance.user_id.in_(user_ids)
+        ).order_by(UserBalance.id)).all()
+    }
+
+
+def _resting_order(offer):
+    return matching.RestingOrder(offer.id, offer.user_id, offer.from_currency, offer.exchange_rate, offer.amount_remaining, offer.created_at)
+
+
+def lock_for_incoming(user_id, from_currency, to_currency, amount, limit_price):
+    """
+    Lock everything a new offer may trade against, in the global order: the crossing resting
+    offers (enough of the book to cover amount), then the taker's and their owners' balances
+    in one statement. Returns (resting_offers, balances keyed by user id).
+    """
+    candidate_ids = _candidate_ids(to_currency, user_id, limit_price, amount, from_currency)
+    resting = _lock_offers(candidate_ids) if candidate_ids else []
+    balances = lock_balances({o.user_id for o in resting} | {user_id})
+    return resting, balances
+
+
+def match_incoming_offer(offer, taker_balance, resting, balances):
+    """
+    Match a new offer, already flushed with its funds reserved, against crossing resting offers
+    in price-time priority. resting and balances come from lock_for_incoming.
+    Returns a list of (resting_offer, trade, transaction), one per fill.
+    """
+    if not resting:
+        return []
+    resting_by_id = {o.id: o for o in resting}
+
+    fills, _ = matching.match_order(
+        offer.user_id,
+        offer.from_currency,
+        offer.amount_remaining,
+        offer.exchange_rate,
+        [
+            _resting_order(o) for o in resting if o.status in ("OPEN", "PARTIAL")
+        ]
+    )
+    if not fills:
+        return []
+
+    maker_ids = {resting_by_id[f.resting_id].user_id for f in fills}
+    usernames = usernames_for(maker_ids | {offer.user_id})
+
+    results = []
+    for fill in fills:
+        resting_offer = resting_by_id[fill.resting_id]
+        maker_balance = balances.get(resting_offer.user_id)
+        if not maker_balance:
+            # no balance row to credit, leave this offer alone
+            continue
+        trade, transaction = settle_fill(
+            resting_offer,
+            fill.resting_consumed,
+            offer.user_id,
+            taker_balance,
+            maker_balance,
+            usernames.get(resting_offer.user_id, "Unknown"),
+            usernames.get(offer.user_id, "Unknown"),
+            taker_prepaid=True
+        )
+        # the incoming offer pays out of its own reservation
+        offer.amount_remaining -= fill.incoming_consumed
+        results.append((resting_offer, trade, transaction))
+
+    if offer.amount_remaining <= matching.EPSILON:
+        offer.amount_remaining = 0
+        offer.status = "FILLED"
+    elif results:
+        offer.status = "PARTIAL"
+    return results
+
+
+def sweep_offers(taker_id, direction, usd_quantity, worst_price=None):
+    """
+    Fill up to usd_quantity USD across the best resting offers in one db transaction.
+    direction is 'buy' (taker buys USD from USD sellers) or 'sell' (taker sells USD to LBP sellers).
+    Offers and balances are locked in ascending id order before anything is filled.
+    Returns (results, usd_unfilled) where results is a list of (offer, trade, transaction).
+    Aborts with 400 when the taker can't pay for the planned fills.
+    """
+    resting_from_currency = "USD" if direction == "buy" else "LBP"
+    taker_gives = "LBP" if direction == "buy" else "USD"
+
+    candidate_ids = _candidate_ids(resting_from_currency, taker_id, worst_price, usd_quantity, "USD")
+    resting = _lock_offers(candidate_ids) if candidate_ids else []
+    resting_by_id = {o.id: o for o in resting}
+
+    fills, usd_unfilled = matching.plan_sweep(
+        taker_id,
+        taker_gives,
+        usd_quantity,
+        worst_price,
+        [_resting_order(o) for o in resting if o.status in ("OPEN", "PARTIAL")]
+    )
+
+    maker_ids = {resting_by_id[f.resting_id].user_id for f in fills}
+    balances = lock_balances(maker_ids | {taker_id})
+    taker_balance = balances.get(taker_id)
+    if not taker_balance:
+        abort(400, "Taker balance not found")
+
+    if taker_gives == "LBP":
+        required = sum(f.lbp_amount for f in fills)
+        if taker_balance.lbp_amount < required:
+            abort(400, f"Insufficient LBP balance. Required: {required}, Available: {taker_balance.lbp_amount}")
+    else:
+        required = sum(f.usd_amount for f in fills)
+        if taker_balance.usd_amount < required:
+            abort(400, f"Insufficient USD balance. Required: {required}, Available: {taker_balance.usd_amount}")
+
+    usernames = usernames_for(maker_ids | {taker_id})
+    results = []
+    for fill in fills:
+        offer = resting_by_id[fill.resting_id]
+        maker_balance = balances.get(offer.user_id)
+        if not maker_balance:
+            abort(400, f"Maker balance not found for offer {offer.id}")
+        trade, transaction = settle_fill(
+            offer,
+            fill.resting_consumed,
+            taker_id,
+            taker_balance,
+            maker_balance,
+            usernames.get(offer.user_id, "Unknown"),
+            usernames.get(taker_id, "Unknown")
+        )
+        results.append((offer, trade, transaction))
+    return results, usd_unfilled
+
+
+def batch_accept(taker_id, legs, all_or_nothing=True):
+    """
+    Accept several offers for one taker in a single db transaction.
+    legs is a list of (offer_id, amount) with amount in the offer's from_currency.
+    All offers, then all involved balances, are locked in one statement each in ascending id order.
+    With all_or_nothing any invalid leg aborts the whole batch with 400, otherwise invalid legs are
+    skipped and reported. Returns a list per leg of dicts with offer_id, amount, error, and on
+    success the offer, trade and transaction.
+    """
+    offers = {o.id: o for o in _lock_offers({offer_id for offer_id, _ in legs})}
+    balances = lock_balances({o.user_id for o in offers.values()} | {taker_id})
+    taker_balance = balances.get(taker_id)
+    if not taker_balance:
+        abort(400, "Taker balance not found")
+    usernames = usernames_for({o.user_id for o in offers.values()} | {taker_id})
+
+    results = []
+    for index, (offer_id, amount) in enumerate(legs):
+        offer = offers.get(offer_id)
+        error = None
+        if not offer:
+            error = "Offer not found"
+        elif offer.user_id == taker_id:
+            error = "Cannot accept your own offer"
+        elif offer.status not in ["OPEN", "PARTIAL"]:
+            error = f"Offer is not available (status={offer.status})"
+        elif is_expired(offer):
+            error = "Offer has expired"
+        elif amount > offer.amount_remaining:
+            error = f"Requested amount exceeds remaining offer ({offer.amount_remaining})"
+        elif offer.user_id not in balances:
+            error = "Maker balance not found"
+        else:
+            # balance is checked against what earlier legs already spent
+            usd_amount, lbp_amount, _, usd_to_lbp, _ = fill_amounts(offer, amount)
+            if usd_to_lbp and taker_balance.usd_amount < usd_amount:
+                error = f"Insufficient USD balance. Required: {usd_amount}, Available: {taker_balance.usd_amount}"
+            elif not usd_to_lbp and taker_balance.lbp_amount < lbp_amount:
+                error = f"Insufficient LBP balance. Required: {lbp_amount}, Available: {taker_balance.lbp_amount}"
+
+        if error:
+            if all_or_nothing:
+                abort(400, f"Leg {index} (offer {offer_id}): {error}")
+            results.append({"offer_id": offer_id, "amount": amount, "error": error})
+            continue
+
+        trade, transaction = settle_fill(
+            offer,
+            amount,
+            taker_id,
+            taker_balance,
+            balances[offer.user_id],
+            usernames.get(offer.user_id, "Unknown"),
+            usernames.get(taker_id, "Unknown")
+        )
+        results.append({
+            "offer_id": offer_id,
+            "amount": amount,
+            "error": None,
+            "offer": offer,
+            "trade": trade,
+            "transaction": transaction
+        })
+    return results
+
+
+def release_offers(offer_ids, status):
+    """
+    Take resting offers off the market in bulk: sets status and zeroes amount_remaining with one
+    UPDATE and refunds what was left to each owner with one executemany UPDATE on user_balance.
+    Offers no longer OPEN/PARTIAL are skipped. Returns the released (id, user_id, from_currency, refund) rows.
+    """
+    if not offer_ids:
+        return []
+    # lock offers then balances in ascending id order, same as the trade paths
+    released = for_update(db.session.query(
+        Offer.id, Offer.user_id, Offer.from_currency, Offer.amount_remaining, Offer.version
+    ).filter(
+        Offer.id.in_(offer_ids),
+        Offer.status.in_(["OPEN", "PARTIAL"])
+    ).order_by(Offer.id)).all()
+    if not released:
+        return []
+
+    refunds = defaultdict(lambda: {"usd": 0.0, "lbp": 0.0})
+    for row in released:
+        refunds[row.user_id]["usd" if row.from_currency == "USD" else "lbp"] += row.amount_remaining
+
+    for_update(db.session.query(UserBalance.id).filter(
+        UserBalance.user_id.in_(refunds.keys())
+    ).order_by(UserBalance.id)).all()
+
+    # conditional on the version read above so it's also safe without locks: an offer that
+    # changed since the select isn't updated and the whole release is retried
+    offers = Offer.__table__
+    updated = db.session.execute(
+        offers.update().where(
+            offers.c.id == bindparam("offer_id"),
+            offers.c.version == bindparam("offer_version")
+        ).values(status=status, amount_remaining=0, version=offers.c.version + 1),
+        [{"offer_id": row.id, "offer_version": row.version} for row in released]
+    ).rowcount
+    if updated != len(released):
+        raise StaleDataError(f"{len(released) - updated} offer(s) changed while being released")
+
+    # refunds are increments so they don't need the version check, only bump it
+    balances = UserBalance.__table__
+    db.session.execute(
+        balances.update().where(balances.c.user_id == bindparam("refund_user_id")).values(
+            usd_amount=balances.c.usd_amount + bindparam("refund_usd"),
+            lbp_amount=balances.c.lbp_amount + bindparam("refund_lbp"),
+            updated_at=datetime.now(timezone.utc),
+            version=balances.c.version + 1
+        ),
+        [
+            {"refund_user_id": user_id, "refund_usd": amounts["usd"], "refund_lbp": amounts["lbp"]}
+            for user_id, amounts in sorted(refunds.items())
+        ]
+    )
+    ledger.post_many([
+        (row.user_id, row.from_currency, row.amount_remaining, "offer_refund", row.id) for row in released
+    ])
+    # objects loaded earlier in this session no longer match the rows
+    versions = {row.id: row.version for row in released}
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, UserBalance) and obj.user_id in refunds:
+            db.session.expire(obj)
+        elif isinstance(obj, Offer) and obj.id in versions:
+            # set in place rather than expired, the offer may already be handed to a caller
+            set_committed_value(obj, "status", status)
+            set_committed_value(obj, "amount_remaining", 0)
+            set_committed_value(obj, "version", versions[obj.id] + 1)
+    return released
+
+
+def expire_due_offers(now=None, batch_size=1000):
+    """
+    Release up to batch_size GTD offers whose expires_at has passed as EXPIRED. Nothing is committed.
+    Returns the released rows, see release_offers.
+    """
+    now = now or utc_now()
+    due_ids = [row.id for row in db.session.query(Offer.id).filter(
+        Offer.status.in_(["OPEN", "PARTIAL"]),
+        Offer.expires_at <= now
+    ).order_by(Offer.id).limit(batch_size)]
+    return release_offers(due_ids, "EXPIRED")
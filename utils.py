@@ -1,20 +1,14 @@
 # --- Notification helper ---
-from model.notifications import Notification
+from notificationOutbox import queue_notification
 
 def create_notification(user_id, message, type_):
     """
-    Create and commit a notification entry for a user.
+    Queue a notification for a user in the session's outbox. It is written, together with
+    every other queued notification, by the caller's next commit.
     type_: e.g. 'alert', 'offer', 'trade', etc.
     """
-    notification = Notification(
-        user_id=user_id,
-        message=message,
-        type=type_
-    )
-    from extensions import db
-    db.session.add(notification)
-    db.session.commit()
-from model.audit_log import AuditLog, AuditActionType
+    queue_notification(user_id, message, type_)
+from model.audit_log import AuditActionType
 from flask import request
 from flask import abort
 
@@ -111,33 +105,109 @@ def extract_timestamps_and_rates(transactions, key_func):
         return timestamps, weighted_rates
 
 
-def get_current_exchange_rates():
-    threeDays = timedelta(days=3)
-    currentTime = datetime.now(timezone.utc)
-    threeDaysAgo = currentTime - threeDays
-
-    #get transactions by time
-    usd_to_lbp_transactions, lbp_to_usd_transactions = get_transactions_by_date(
-        threeDaysAgo, 
-        currentTime
-    )
+def truncate_date(column, unit):
+    """
+    SQL expression that floors a datetime column to its minute, hour or day.
+    Returns an ISO formatted string on both MySQL and SQLite so callers can parse it back.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        formats = {"minute": "%Y-%m-%d %H:%M:00", "hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d"}
+        return db.func.strftime(formats[unit], column)
+    if dialect == "mysql":
+        # mysql uses %i for minutes
+        formats = {"minute": "%Y-%m-%d %H:%i:00", "hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d"}
+        return db.func.date_format(column, formats[unit])
+    return db.func.date_trunc(unit, column)
+
+
+def get_bucketed_rates(startDate, endDate, interval):
+    """
+    Single GROUP BY over transactions: weighted average rate per (bucket, direction).
+    interval is 'hour' or 'day'. Returns ((usd_timestamps, usd_rates), (lbp_timestamps, lbp_rates)).
+    """
+    #adding a day to support same day ops
+    endDate = endDate + timedelta(days=1)
+    bucket = truncate_date(Transaction.added_date, interval)
+
+    rows = db.session.query(
+        bucket.label("bucket"),
+        Transaction.usd_to_lbp,
+        db.func.sum(Transaction.lbp_amount),
+        db.func.sum(Transaction.usd_amount),
+        db.func.count(Transaction.id)
+    ).filter(
+        Transaction.added_date >= startDate,
+        Transaction.added_date < endDate
+    ).group_by(
+        bucket, Transaction.usd_to_lbp
+    ).order_by(bucket).all()
 
-    # get rates of transactions
-    usd_to_lbp_rates_weighted, lbp_to_usd_rates_weighted = get_transaction_rates_weighted(
-        usd_to_lbp_transactions,
-        lbp_to_usd_transactions
-    )
+    series = {True: ([], []), False: ([], [])}
+    for ts, usd_to_lbp, lbp_sum, usd_sum, count in rows:
+        timestamps, rates = series[bool(usd_to_lbp)]
+        timestamps.append(str(ts))
+        # sum(rate * usd) / sum(usd) == sum(lbp) / sum(usd)
+        rates.append(lbp_sum / usd_sum if usd_sum else None)
+    return series[True], series[False]
 
-    # final rate of each direction
-    avg_weighted_usd_to_lbp_rate = get_weighted_avg_rate(usd_to_lbp_rates_weighted)
-    avg_weighted_lbp_to_usd_rate = get_weighted_avg_rate(lbp_to_usd_rates_weighted)
 
-    print(f"current rates: USD to LBP: {avg_weighted_usd_to_lbp_rate}, LBP to USD: {avg_weighted_lbp_to_usd_rate}")
+def get_current_exchange_rates():
+    # reads the rolling window kept by the rate engine instead of rescanning three days of transactions
+    from rateEngine import rate_engine
+    rates = rate_engine.current_rates()
+
+    print(f"current rates: USD to LBP: {rates['usd_to_lbp']}, LBP to USD: {rates['lbp_to_usd']}")
     return {
-        "usd_to_lbp": avg_weighted_usd_to_lbp_rate,
-        "lbp_to_usd": avg_weighted_lbp_to_usd_rate
+        "usd_to_lbp": rates["usd_to_lbp"],
+        "lbp_to_usd": rates["lbp_to_usd"]
     }
 
+
+def record_committed_transaction(transaction):
+    """
+    Call after a Transaction has been committed so in-memory consumers stay current.
+    """
+    from rateEngine import rate_engine
+    from rateCache import rate_cache
+    from candles import record_transaction_in_candles
+    # rollups are folded in by the candle flush job, outside the trade's transaction
+    record_transaction_in_candles(transaction)
+    rate_engine.add(
+        transaction.added_date,
+        transaction.usd_amount,
+        transaction.lbp_amount,
+        transaction.usd_to_lbp,
+        transaction.id
+    )
+    # cached rate responses no longer reflect the data
+    rate_cache.invalidate()
+    publish_current_rates()
+
+
+def publish_current_rates():
+    # computed once here and fanned out to every connected stream client
+    from broadcaster import market_broadcaster
+    if market_broadcaster.subscriber_count() == 0:
+        return
+    from rateEngine import rate_engine
+    rates = rate_engine.current_rates()
+    market_broadcaster.publish("rates", {
+        "usd_to_lbp": rates["usd_to_lbp"],
+        "lbp_to_usd": rates["lbp_to_usd"]
+    })
+
+
+def record_committed_trade(trade):
+    """
+    Call after a Trade has been committed to push the print to stream clients.
+    """
+    from broadcaster import market_broadcaster
+    from model.trade import TradeSchema
+    market_broadcaster.publish("trade", TradeSchema(
+        only=("id", "offer_id", "amount_from", "amount_to", "executed_rate", "direction", "created_at")
+    ).dump(trade))
+
 def validate_rate_alert_fields(direction, condition, threshold_rate):
     # Validate direction
     allowed_directions = ["BUY_USD", "SELL_USD"]
@@ -156,10 +226,10 @@ def validate_rate_alert_fields(direction, condition, threshold_rate):
 
 def create_audit_log(action_type, description, user_id=None, entity_type=None, entity_id=None, ip_address=None):
     """
-    create and commit an audit log entry.
-    Automatically fills IP address from request context.
+    queue an audit log entry, the audit sink writes it in the background (no commit here).
     """
-    log = AuditLog(
+    from auditSink import audit_sink
+    audit_sink.emit(
         action_type=action_type,
         description=description,
         user_id=user_id,
@@ -167,9 +237,15 @@ def create_audit_log(action_type, description, user_id=None, entity_type=None, e
         entity_id=entity_id,
         ip_address=ip_address
     )
-    from extensions import db
-    db.session.add(log)
-    db.session.commit()
+
+
+def add_audit_logs(entries):
+    """
+    Queue several audit log entries at once.
+    entries: list of dicts with the create_audit_log arguments.
+    """
+    from auditSink import audit_sink
+    audit_sink.emit_many(entries)
 
 
 def log_preference_change(actor_user_id, actor_role, target_user_id, prefs, ip_address=None):